@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401 - registers the Vote receivers
+
+        # SQLite loses the search triggers whenever a migration rebuilds a table (api/search.py)
+        from django.db.models.signals import post_migrate
+        from .search import reinstall_after_migrate
+        post_migrate.connect(reinstall_after_migrate, sender=self)
+
+        from django.conf import settings
+        if settings.LEADERBOARD_REFRESH_IN_PROCESS:
+            # Only enable this for web processes; management commands would start one too
+            from .leaderboard import start_background_refresher
+            start_background_refresher()
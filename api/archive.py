@@ -0,0 +1,105 @@
+"""
+Vote compaction: moves votes older than VOTE_ARCHIVE_AFTER_DAYS from Vote to ArchivedVote.
+
+Only recent votes are ever scanned by time (the karma ledger and its boundary hour look
+at KARMA_LEDGER_RETENTION_HOURS at most), so old rows only grow Vote's indexes. Moving
+them keeps Vote, and its created_at and (content_type, object_id) indexes, proportional
+to recent activity.
+
+What keeps working:
+  - counts: likes_count is a stored counter and doesn't change. ArchivedVoteTotal holds
+    the archived likes per object, which reconcile_counters adds to the live Vote count;
+  - uniqueness: votes.like() refuses a like the archive already has, and un-liking an
+    archived vote deletes it from the archive (api/votes.py);
+  - user_has_liked: likes.liked_ids() reads both tables.
+
+The job runs in batches of VOTE_ARCHIVE_BATCH_SIZE, oldest first, one short transaction
+each (copy, delete, bump totals), so locks are held per batch and never for the whole
+run. Run one compaction at a time.
+"""
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Vote, ArchivedVote, ArchivedVoteTotal
+
+
+def default_cutoff(now=None):
+    return (now or timezone.now()) - timedelta(days=settings.VOTE_ARCHIVE_AFTER_DAYS)
+
+
+def compact(before=None, batch_size=None, pause=0, progress=None):
+    """
+    Archive every vote created before `before` (default: VOTE_ARCHIVE_AFTER_DAYS ago).
+    `progress(moved, elapsed)` is called after each batch; `pause` seconds are slept
+    between batches to leave room for other writers. Returns (rows moved, seconds).
+    """
+    before = before or default_cutoff()
+    retention = timezone.now() - timedelta(hours=settings.KARMA_LEDGER_RETENTION_HOURS)
+    if before > retention:
+        raise ValueError("Votes inside the karma ledger's retention period can't be archived")
+    batch_size = batch_size or settings.VOTE_ARCHIVE_BATCH_SIZE
+
+    moved = 0
+    start = time.perf_counter()
+    while True:
+        with transaction.atomic():
+            # Oldest first on the created_at index; moved rows are gone, so no cursor is needed
+            rows = list(
+                Vote.objects.select_for_update().filter(created_at__lt=before).order_by('created_at', 'pk')
+                .values_list('pk', 'user_id', 'content_type_id', 'object_id', 'value', 'created_at')[:batch_size]
+            )
+            if not rows:
+                break
+            ArchivedVote.objects.bulk_create([
+                ArchivedVote(pk=pk, user_id=user_id, content_type_id=ct_id, object_id=object_id, value=value, created_at=created_at)
+                for pk, user_id, ct_id, object_id, value, created_at in rows
+            ])
+            # One DELETE, no per-row post_delete: nothing was un-liked, counters stay as they are
+            Vote.objects.filter(pk__in=[row[0] for row in rows])._raw_delete(Vote.objects.db)
+            add_to_totals(Counter((ct_id, object_id) for _, _, ct_id, object_id, _, _ in rows))
+        moved += len(rows)
+        if progress:
+            progress(moved, time.perf_counter() - start)
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved, time.perf_counter() - start
+
+
+def add_to_totals(counts):
+    """Add {(content_type_id, object_id): n} to ArchivedVoteTotal."""
+    by_ct = defaultdict(dict)
+    for (ct_id, object_id), n in counts.items():
+        by_ct[ct_id][object_id] = n
+    for ct_id, objects in by_ct.items():
+        existing = {
+            total.object_id: total
+            for total in ArchivedVoteTotal.objects.select_for_update().filter(content_type_id=ct_id, object_id__in=objects)
+        }
+        for object_id, total in existing.items():
+            total.count += objects[object_id]
+        ArchivedVoteTotal.objects.bulk_update(existing.values(), ['count'])
+        ArchivedVoteTotal.objects.bulk_create([
+            ArchivedVoteTotal(content_type_id=ct_id, object_id=object_id, count=n)
+            for object_id, n in objects.items() if object_id not in existing
+        ])
+
+
+def remove_from_totals(pairs):
+    """One archived vote less for each (content_type_id, object_id) in `pairs`."""
+    for (ct_id, object_id), n in Counter(pairs).items():
+        ArchivedVoteTotal.objects.filter(content_type_id=ct_id, object_id=object_id).update(count=F('count') - n)
+
+
+def archived_totals(ct, object_ids):
+    """{object_id: archived likes} for `object_ids` of content type `ct`."""
+    return dict(
+        ArchivedVoteTotal.objects.filter(content_type=ct, object_id__in=object_ids).values_list('object_id', 'count')
+    )
@@ -0,0 +1,148 @@
+"""
+Async versions of the hot read endpoints (feed, post detail, leaderboard), served under
+/api/async/ and meant for the ASGI serving mode (see DEPLOY.md).
+
+Under ASGI a request that is waiting on a slow client does not hold a worker thread, so
+one process can keep many concurrent connections open. DRF views are sync only, so these
+are plain Django async views reusing the DRF parts that don't touch the database
+(serializers, KeysetPagination, the authentication classes) and returning the same JSON
+as the sync endpoints.
+
+Single queries go through the async ORM. Helpers that run several queries (the comment
+tree cache, the karma ledger, DRF authentication with its password check) are run as one
+sync_to_async call each - the async ORM hops to the same thread for every query anyway,
+so one hop per helper is cheaper than one per query.
+
+Validators (ETag, Last-Modified, 304s) are the same as the sync endpoints' (api/conditional.py),
+and so is replica routing (api/routing.py).
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.http import HttpResponse
+from django.views.decorators.http import require_safe
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import conditional, counters, fieldsets, likes, routing, threads, tree
+from .models import Post, Comment
+from .pagination import KeysetPagination
+from .serializers import PostSerializer, PostDetailSerializer, LeaderboardEntrySerializer
+from .views import feed_ordering, leaderboard_page, post_queryset, thread_page_link, wants
+
+
+def json_response(data, status=200, headers=None):
+    # Same bytes as DRF's JSONRenderer produces for the sync views
+    return HttpResponse(JSONRenderer().render(data), status=status, headers=headers, content_type='application/json')
+
+
+def error_response(exc):
+    # Like DRF's exception handler: field errors as they are, anything else under 'detail'
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(data, exc.status_code)
+
+
+async def authenticate(request):
+    """
+    Wrap `request` in a DRF Request and run the configured authentication classes.
+    Returns (drf_request, None), or (None, error_response) if the credentials are invalid.
+    """
+    def run():
+        drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        try:
+            drf_request.user
+        except exceptions.AuthenticationFailed as exc:
+            # Like APIView: 401 with a challenge when the first authenticator has one, else 403
+            challenge = drf_request.authenticators[0].authenticate_header(drf_request) if drf_request.authenticators else None
+            headers = {'WWW-Authenticate': challenge} if challenge else None
+            return None, json_response({'detail': exc.detail}, 401 if challenge else 403, headers)
+        # The querysets below look content types up synchronously; make sure they are cached
+        ContentType.objects.get_for_models(Post, Comment)
+        return drf_request, None
+    return await sync_to_async(run)()
+
+
+async def serializer_context(drf_request, fields):
+    # The viewer's liked post ids may need a query: load them here rather than in the serializer
+    context = {'request': drf_request, 'fields': fields}
+    if wants(fields, 'user_has_liked'):
+        context['liked_post_ids'] = await sync_to_async(likes.liked_ids)(drf_request.user, Post)
+    return context
+
+
+@require_safe
+async def post_list(request):
+    drf_request, error = await authenticate(request)
+    if error:
+        return error
+    with routing.reads_from(await sync_to_async(routing.replica_for)(drf_request.user)):
+        # Validated like the sync feed: page ids first, rows only if the ETag changed
+        paginator = KeysetPagination()
+        try:
+            paginator.ordering = feed_ordering(drf_request.query_params)
+            fields = fieldsets.requested(drf_request.query_params, PostSerializer)
+            queryset = post_queryset(drf_request.user, fields=fields, ordering=paginator.ordering)
+            page_ids = [pk async for pk in paginator.page_queryset(queryset, drf_request).values_list('pk', flat=True)]
+        except exceptions.APIException as exc: # Bad parameters, or an invalid cursor (404)
+            return error_response(exc)
+        etag = await sync_to_async(conditional.feed_etag)(drf_request.user, page_ids)
+        response = conditional.not_modified(request, etag)
+        if response is None:
+            by_id = await queryset.ain_bulk(page_ids)
+            posts = paginator.set_page([by_id[pk] for pk in page_ids if pk in by_id])
+            if wants(fields, 'likes_count'):
+                await counters.aadd_pending_likes(posts) # Viral posts in sharded counter mode
+            data = PostSerializer(posts, many=True, context=await serializer_context(drf_request, fields)).data
+            response = json_response(paginator.get_paginated_response(data).data)
+        return conditional.set_validators(response, etag)
+
+
+@require_safe
+async def post_detail(request, pk):
+    drf_request, error = await authenticate(request)
+    if error:
+        return error
+    with routing.reads_from(await sync_to_async(routing.replica_for)(drf_request.user)):
+        etag = await sync_to_async(conditional.post_etag)(drf_request.user, pk)
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return conditional.set_validators(response, etag)
+
+        try:
+            fields = fieldsets.requested(drf_request.query_params, PostDetailSerializer)
+        except exceptions.APIException as exc:
+            return error_response(exc)
+        post = await post_queryset(drf_request.user, fields=fields).filter(pk=pk).afirst()
+        if post is None:
+            return json_response({'detail': 'No Post matches the given query.'}, 404)
+        if wants(fields, 'likes_count'):
+            await counters.aadd_pending_likes([post])
+
+        if wants(fields, 'comments', 'comments_next', 'has_more_comments'):
+            depth = threads.bounded(drf_request.query_params.get('depth'), None, settings.COMMENT_MAX_DEPTH)
+            comments, has_more = await sync_to_async(threads.post_first_page)(drf_request.user, post.pk, depth)
+            post.rendered_comments = tree.render(comments)
+            if has_more:
+                post.comments_next = thread_page_link(drf_request, 'post-comments', post.pk, comments[-1])
+        data = PostDetailSerializer(post, context=await serializer_context(drf_request, fields)).data
+        return conditional.set_validators(json_response(data), etag)
+
+
+@require_safe
+async def leaderboard(request):
+    drf_request, error = await authenticate(request)
+    if error:
+        return error
+    with routing.reads_from(await sync_to_async(routing.replica_for)(drf_request.user)):
+        try:
+            entries, computed_at = await sync_to_async(leaderboard_page)(drf_request.query_params)
+        except exceptions.APIException as exc:
+            return error_response(exc)
+        etag = conditional.leaderboard_etag(computed_at)
+        response = conditional.not_modified(request, etag, computed_at)
+        if response is None:
+            response = json_response(LeaderboardEntrySerializer(entries, many=True).data)
+        response['X-Computed-At'] = computed_at.isoformat()
+        return conditional.set_validators(response, etag, computed_at, private=False)
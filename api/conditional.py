@@ -0,0 +1,136 @@
+"""
+Conditional GET (ETag / Last-Modified) for the feed, post detail and leaderboard.
+
+Validators are computed from version stamps kept in the cache, so a request whose
+If-None-Match still matches is answered 304 before the page is loaded or anything
+is serialized:
+  - every post has a stamp, bumped when the post row or anything shown with it
+    changes: an edit, a like on it, a comment added or removed;
+  - the detail page adds the post's comment tree version (api/tree_cache.py), which
+    moves with comments and comment likes;
+  - a feed page is identified by the ids on it (one ids-only query on the feed
+    index) plus those posts' stamps, so a like on one post only changes the pages
+    that show it;
+  - a leaderboard window is identified by its snapshot's computed_at.
+
+`user_has_liked` differs per viewer, so the post validators also fold in the
+viewer's id and a per-user stamp bumped on every vote write (likes.update_on_commit):
+two users never share an ETag, and a user's own like changes theirs. Responses are
+marked `Cache-Control: private, no-cache` and vary on Cookie and Authorization, so
+shared caches never serve one user's page to another and browsers revalidate.
+
+Stamps live in the cache with no expiry and start from a random value; if one is
+evicted the next reader starts a new random one, which at worst turns a 304 into a 200.
+Every worker must see every bump, so the feed and post validators need a shared cache:
+with a per-process LocMemCache a like handled by one worker would leave the others
+answering 304 with the old page indefinitely. They are only emitted with POST_ETAGS,
+which is on by default for any other CACHE_BACKEND (feed_etag/post_etag return None).
+The leaderboard's validators come from its snapshot and need no stamps.
+
+Neither are they emitted for responses read from a replica (api/routing.py): the stamp
+is current but the body may lag behind it, and a client holding that ETag would keep
+getting 304s for the stale body until the next write.
+"""
+import hashlib
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import routing, tree_cache
+
+
+def _post_key(post_id):
+    return f'post:{post_id}:version'
+
+
+def _likes_key(user_id):
+    return f'likes:{user_id}:version'
+
+
+def versions(keys):
+    """{key: stamp} for `keys`, starting missing stamps from a random value."""
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, random.getrandbits(48), None)
+            found[key] = cache.get(key)
+    return found
+
+
+def bump(keys):
+    for key in set(keys):
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass # No stamp yet: the next reader starts a fresh one
+
+
+def bump_on_commit(keys):
+    # Now, for the writer's own reads, and after commit, against readers that saw the old rows
+    keys = set(keys)
+    if keys:
+        bump(keys)
+        transaction.on_commit(lambda: bump(keys))
+
+
+def bump_posts(post_ids):
+    bump_on_commit(_post_key(pk) for pk in post_ids)
+
+
+def bump_user_likes(user_ids):
+    bump_on_commit(_likes_key(uid) for uid in user_ids)
+
+
+def make_etag(*parts):
+    return '"{}"'.format(hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()[:32])
+
+
+def viewer(user):
+    if not user.is_authenticated:
+        return 'anonymous'
+    return f'{user.pk}:{versions([_likes_key(user.pk)])[_likes_key(user.pk)]}'
+
+
+def feed_etag(user, post_ids):
+    if not settings.POST_ETAGS or routing.on_replica():
+        return None
+    stamps = versions([_post_key(pk) for pk in post_ids])
+    return make_etag('feed', viewer(user), *(f'{pk}:{stamps[_post_key(pk)]}' for pk in post_ids))
+
+
+def post_etag(user, post_id):
+    if not settings.POST_ETAGS or routing.on_replica():
+        return None
+    key = _post_key(post_id)
+    return make_etag('post', viewer(user), post_id, versions([key])[key], tree_cache.post_version(post_id))
+
+
+def leaderboard_etag(computed_at):
+    # The same for every viewer: the window and limit are in the URL
+    return make_etag('leaderboard', computed_at.isoformat())
+
+
+def not_modified(request, etag, last_modified=None):
+    """A 304 (or 412) response if the request's validators match, else None."""
+    if etag is None and last_modified is None:
+        return None
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+
+
+def set_validators(response, etag, last_modified=None, private=True):
+    if etag is not None:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie', 'Authorization'))
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
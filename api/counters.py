@@ -0,0 +1,211 @@
+"""
+Denormalized like/comment counters.
+
+Post.likes_count, Post.comment_count, Comment.likes_count and Comment.reply_count
+are stored columns, bumped with F() expressions in the same transaction as the
+Vote/Comment write (see signals.py), so reads no longer need a COUNT join.
+
+Posts in sharded mode (Post.like_shards > 0) take their like increments on one of
+several PostLikeShard rows picked at random, so a burst of concurrent likes on a
+viral post spreads over N rows instead of serializing on one. Readers add the
+pending shard totals with add_pending_likes(); reconcile() folds them back.
+"""
+import random
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+from . import archive, conditional, hot
+from .models import Post, Comment, Vote, PostLikeShard
+
+
+def record_vote_changes(changes):
+    """
+    Apply (content_type_id, object_id, created_at, delta) vote changes to the
+    like counters. Deltas for the same object are merged first.
+    """
+    post_ct = ContentType.objects.get_for_model(Post)
+    comment_ct = ContentType.objects.get_for_model(Comment)
+
+    deltas = defaultdict(int)
+    for ct_id, object_id, _, delta in changes:
+        deltas[(ct_id, object_id)] += delta
+
+    # Every touched post's counter mode, in one read without a lock (see _bump_post_likes)
+    post_ids = [object_id for (ct_id, object_id), delta in deltas.items() if delta and ct_id == post_ct.id]
+    shards = dict(Post.objects.filter(pk__in=post_ids).values_list('pk', 'like_shards')) if post_ids else {}
+
+    with transaction.atomic():
+        for (ct_id, object_id), delta in deltas.items():
+            if not delta:
+                continue
+            if ct_id == post_ct.id:
+                _bump_post_likes(object_id, delta, shards.get(object_id))
+            elif ct_id == comment_ct.id:
+                Comment.objects.filter(pk=object_id).update(likes_count=F('likes_count') + delta)
+        hot.update(object_id for (ct_id, object_id), delta in deltas.items() if delta and ct_id == post_ct.id)
+
+
+def _bump_post_likes(post_id, delta, shards):
+    # `shards` is read beforehand, without a lock: an UPDATE filtered on like_shards=0 still
+    # locks the row it scans on InnoDB, which would serialize a viral post's likes on it again
+    if shards == 0:
+        if Post.objects.filter(pk=post_id, like_shards=0).update(likes_count=F('likes_count') + delta):
+            return
+        # Switched to sharded meanwhile
+        shards = Post.objects.filter(pk=post_id).values_list('like_shards', flat=True).first()
+    if not shards:
+        return # Post is gone
+    shard = random.randrange(shards)
+    rows = PostLikeShard.objects.filter(post_id=post_id, shard=shard)
+    if rows.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            PostLikeShard.objects.create(post_id=post_id, shard=shard, count=delta)
+    except IntegrityError:
+        rows.update(count=F('count') + delta)
+
+
+def record_comment_change(post_id, parent_id, delta):
+    Post.objects.filter(pk=post_id).update(comment_count=F('comment_count') + delta)
+    hot.update([post_id])
+    if parent_id:
+        Comment.objects.filter(pk=parent_id).update(reply_count=F('reply_count') + delta)
+
+
+def add_pending_likes(posts):
+    """
+    Add not-yet-folded shard increments to `likes_count` of already loaded posts.
+    Costs one query, and only when at least one of the posts is sharded.
+    """
+    sharded = {p.pk: p for p in posts if p.like_shards}
+    if not sharded:
+        return
+    pending = PostLikeShard.objects.filter(post_id__in=list(sharded)).values('post').annotate(total=Sum('count'))
+    for row in pending:
+        sharded[row['post']].likes_count += row['total']
+
+
+async def aadd_pending_likes(posts):
+    """add_pending_likes() for the async views."""
+    sharded = {p.pk: p for p in posts if p.like_shards}
+    if not sharded:
+        return
+    pending = PostLikeShard.objects.filter(post_id__in=list(sharded)).values('post').annotate(total=Sum('count'))
+    async for row in pending:
+        sharded[row['post']].likes_count += row['total']
+
+
+def set_sharding(post_id, shards):
+    """Switch a post into (shards > 0) or out of (shards == 0) sharded counter mode."""
+    with transaction.atomic():
+        fold_shards([post_id])
+        Post.objects.filter(pk=post_id).update(like_shards=shards)
+        hot.update([post_id])
+
+
+def fold_shards(post_ids=None):
+    """Move pending shard increments into Post.likes_count."""
+    with transaction.atomic():
+        rows = PostLikeShard.objects.select_for_update()
+        if post_ids is not None:
+            rows = rows.filter(post_id__in=post_ids)
+        rows = list(rows.values_list('pk', 'post_id', 'count'))
+        totals = defaultdict(int)
+        for _, post_id, count in rows:
+            totals[post_id] += count
+        for post_id, total in totals.items():
+            Post.objects.filter(pk=post_id).update(likes_count=F('likes_count') + total)
+        PostLikeShard.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+        hot.update(totals)
+    return len(totals)
+
+
+def reconcile(fix=False, chunk_size=2000):
+    """
+    Recompute every counter from the Vote and Comment tables.
+
+    Returns a list of (label, pk, stored, actual) for each counter that drifted.
+    With fix=True the stored values are corrected (and pending shards folded). Each
+    chunk of rows is compared and corrected with those rows locked (and, for sharded
+    posts, their shard rows): a concurrent like waits and then applies its F() increment
+    on top of the corrected value, instead of being counted in it and then added again.
+    """
+    if fix:
+        fold_shards()
+
+    post_ct = ContentType.objects.get_for_model(Post)
+    comment_ct = ContentType.objects.get_for_model(Comment)
+
+    drift = []
+    drift += _reconcile_column(
+        Post, 'likes_count', Vote.objects.filter(content_type=post_ct), 'object_id',
+        fix, chunk_size, pending=_pending_likes, archived_ct=post_ct
+    )
+    drift += _reconcile_column(
+        Post, 'comment_count', Comment.objects.all(), 'post_id', fix, chunk_size
+    )
+    drift += _reconcile_column(
+        Comment, 'reply_count', Comment.objects.all(), 'parent_id', fix, chunk_size
+    )
+    drift += _reconcile_column(
+        Comment, 'likes_count', Vote.objects.filter(content_type=comment_ct), 'object_id',
+        fix, chunk_size, archived_ct=comment_ct
+    )
+    return drift
+
+
+def _pending_likes(post_ids, lock=False):
+    """
+    Pending shard totals of `post_ids`. With lock, every shard row of the sharded ones is
+    created (count 0) and locked until the transaction ends: an increment can't land
+    meanwhile, not even on a shard that had no row yet.
+    """
+    rows = PostLikeShard.objects.filter(post_id__in=post_ids)
+    if lock:
+        sharded = Post.objects.filter(pk__in=post_ids, like_shards__gt=0).values_list('pk', 'like_shards')
+        PostLikeShard.objects.bulk_create([
+            PostLikeShard(post_id=pk, shard=shard, count=0) for pk, shards in sharded for shard in range(shards)
+        ], ignore_conflicts=True)
+        rows = rows.select_for_update()
+    totals = defaultdict(int)
+    for post_id, count in rows.values_list('post_id', 'count'):
+        totals[post_id] += count
+    return totals
+
+
+def _reconcile_column(model, field, source, key, fix, chunk_size, pending=None, archived_ct=None):
+    drift = []
+    last_pk = 0
+    while True:
+        # Walk the counter table in pk order so memory stays bounded
+        ids = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return drift
+        last_pk = ids[-1]
+        with transaction.atomic():
+            # Shard rows first: likes on a sharded post only ever lock those
+            extra = pending(ids, lock=fix) if pending else {}
+            rows = model.objects.filter(pk__in=ids).order_by('pk')
+            chunk = list((rows.select_for_update() if fix else rows).values_list('pk', field))
+            actual = defaultdict(int, source.filter(**{f'{key}__in': ids}).values(key).annotate(
+                n=Count('pk')
+            ).values_list(key, 'n'))
+            if archived_ct is not None:
+                # Likes compacted out of the Vote table (api/archive.py)
+                for pk, n in archive.archived_totals(archived_ct, ids).items():
+                    actual[pk] += n
+            for pk, stored in chunk:
+                stored += extra.get(pk, 0)
+                real = actual.get(pk, 0)
+                if stored != real:
+                    drift.append((f'{model._meta.model_name}.{field}', pk, stored, real))
+                    if fix:
+                        # Pending shards stay pending: store what they don't already add
+                        model.objects.filter(pk=pk).update(**{field: real - extra.get(pk, 0)})
+                        if model is Post:
+                            conditional.bump_posts([pk])
+                            hot.update([pk])
@@ -0,0 +1,47 @@
+"""
+Sparse fieldsets for the post and comment endpoints: ?fields= and ?include=.
+
+    GET /api/posts/?fields=id,content
+    GET /api/posts/?fields=content&include=author,user_has_liked
+
+`?fields=` names plain fields to return. `?include=` names the ones that cost extra work
+to produce (the serializer's Meta.includes: the author join, the viewer's liked ids, a
+post's comment tree). With either parameter a response holds `id` plus the fields of
+both, and the views skip whatever was not asked for: the select_related join and unused
+columns (QuerySet.only()), the liked ids lookup, pending sharded likes, the comment tree.
+
+Without them every field is returned, as before. Only read requests are narrowed: writes
+take and return the full representation.
+"""
+from rest_framework.exceptions import ValidationError
+
+
+def _names(params, param):
+    return [name.strip() for name in params.get(param, '').split(',') if name.strip()]
+
+
+def requested(params, serializer_class):
+    """
+    The field names `params` selects from `serializer_class`, or None for all of them.
+    Raises ValidationError for unknown names.
+    """
+    if 'fields' not in params and 'include' not in params:
+        return None
+    available, includes = serializer_class.Meta.fields, serializer_class.Meta.includes
+    fields, included = _names(params, 'fields'), _names(params, 'include')
+
+    errors = {}
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        errors['fields'] = f"Unknown field(s): {', '.join(unknown)}. Choose from {', '.join(available)}."
+    unknown = [name for name in included if name not in includes]
+    if unknown:
+        errors['include'] = f"Unknown include(s): {', '.join(unknown)}. Choose from {', '.join(includes)}."
+    if errors:
+        raise ValidationError(errors)
+    return frozenset(['id', *fields, *(field for name in included for field in includes[name])])
+
+
+def columns(selected, column_map):
+    """The columns to load (QuerySet.only()) for the `selected` fields, per `column_map`."""
+    return {'id', *(column for name in selected for column in column_map.get(name, ()))}
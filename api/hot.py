@@ -0,0 +1,90 @@
+"""
+"Hot" ranking of the feed (GET /api/posts/?sort=hot).
+
+    hot_score = log10(max(1, likes + HOT_COMMENT_WEIGHT * comments)) + (created_at - EPOCH) / HOT_DECAY_SECONDS
+
+Engagement counts logarithmically and every HOT_DECAY_SECONDS of age cost one order
+of magnitude: a post needs 10x the engagement to outrank one posted that much later.
+That is exponential time decay, written so that "now" is the same constant for every
+post and drops out of the comparison - stored scores never go stale relative to each
+other, and the top-K hot posts are the first K entries of the (-hot_score, -id) index.
+
+Scores are updated with their counters (api/counters.py): one read and one write of
+the touched posts per vote or comment write. Posts in sharded counter mode are skipped there, since
+taking their row lock on every like is what sharding avoids; `refresh_hot_scores`
+(periodically, e.g. every few minutes from cron or with --loop) rescores every post
+from its counters including pending shard increments, and after a change of the
+HOT_* settings.
+"""
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Sum
+
+from .models import Post, PostLikeShard
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def score(likes, comments, created_at):
+    engagement = likes + settings.HOT_COMMENT_WEIGHT * comments
+    return math.log10(max(1, engagement)) + (created_at - EPOCH).total_seconds() / settings.HOT_DECAY_SECONDS
+
+
+def update(post_ids):
+    """Rescore unsharded `post_ids` from their stored counters (call after changing them)."""
+    rows = Post.objects.filter(pk__in=set(post_ids), like_shards=0).values_list(
+        'pk', 'likes_count', 'comment_count', 'created_at'
+    )
+    # One UPDATE however many posts (bulk_vote can touch hundreds)
+    Post.objects.bulk_update(
+        [Post(pk=pk, hot_score=score(likes, comments, created_at)) for pk, likes, comments, created_at in rows],
+        ['hot_score']
+    )
+
+
+def refresh(chunk_size=2000):
+    """Rescore every post, pending shard increments included. Returns the number of changed scores."""
+    pending = defaultdict(int, PostLikeShard.objects.values('post').annotate(total=Sum('count')).values_list('post', 'total'))
+    changed = 0
+    last_pk = 0
+    while True:
+        # Walk the table in pk order so memory stays bounded
+        chunk = list(
+            Post.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'likes_count', 'comment_count', 'created_at', 'hot_score')[:chunk_size]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        stale = [
+            Post(pk=pk, hot_score=new)
+            for pk, likes, comments, created_at, old in chunk
+            if not math.isclose(old, new := score(likes + pending[pk], comments, created_at), rel_tol=0, abs_tol=1e-9)
+        ]
+        Post.objects.bulk_update(stale, ['hot_score'])
+        changed += len(stale)
+    return changed
+
+
+def run_refresher(interval=None, stop=None):
+    """refresh() every `interval` seconds until `stop` (a threading.Event) is set."""
+    interval = interval or settings.HOT_REFRESH_SECONDS
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        started = time.monotonic()
+        try:
+            refresh()
+        except Exception:
+            logger.exception("Hot score refresh failed")
+        finally:
+            close_old_connections()
+        stop.wait(max(0, interval - (time.monotonic() - started)))
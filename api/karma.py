@@ -0,0 +1,211 @@
+"""
+Rolling-window karma ledger.
+
+Karma is still derived from votes (never a single "daily karma" integer), but
+instead of re-aggregating every vote of the last 24h on each leaderboard hit we
+keep per-author, per-hour counters (KarmaBucket) that are bumped whenever a vote
+is added or removed.
+
+Reading the window is then:
+    sum of the full hour buckets inside the window
+  + an exact count over the Vote table for the single, partial boundary hour
+so votes older than the window still drop out exactly, not at hour granularity.
+"""
+import heapq
+import threading
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import Post, Comment, KarmaBucket
+
+POST_LIKE_KARMA = 5
+COMMENT_LIKE_KARMA = 1
+
+BUCKET_SIZE = timedelta(hours=1)
+
+
+def hour_bucket(dt):
+    """Start of the UTC hour `dt` falls into (the key of its KarmaBucket)."""
+    return dt.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def retention_cutoff(now=None):
+    """Start of the oldest hour the ledger keeps; prune_ledger() drops the buckets before it."""
+    return hour_bucket((now or timezone.now()) - timedelta(hours=settings.KARMA_LEDGER_RETENTION_HOURS))
+
+
+def _karma_models():
+    # (model, points per like) - the ledger only cares about who authored the liked object
+    return (
+        (ContentType.objects.get_for_model(Post), Post, POST_LIKE_KARMA),
+        (ContentType.objects.get_for_model(Comment), Comment, COMMENT_LIKE_KARMA),
+    )
+
+
+# (content_type_id, object_id) -> author_id of posts and comments being deleted in this thread.
+# A cascade can delete the liked object before its votes' post_delete signals run, when the
+# author can no longer be looked up.
+_deleting = threading.local()
+
+
+def remember_authors(model, objects):
+    """
+    pre_delete hook: keep the authors of `objects` for record_vote_changes() until the
+    deleting transaction commits.
+    """
+    authors = getattr(_deleting, 'authors', None)
+    if authors is None:
+        authors = _deleting.authors = {}
+    ct_id = ContentType.objects.get_for_model(model).id
+    keys = [(ct_id, obj.pk) for obj in objects]
+    authors.update((key, obj.author_id) for key, obj in zip(keys, objects))
+
+    def forget():
+        for key in keys:
+            authors.pop(key, None)
+    transaction.on_commit(forget)
+
+
+def record_vote_changes(changes):
+    """
+    Apply vote additions/removals to the ledger.
+
+    `changes` is an iterable of (content_type_id, object_id, created_at, delta)
+    where delta is +1 for a new like and -1 for a removed one. The vote's own
+    created_at decides the bucket, so un-liking subtracts from the hour the like
+    was originally counted in. Hours before the retention period are skipped: their
+    buckets are already pruned (un-liking an old, archived like would otherwise
+    leave a negative bucket behind).
+    """
+    changes = list(changes)
+    if not changes:
+        return
+
+    by_ct = defaultdict(list)
+    for ct_id, object_id, created_at, delta in changes:
+        by_ct[ct_id].append((object_id, created_at, delta))
+
+    deltas = defaultdict(int)
+    for ct, model, points in _karma_models():
+        rows = by_ct.get(ct.id)
+        if not rows:
+            continue
+        # One query per model to resolve who gets the karma
+        authors = dict(
+            model.objects.filter(pk__in={object_id for object_id, _, _ in rows})
+            .values_list('pk', 'author_id')
+        )
+        deleting = getattr(_deleting, 'authors', {})
+        for object_id, created_at, delta in rows:
+            author_id = authors.get(object_id, deleting.get((ct.id, object_id)))
+            if author_id is not None:
+                deltas[(author_id, hour_bucket(created_at))] += delta * points
+
+    cutoff = retention_cutoff()
+    with transaction.atomic():
+        for (user_id, hour), delta in deltas.items():
+            if delta and hour >= cutoff:
+                _bump_bucket(user_id, hour, delta)
+
+
+def _bump_bucket(user_id, hour, delta):
+    # UPDATE first: the bucket almost always exists already within the hour
+    bucket = KarmaBucket.objects.filter(user_id=user_id, hour=hour)
+    if bucket.update(score=F('score') + delta):
+        return
+    try:
+        with transaction.atomic():
+            KarmaBucket.objects.create(user_id=user_id, hour=hour, score=delta)
+    except IntegrityError:
+        # Lost the race against a concurrent first vote in this hour
+        bucket.update(score=F('score') + delta)
+
+
+def slow_scores(since, until=None):
+    """
+    Reference implementation: aggregate karma straight from the Vote table.
+
+    Used for the partial boundary hour of the window and by the
+    `karma_ledger --verify` command to check the ledger.
+
+    Joining User -> Posts -> Votes AND User -> Comments -> Votes in a single query
+    creates a Cartesian product and inflates the sums, so posts and comments are
+    aggregated separately and merged in Python.
+    """
+    scores = defaultdict(int)
+    for ct, model, points in _karma_models():
+        # All vote conditions go into one filter() call so they apply to the same join
+        vote_filter = {'votes__content_type': ct, 'votes__created_at__gte': since}
+        if until is not None:
+            vote_filter['votes__created_at__lt'] = until
+        qs = model.objects.filter(**vote_filter)
+        for item in qs.values('author').annotate(score=Count('votes') * points):
+            scores[item['author']] += item['score']
+    return scores
+
+
+def ledger_scores(hours=24, now=None):
+    """Karma per author over the last `hours`, read from the ledger."""
+    now = now or timezone.now()
+    since = now - timedelta(hours=hours)
+    boundary = hour_bucket(since)
+
+    # Full buckets strictly after the boundary hour
+    scores = defaultdict(int, KarmaBucket.objects.filter(
+        hour__gt=boundary
+    ).values('user').annotate(
+        total=Sum('score')
+    ).values_list('user', 'total'))
+
+    # The boundary hour is only partly inside the window - count it exactly
+    for uid, score in slow_scores(since, boundary + BUCKET_SIZE).items():
+        scores[uid] += score
+
+    return scores
+
+
+def top_scores(limit=5, hours=24, now=None):
+    """[(user_id, score), ...] for the `limit` best authors, highest first."""
+    scores = ledger_scores(hours=hours, now=now)
+    return heapq.nlargest(
+        limit,
+        ((uid, score) for uid, score in scores.items() if score > 0),
+        key=lambda item: (item[1], -item[0])
+    )
+
+
+def rebuild_ledger(now=None):
+    """Recompute every bucket inside the retention period from the Vote table."""
+    start = retention_cutoff(now)
+
+    totals = defaultdict(int)
+    for ct, model, points in _karma_models():
+        rows = model.objects.filter(
+            votes__content_type=ct, votes__created_at__gte=start
+        ).annotate(
+            hour=TruncHour('votes__created_at', tzinfo=dt_timezone.utc)
+        ).values('author', 'hour').annotate(likes=Count('votes'))
+        for row in rows:
+            totals[(row['author'], row['hour'])] += row['likes'] * points
+
+    with transaction.atomic():
+        KarmaBucket.objects.filter(hour__gte=start).delete()
+        KarmaBucket.objects.bulk_create(
+            [KarmaBucket(user_id=uid, hour=hour, score=score) for (uid, hour), score in totals.items()],
+            batch_size=1000
+        )
+    return len(totals)
+
+
+def prune_ledger(now=None):
+    """Drop buckets that fell out of the retention period. Returns rows deleted."""
+    cutoff = retention_cutoff(now)
+    deleted, _ = KarmaBucket.objects.filter(hour__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,115 @@
+"""
+Precomputed leaderboard snapshots.
+
+Each window ('1h', '24h', '7d') has one LeaderboardSnapshot row holding its top
+LEADERBOARD_SNAPSHOT_SIZE authors, recomputed from the karma ledger every
+LEADERBOARD_REFRESH_SECONDS by `refresh_leaderboard --loop` or the in-process
+refresher (LEADERBOARD_REFRESH_IN_PROCESS). Requests only read a snapshot: from the
+local cache while it is fresh, otherwise from its row.
+
+If nothing refreshes a window (no refresher running, or the very first request), the
+first reader that finds it stale takes a cache lock and recomputes it; everyone else
+keeps serving the old snapshot meanwhile. Either way the aggregation runs at most
+once per window per cadence, however many clients poll.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import karma, routing
+from .models import LeaderboardSnapshot
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = {'1h': 1, '24h': 24, '7d': 168}
+DEFAULT_WINDOW = '24h'
+LOCK_TIMEOUT = 60 # Seconds before a crashed refresher's lock is ignored
+
+
+def _key(window):
+    return f'leaderboard:{window}'
+
+
+def compute(window, now=None):
+    """Top authors of `window` from the karma ledger: [{'username', 'score'}, ...]."""
+    top = karma.top_scores(limit=settings.LEADERBOARD_SNAPSHOT_SIZE, hours=WINDOWS[window], now=now)
+    users = get_user_model().objects.in_bulk([uid for uid, _ in top])
+    return [
+        {'username': users[uid].username, 'score': score}
+        for uid, score in top if uid in users
+    ]
+
+
+def refresh(windows=None, now=None):
+    """Recompute and store the snapshots of `windows` (default: all). Returns them by window."""
+    snapshots = {}
+    for window in windows or WINDOWS:
+        computed_at = now or timezone.now()
+        with routing.primary(): # Labelled computed_at, so not from a lagging replica
+            snap = {'computed_at': computed_at, 'entries': compute(window, now=computed_at)}
+        LeaderboardSnapshot.objects.update_or_create(window=window, defaults=snap)
+        cache.set(_key(window), snap, settings.LEADERBOARD_REFRESH_SECONDS)
+        snapshots[window] = snap
+    return snapshots
+
+
+def is_stale(snap, now=None):
+    # Twice the cadence: a running refresher always gets there first
+    age = (now or timezone.now()) - snap['computed_at']
+    return age > timedelta(seconds=2 * settings.LEADERBOARD_REFRESH_SECONDS)
+
+
+def snapshot(window):
+    """The current snapshot of `window`: {'computed_at': datetime, 'entries': [...]}."""
+    key = _key(window)
+    snap = cache.get(key)
+    if snap is not None:
+        return snap
+
+    snap = LeaderboardSnapshot.objects.filter(window=window).values('computed_at', 'entries').first()
+    if snap is None or is_stale(snap):
+        if cache.add(f'{key}:lock', 1, LOCK_TIMEOUT):
+            try:
+                return refresh([window])[window]
+            finally:
+                cache.delete(f'{key}:lock')
+        if snap is None:
+            # Cold start while another request computes it: answer without storing
+            return {'computed_at': timezone.now(), 'entries': compute(window)}
+        return snap
+
+    # Cache the row until it would go stale, so most requests don't even read it
+    age = (timezone.now() - snap['computed_at']).total_seconds()
+    cache.set(key, snap, max(1, int(2 * settings.LEADERBOARD_REFRESH_SECONDS - age)))
+    return snap
+
+
+def run_refresher(interval=None, stop=None):
+    """Refresh all windows every `interval` seconds until `stop` (a threading.Event) is set."""
+    interval = interval or settings.LEADERBOARD_REFRESH_SECONDS
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        started = time.monotonic()
+        # With a shared cache, only one of the workers' refreshers runs per cadence
+        if cache.add('leaderboard:refresher', 1, max(1, int(interval) - 1)):
+            try:
+                refresh()
+            except Exception:
+                logger.exception("Leaderboard refresh failed")
+            finally:
+                close_old_connections()
+        stop.wait(max(0, interval - (time.monotonic() - started)))
+
+
+def start_background_refresher():
+    """Run run_refresher() in a daemon thread of this process (see ApiConfig.ready)."""
+    thread = threading.Thread(target=run_refresher, name='leaderboard-refresher', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,251 @@
+"""
+Per-user cache of the post and comment ids a user has liked.
+
+`user_has_liked` used to be an Exists(Vote ...) subquery evaluated for every returned
+row. Instead each viewer's liked ids are loaded once (one query per model) into the
+cache and every row becomes a membership test. Archived likes (api/archive.py) are included.
+
+Ids are stored compactly, whichever is smaller:
+  - a sorted array of 32/64-bit ints, searched with bisect (4-8 bytes per like),
+  - a bitmap over [min id, max id] when the ids are dense (1 bit per id in the range).
+A user with 100k likes costs ~400KB as an array, or ~12KB as a bitmap if those likes
+fall within a 100k id range. Reads copy the bytes in as they are; nothing is decoded id by id.
+
+Entries expire LIKED_IDS_CACHE_TTL seconds after they were loaded, whatever happens to
+them meanwhile. Every vote write updates the voter's cached entries in place once its
+transaction commits (update_on_commit, called from votes.apply_vote_changes): the liked or
+unliked ids are added to / removed from the entry and it is re-encoded, so a user with
+100k likes doesn't reload them all after each vote.
+
+Each entry carries the version stamp its ids were loaded at, and a read only uses an entry
+whose stamp is current. Committed writes bump the stamp (under a short cache lock) and
+patch only an entry that was current just before: anything else is dropped, and with it
+an entry a reader loaded before the write committed but stored after. When the lock
+can't be had, or a write has several voters, the entries are invalidated the same way.
+
+Every worker must see every update, so the cache is only used with a shared cache backend
+(LIKED_IDS_CACHE, on unless the cache is the per-process LocMemCache): without it each
+request loads the viewer's ids from the database.
+"""
+import random
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+
+from . import conditional
+from .models import Post, Comment, Vote, ArchivedVote
+
+LOCK_TIMEOUT = 5 # Seconds before a crashed updater's lock is ignored
+LOCK_WAIT = 1 # Seconds to wait for another update of the same entry before invalidating it
+WAIT_INTERVAL = 0.005
+
+
+class LikedIds:
+    """Read-only set of ids, backed by the compact bytes described above."""
+    __slots__ = ('_ids', '_bits', '_offset')
+
+    def __init__(self, ids=(), _encoded=None):
+        self._ids = self._bits = None
+        self._offset = 0
+        if _encoded is not None:
+            self._decode(_encoded)
+            return
+        ids = sorted(set(ids))
+        if ids and (ids[-1] - ids[0]) // 8 + 1 < len(ids) * 4:
+            self._offset = ids[0]
+            bits = bytearray((ids[-1] - ids[0]) // 8 + 1)
+            for pk in ids:
+                n = pk - self._offset
+                bits[n >> 3] |= 1 << (n & 7)
+            self._bits = bytes(bits)
+        else:
+            self._ids = array('I' if not ids or ids[-1] < 2 ** 32 else 'Q', ids)
+
+    def __contains__(self, pk):
+        if self._bits is not None:
+            n = pk - self._offset
+            return 0 <= n < len(self._bits) * 8 and bool(self._bits[n >> 3] & (1 << (n & 7)))
+        i = bisect_left(self._ids, pk)
+        return i < len(self._ids) and self._ids[i] == pk
+
+    def __len__(self):
+        if self._bits is not None:
+            return sum(bin(byte).count('1') for byte in self._bits)
+        return len(self._ids)
+
+    def __iter__(self):
+        if self._ids is not None:
+            return iter(self._ids)
+        return (self._offset + n for n in range(len(self._bits) * 8) if self._bits[n >> 3] & (1 << (n & 7)))
+
+    def changed(self, added=(), removed=()):
+        """
+        A copy with `added` ids in and `removed` ids out. Bits are flipped / array items
+        inserted and deleted in the existing encoding; ids outside a bitmap's range or too
+        large for the array's item size re-encode the whole set.
+        """
+        if self._bits is not None:
+            if all(0 <= pk - self._offset < len(self._bits) * 8 for pk in added):
+                bits = bytearray(self._bits)
+                for pk in removed:
+                    n = pk - self._offset
+                    if 0 <= n < len(bits) * 8:
+                        bits[n >> 3] &= ~(1 << (n & 7))
+                for pk in added:
+                    n = pk - self._offset
+                    bits[n >> 3] |= 1 << (n & 7)
+                return LikedIds(_encoded=b'B' + self._offset.to_bytes(8, 'little') + bytes(bits))
+        else:
+            ids = array(self._ids.typecode, self._ids)
+            try:
+                for pk in removed:
+                    i = bisect_left(ids, pk)
+                    if i < len(ids) and ids[i] == pk:
+                        del ids[i]
+                for pk in added:
+                    i = bisect_left(ids, pk)
+                    if i == len(ids) or ids[i] != pk:
+                        ids.insert(i, pk)
+            except OverflowError:
+                pass
+            else:
+                return LikedIds(_encoded=ids.typecode.encode() + ids.tobytes())
+        return LikedIds(set(self).union(added).difference(removed))
+
+    def encode(self):
+        if self._bits is not None:
+            return b'B' + self._offset.to_bytes(8, 'little') + self._bits
+        return self._ids.typecode.encode() + self._ids.tobytes()
+
+    @classmethod
+    def decode(cls, data):
+        return cls(_encoded=data)
+
+    def _decode(self, data):
+        kind, payload = data[:1], data[1:]
+        if kind == b'B':
+            self._offset = int.from_bytes(payload[:8], 'little')
+            self._bits = payload[8:]
+        else:
+            self._ids = array(kind.decode())
+            self._ids.frombytes(payload)
+
+
+NOTHING = LikedIds()
+
+
+def _key(user_id, model):
+    return f'likes:{user_id}:{model._meta.model_name}'
+
+
+def _load(user, model):
+    # Vote first: compaction only moves rows from Vote to ArchivedVote, so a row moving
+    # in between is seen (twice, at worst) rather than missed
+    ct = ContentType.objects.get_for_model(model)
+    ids = list(Vote.objects.filter(user=user, content_type=ct).values_list('object_id', flat=True))
+    ids += ArchivedVote.objects.filter(user=user, content_type=ct).values_list('object_id', flat=True)
+    return LikedIds(ids)
+
+
+def liked_ids(user, model):
+    """LikedIds of the `model` (Post or Comment) objects `user` liked."""
+    if not user.is_authenticated:
+        return NOTHING
+    if not settings.LIKED_IDS_CACHE:
+        return _load(user, model)
+    key = _key(user.pk, model)
+    found = cache.get_many([key, f'{key}:version'])
+    version, entry = found.get(f'{key}:version'), found.get(key)
+    if version is None:
+        cache.add(f'{key}:version', random.getrandbits(48), None)
+        version = cache.get(f'{key}:version')
+    elif entry is not None and entry[0] == version:
+        return LikedIds.decode(entry[2])
+
+    # The stamp is read before the rows: a write committing meanwhile bumps it past ours
+    liked = _load(user, model)
+    ttl = settings.LIKED_IDS_CACHE_TTL
+    cache.set(key, (version, time.time() + ttl, liked.encode()), ttl)
+    return liked
+
+
+def _invalidate(key):
+    try:
+        cache.incr(f'{key}:version')
+    except ValueError:
+        pass # No stamp yet: no entry was stored against one
+    cache.delete(key)
+
+
+def invalidate(user_ids):
+    for uid in set(user_ids):
+        for model in (Post, Comment):
+            _invalidate(_key(uid, model))
+
+
+def update_on_commit(user_ids, changes):
+    """
+    Apply vote `changes` (see votes.apply_vote_changes) cast by `user_ids` to their cached
+    likes once the transaction commits: nothing changes if it rolls back. With several
+    voters the changes can't be told apart, so their entries are invalidated on commit.
+    """
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    conditional.bump_user_likes(user_ids) # The users' ETags fold in their likes
+    if not settings.LIKED_IDS_CACHE:
+        return
+    if len(user_ids) > 1:
+        transaction.on_commit(lambda: invalidate(user_ids))
+        return
+
+    net = defaultdict(int)
+    for ct_id, object_id, _, delta in changes:
+        net[ct_id, object_id] += delta
+    edits = {}
+    for model in (Post, Comment):
+        ct_id = ContentType.objects.get_for_model(model).id
+        added = [pk for (ct, pk), delta in net.items() if ct == ct_id and delta > 0]
+        removed = [pk for (ct, pk), delta in net.items() if ct == ct_id and delta < 0]
+        if added or removed:
+            edits[_key(user_ids[0], model)] = (added, removed)
+    if edits:
+        transaction.on_commit(lambda: _update(edits))
+
+
+def _update(edits):
+    for key, (added, removed) in edits.items():
+        lock = f'{key}:lock'
+        deadline = time.monotonic() + LOCK_WAIT
+        while not cache.add(lock, 1, LOCK_TIMEOUT):
+            if time.monotonic() >= deadline:
+                _invalidate(key)
+                break
+            time.sleep(WAIT_INTERVAL)
+        else:
+            try:
+                _patch(key, added, removed)
+            finally:
+                cache.delete(lock)
+
+
+def _patch(key, added, removed):
+    try:
+        version = cache.incr(f'{key}:version')
+    except ValueError:
+        cache.delete(key) # Stamp evicted: nothing to check the entry against
+        return
+    entry = cache.get(key)
+    expires = entry[1] - time.time() if entry is not None else 0
+    if entry is None or entry[0] != version - 1 or expires < 1:
+        # Missing, or loaded before a write it doesn't hold: the next read reloads it
+        cache.delete(key)
+        return
+    liked = LikedIds.decode(entry[2]).changed(added, removed)
+    cache.set(key, (version, entry[1], liked.encode()), expires) # Keeps its original expiry
@@ -0,0 +1,192 @@
+import base64
+import json
+import platform
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+
+from api import tokens
+from api.metrics import QueryTimer
+from api.models import Post, Comment
+
+User = get_user_model()
+
+# (label, method, path); {post}, {comment} and {root} are filled per request from the sampled targets
+ENDPOINTS = [
+    ('feed', 'get', '/api/posts/'),
+    ('feed-page-50', 'get', '/api/posts/?page_size=50'),
+    ('feed-hot', 'get', '/api/posts/?sort=hot'),
+    ('detail', 'get', '/api/posts/{post}/'),
+    ('post-comments', 'get', '/api/posts/{post}/comments/'),
+    ('comment-thread', 'get', '/api/comments/{root}/thread/'),
+    ('comment-replies', 'get', '/api/comments/{root}/replies/'),
+    ('leaderboard', 'get', '/api/leaderboard/'),
+    ('leaderboard-7d', 'get', '/api/leaderboard/?window=7d'),
+    ('like-post', 'put', '/api/vote/post/{post}/'),
+    ('unlike-post', 'delete', '/api/vote/post/{post}/'),
+    ('like-comment', 'put', '/api/vote/comment/{comment}/'),
+    ('unlike-comment', 'delete', '/api/vote/comment/{comment}/'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every API endpoint in-process (django.test.Client, no server needed) with "
+        "concurrent logged-in clients against the configured database, e.g. after generate_data. "
+        "Reports p50/p95/p99 latency, throughput and SQL queries per request; --output saves the "
+        "results as JSON and --compare diffs them against an earlier run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint.")
+        parser.add_argument('--endpoints', nargs='+', choices=[label for label, _, _ in ENDPOINTS])
+        parser.add_argument('--seed', type=int, default=42, help="Chooses the users and targets.")
+        parser.add_argument(
+            '--auth', choices=['session', 'basic', 'token'], default='session',
+            help="How clients authenticate: session cookie, Basic (password hashed per request) or Bearer token."
+        )
+        parser.add_argument('--password', default='password', help="The users' password, for --auth basic.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', help="JSON file of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        targets = self.sample_targets(rng)
+        users = list(User.objects.order_by('pk')[:1000])
+        if not users:
+            raise CommandError("No users to log in as - run generate_data first.")
+        users = [rng.choice(users) for _ in range(options['concurrency'])]
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+
+        selected = options['endpoints'] or [label for label, _, _ in ENDPOINTS]
+        results = {}
+        self.stdout.write(
+            f"{'endpoint':<16} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'mean ms':>8} {'queries':>8} {'errors':>7}"
+            + ('  p95 vs baseline' if baseline else '')
+        )
+        for label, method, path in ENDPOINTS:
+            if label not in selected:
+                continue
+            stats = run_endpoint(
+                method, path, targets, users, options['concurrency'], options['requests'], options['seed'],
+                lambda client, user: log_in(client, user, options['auth'], options['password'])
+            )
+            results[label] = stats
+            line = (
+                f"{label:<16} {stats['rps']:>8.1f} {stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} "
+                f"{stats['p99_ms']:>8.1f} {stats['mean_ms']:>8.1f} {stats['queries']:>8.1f} {stats['errors']:>7}"
+            )
+            if baseline and label in baseline and baseline[label]['p95_ms']:
+                line += f"  {(stats['p95_ms'] / baseline[label]['p95_ms'] - 1) * 100:+.0f}%"
+            self.stdout.write(line)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'meta': {
+                        'at': timezone.now().isoformat(),
+                        'database': connection.vendor,
+                        'python': platform.python_version(),
+                        'posts': Post.objects.count(),
+                        'comments': Comment.objects.count(),
+                        'concurrency': options['concurrency'],
+                        'requests': options['requests'],
+                        'seed': options['seed'],
+                        'auth': options['auth'],
+                    },
+                    'results': results,
+                }, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def sample_targets(self, rng):
+        """Post, comment and top-level comment ids, weighted towards popular posts like real traffic."""
+        hot = list(Post.objects.order_by('-likes_count').values_list('pk', flat=True)[:50])
+        recent = list(Post.objects.order_by('-created_at').values_list('pk', flat=True)[:50])
+        if not hot:
+            raise CommandError("No posts to benchmark - run generate_data first.")
+        posts = [rng.choice(hot if rng.random() < 0.7 else recent) for _ in range(100)]
+        comments = list(Comment.objects.filter(post__in=posts).values_list('pk', flat=True)[:200])
+        roots = list(Comment.objects.filter(post__in=posts, parent=None).order_by('-reply_count').values_list('pk', flat=True)[:100])
+        if not comments:
+            raise CommandError("The sampled posts have no comments - run generate_data first.")
+        return {'post': posts, 'comment': comments, 'root': roots}
+
+
+def log_in(client, user, auth, password):
+    if auth == 'session':
+        client.force_login(user)
+    elif auth == 'basic':
+        credentials = base64.b64encode(f'{user.username}:{password}'.encode()).decode()
+        client.defaults['HTTP_AUTHORIZATION'] = f'Basic {credentials}'
+    else:
+        client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {tokens.issue(user)[0]}'
+
+
+def run_endpoint(method, path, targets, users, concurrency, total, seed, login):
+    """`total` requests from `concurrency` threads, each logged in as one of `users` with `login(client, user)`."""
+    local = threading.local()
+    lock = threading.Lock()
+    slots = iter(range(concurrency))
+
+    def client():
+        if not hasattr(local, 'client'):
+            with lock:
+                slot = next(slots)
+            # A failing request counts as an error instead of aborting the run
+            local.client = Client(raise_request_exception=False)
+            login(local.client, users[slot])
+            local.rng = random.Random(seed + slot)
+            # Connections are per thread: time this thread's queries
+            local.timer = QueryTimer()
+            for conn in connections.all():
+                conn.execute_wrappers.append(local.timer)
+        return local
+
+    def call(_):
+        state = client()
+        url = path.format(**{name: state.rng.choice(ids) for name, ids in targets.items() if f'{{{name}}}' in path})
+        queries = state.timer.count
+        start = time.perf_counter()
+        response = getattr(state.client, method)(url)
+        return time.perf_counter() - start, state.timer.count - queries, response.status_code >= 400
+
+    # One untimed request first, so one-off work (cold caches, a stale leaderboard
+    # snapshot being recomputed) isn't measured as concurrent contention
+    warmup = Client(raise_request_exception=False)
+    login(warmup, users[0])
+    getattr(warmup, method)(path.format(**{name: ids[0] for name, ids in targets.items()}))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, range(total)))
+        # Leave the worker threads' connections closed rather than leaked
+        list(pool.map(lambda _: connections.close_all(), range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _, _ in results)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        'requests': total,
+        'errors': sum(1 for *_, failed in results if failed),
+        'rps': total / elapsed,
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'queries': sum(queries for _, queries, _ in results) / total,
+    }
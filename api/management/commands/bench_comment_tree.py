@@ -0,0 +1,108 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.models import Comment
+from api.serializers import CommentSerializer
+from api.tree import Node, render
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark rendering a comment tree with the recursive CommentSerializer vs the "
+        "fast path in api/tree.py, on synthetic in-memory trees (no database needed)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3, help="Best of N runs (default: 3).")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        self.stdout.write(f"{'comments':>10} {'drf ms':>10} {'fast ms':>10} {'speedup':>8}  identical")
+        for size in options['sizes']:
+            rows = synthetic_rows(size, options['seed'])
+
+            drf_time, drf_bytes = best_of(options['repeat'], lambda: renderer.render(drf_tree(rows)))
+            fast_time, fast_bytes = best_of(options['repeat'], lambda: renderer.render(fast_tree(rows)))
+
+            self.stdout.write(
+                f"{size:>10} {drf_time * 1000:>10.1f} {fast_time * 1000:>10.1f} "
+                f"{drf_time / fast_time:>7.1f}x  {'yes' if drf_bytes == fast_bytes else 'NO'}"
+            )
+
+
+def best_of(repeat, fn):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def synthetic_rows(size, seed):
+    """values()-style rows of a random post thread: ~10% roots, replies attach anywhere above."""
+    rng = random.Random(seed)
+    start = timezone.now() - timedelta(days=1)
+    rows, depth, replies = [], {}, {}
+    for pk in range(1, size + 1):
+        parent = rng.randrange(1, pk) if pk > 1 and rng.random() > 0.1 else None
+        depth[pk] = depth[parent] + 1 if parent else 0
+        replies[parent] = replies.get(parent, 0) + 1
+        author = rng.randrange(1, 200)
+        rows.append({
+            'id': pk, 'author_id': author, 'author__username': f'user{author}',
+            'content': f'Comment {pk} ' + 'lorem ipsum ' * rng.randrange(1, 20),
+            'created_at': start + timedelta(seconds=pk), 'parent_id': parent,
+            'likes_count': rng.randrange(0, 50), 'user_has_liked': rng.random() < 0.05,
+            'post_id': 1, 'reply_count': 0, 'depth': depth[pk],
+        })
+    for row in rows:
+        row['reply_count'] = replies.get(row['id'], 0)
+    return rows
+
+
+def drf_tree(rows):
+    # What the views did before: model instances + prefetched_replies + recursive serializer
+    authors = {}
+    comments = {}
+    roots = []
+    for row in rows:
+        author = authors.get(row['author_id'])
+        if author is None:
+            author = authors[row['author_id']] = User(id=row['author_id'], username=row['author__username'])
+        comment = Comment(
+            id=row['id'], author=author, content=row['content'], created_at=row['created_at'],
+            parent_id=row['parent_id'], likes_count=row['likes_count'], post_id=row['post_id'],
+            reply_count=row['reply_count'], depth=row['depth'],
+        )
+        comment.user_has_liked = row['user_has_liked']
+        comment.prefetched_replies = []
+        comments[comment.id] = comment
+        if comment.parent_id:
+            comments[comment.parent_id].prefetched_replies.append(comment)
+        else:
+            roots.append(comment)
+    return CommentSerializer(roots, many=True).data
+
+
+def fast_tree(rows):
+    nodes = {}
+    roots = []
+    for row in rows:
+        node = nodes[row['id']] = Node(row)
+        if node.parent_id:
+            nodes[node.parent_id].replies.append(node)
+        else:
+            roots.append(node)
+    return render(roots)
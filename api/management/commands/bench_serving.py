@@ -0,0 +1,154 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import Post
+
+# (label, WSGI path, ASGI path); {post} is replaced by the newest post id
+ENDPOINTS = [
+    ('feed', '/api/posts/', '/api/async/posts/'),
+    ('detail', '/api/posts/{post}/', '/api/async/posts/{post}/'),
+    ('leaderboard', '/api/leaderboard/', '/api/async/leaderboard/'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare concurrent-request throughput of the WSGI mode (gunicorn sync workers, sync "
+        "DRF views) and the ASGI mode (uvicorn, api/async_views.py) against the configured "
+        "database. Starts each server as a subprocess on a local port."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='+', choices=['wsgi', 'asgi'], default=['wsgi', 'asgi'])
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint and concurrency level.")
+        parser.add_argument('--workers', type=int, default=1, help="Server processes for both modes (default: 1).")
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--slow-clients', type=int, default=0,
+            help="Connections that trickle their request headers in during each run, like clients on bad networks."
+        )
+
+    def handle(self, *args, **options):
+        post = Post.objects.order_by('-id').values_list('pk', flat=True).first()
+        if post is None:
+            raise CommandError("No posts to benchmark - load some data first.")
+
+        self.stdout.write(f"{'mode':<6} {'endpoint':<12} {'conc':>5} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+        for mode in options['modes']:
+            with serve(mode, options['port'], options['workers']):
+                base = f"http://127.0.0.1:{options['port']}"
+                for label, wsgi_path, asgi_path in ENDPOINTS:
+                    url = base + (wsgi_path if mode == 'wsgi' else asgi_path).format(post=post)
+                    for concurrency in options['concurrency']:
+                        with slow_clients(options['port'], options['slow_clients']):
+                            rate, p50, p95, errors = run_load(url, concurrency, options['requests'])
+                        self.stdout.write(
+                            f"{mode:<6} {label:<12} {concurrency:>5} {rate:>9.1f} {p50 * 1000:>8.1f} {p95 * 1000:>8.1f} {errors:>7}"
+                        )
+
+
+class serve:
+    """Context manager running the WSGI or ASGI server for the duration of a benchmark."""
+
+    def __init__(self, mode, port, workers):
+        bind = ['--bind', f'127.0.0.1:{port}'] if mode == 'wsgi' else ['--host', '127.0.0.1', '--port', str(port)]
+        if mode == 'wsgi':
+            self.args = [sys.executable, '-m', 'gunicorn', 'playto_backend.wsgi', '--workers', str(workers), *bind]
+        else:
+            self.args = [
+                sys.executable, '-m', 'uvicorn', 'playto_backend.asgi:application',
+                '--workers', str(workers), '--log-level', 'warning', *bind
+            ]
+        self.url = f'http://127.0.0.1:{port}/api/leaderboard/'
+
+    def __enter__(self):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'playto_backend.settings')}
+        self.process = subprocess.Popen(
+            self.args, cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                urllib.request.urlopen(self.url, timeout=1).read()
+                return self
+            except (urllib.error.URLError, ConnectionError, OSError):
+                if self.process.poll() is not None:
+                    break
+                time.sleep(0.2)
+        self.__exit__()
+        raise CommandError(f"Server did not start: {' '.join(self.args)}")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class slow_clients:
+    """`count` connections sending one header line per second until the run is over."""
+
+    def __init__(self, port, count):
+        self.port, self.count = port, count
+        self.stop = Event()
+
+    def trickle(self):
+        try:
+            with socket.create_connection(('127.0.0.1', self.port), timeout=5) as sock:
+                sock.sendall(b'GET /api/leaderboard/ HTTP/1.1\r\nHost: localhost\r\n')
+                while not self.stop.wait(1):
+                    sock.sendall(b'X-Slow: 1\r\n')
+                sock.sendall(b'Connection: close\r\n\r\n')
+                sock.recv(65536)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        self.threads = [Thread(target=self.trickle, daemon=True) for _ in range(self.count)]
+        for thread in self.threads:
+            thread.start()
+        time.sleep(0.5 if self.count else 0) # Let them connect first
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join(timeout=10)
+
+
+def run_load(url, concurrency, total):
+    """Fire `total` GETs at `url` from `concurrency` client threads: (req/s, p50, p95, errors)."""
+    def fetch(_):
+        start = time.perf_counter()
+        try:
+            urllib.request.urlopen(url, timeout=30).read()
+            return time.perf_counter() - start, False
+        except (urllib.error.URLError, ConnectionError, OSError):
+            return time.perf_counter() - start, True
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fetch, range(total)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, failed in results if failed)
+    return (
+        total / elapsed,
+        latencies[len(latencies) // 2],
+        latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        errors,
+    )
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move votes older than VOTE_ARCHIVE_AFTER_DAYS from the Vote table to the archive, in "
+        "short batched transactions (see api/archive.py), and report the rows/second achieved. "
+        "Run it periodically, e.g. nightly from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, help="Archive votes older than this (default: VOTE_ARCHIVE_AFTER_DAYS).")
+        parser.add_argument('--batch-size', type=int, help="Rows per transaction (default: VOTE_ARCHIVE_BATCH_SIZE).")
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days']) if options['days'] is not None else None
+
+        def progress(moved, elapsed):
+            self.stdout.write(f"  {moved} votes archived, {moved / elapsed:.0f} rows/s", ending='\r')
+            self.stdout.flush()
+
+        try:
+            moved, elapsed = archive.compact(before, options['batch_size'], options['pause'], progress)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        rate = moved / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} votes in {elapsed:.1f}s ({rate:.0f} rows/s)"))
@@ -0,0 +1,198 @@
+import math
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api import hot, karma, leaderboard
+from api.models import Post, Comment, Vote, path_segment
+
+User = get_user_model()
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore '
+    'et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load deterministic synthetic data: users, posts, comment trees with realistic depth and "
+        "fanout, and votes with skewed popularity. Same --seed, same data (timestamps are relative "
+        "to now). Rows go in with bulk_create, with counters, tree paths and the karma ledger filled in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--comments-per-post', type=float, default=20, help="Mean; heavy-tailed per post.")
+        parser.add_argument('--max-comments', type=int, default=20000, help="Cap for a single post.")
+        parser.add_argument('--max-depth', type=int, default=8)
+        parser.add_argument('--likes-per-post', type=float, default=15, help="Mean; heavy-tailed per post.")
+        parser.add_argument('--likes-per-comment', type=float, default=2, help="Mean; heavy-tailed per comment.")
+        parser.add_argument('--days', type=float, default=10, help="Spread post timestamps over the last N days.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='gen', help="Username prefix of the generated users.")
+        parser.add_argument('--batch-size', type=int, default=200, help="Posts (with their comments and votes) per transaction.")
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=f"{options['prefix']}_").exists():
+            raise CommandError(f"Users named {options['prefix']}_* already exist; pick another --prefix.")
+
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.now = timezone.now()
+        self.post_ct = ContentType.objects.get_for_model(Post)
+        self.comment_ct = ContentType.objects.get_for_model(Comment)
+        # Ids are assigned here rather than by the database, so tree paths can be computed
+        # before the INSERT and rows never need a second write
+        self.next_id = {
+            model: (model.objects.aggregate(n=Max('pk'))['n'] or 0) + 1
+            for model in (User, Post, Comment, Vote)
+        }
+
+        with explicit_timestamps():
+            user_ids = self.create_users()
+            totals = {'posts': 0, 'comments': 0, 'votes': 0}
+            for start in range(0, options['posts'], options['batch_size']):
+                count = min(options['batch_size'], options['posts'] - start)
+                for key, n in self.create_batch(user_ids, count).items():
+                    totals[key] += n
+                self.stdout.write(f"  {start + count}/{options['posts']} posts", ending='\r')
+                self.stdout.flush()
+
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [User, Post, Comment, Vote]):
+                cursor.execute(sql)
+        karma.rebuild_ledger()
+        leaderboard.refresh()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(user_ids)} users, {totals['posts']} posts, {totals['comments']} comments "
+            f"and {totals['votes']} votes (seed {options['seed']})"
+        ))
+
+    def take_ids(self, model, count):
+        first = self.next_id[model]
+        self.next_id[model] += count
+        return range(first, first + count)
+
+    def heavy_tail(self, mean, cap):
+        # Log-normal with the given mean: most objects get a little, a few get a lot
+        if mean <= 0:
+            return 0
+        sigma = 1.2
+        return min(cap, int(self.rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)))
+
+    def text(self, low, high):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(low, high))).capitalize()
+
+    def create_users(self):
+        password = make_password('password')
+        ids = self.take_ids(User, self.options['users'])
+        User.objects.bulk_create(
+            [User(id=pk, username=f"{self.options['prefix']}_{pk}", password=password) for pk in ids],
+            batch_size=1000
+        )
+        ids = list(ids)
+        # Zipf-like activity: a few users author most of the content
+        self.author_weights = list(_cumulative([1 / (rank + 1) ** 1.1 for rank in range(len(ids))]))
+        return ids
+
+    def pick_author(self, user_ids):
+        return self.rng.choices(user_ids, cum_weights=self.author_weights)[0]
+
+    def timestamp_after(self, start):
+        # Skewed towards shortly after `start`
+        return start + (self.now - start) * self.rng.random() ** 3
+
+    def votes_for(self, user_ids, ct, obj, mean):
+        count = self.heavy_tail(mean, len(user_ids))
+        return [
+            Vote(user_id=voter, content_type=ct, object_id=obj.pk, created_at=self.timestamp_after(obj.created_at))
+            for voter in self.rng.sample(user_ids, count)
+        ]
+
+    def create_batch(self, user_ids, count):
+        opts = self.options
+        posts, comments, votes = [], [], []
+        for pk in self.take_ids(Post, count):
+            post = Post(
+                id=pk, author_id=self.pick_author(user_ids), content=self.text(5, 60),
+                created_at=self.now - timedelta(days=opts['days'] * self.rng.random()),
+            )
+            posts.append(post)
+
+            thread = self.comment_tree(post, user_ids)
+            comments += thread
+            post.comment_count = len(thread)
+
+            post_votes = self.votes_for(user_ids, self.post_ct, post, opts['likes_per_post'])
+            post.likes_count = len(post_votes)
+            post.hot_score = hot.score(post.likes_count, post.comment_count, post.created_at)
+            votes += post_votes
+            for comment in thread:
+                comment_votes = self.votes_for(user_ids, self.comment_ct, comment, opts['likes_per_comment'])
+                comment.likes_count = len(comment_votes)
+                votes += comment_votes
+
+        for vote, pk in zip(votes, self.take_ids(Vote, len(votes))):
+            vote.id = pk
+        with transaction.atomic():
+            Post.objects.bulk_create(posts, batch_size=1000)
+            # Parents come before their replies in `comments`, so FKs are always satisfied
+            Comment.objects.bulk_create(comments, batch_size=1000)
+            Vote.objects.bulk_create(votes, batch_size=2000)
+        return {'posts': len(posts), 'comments': len(comments), 'votes': len(votes)}
+
+    def comment_tree(self, post, user_ids):
+        """A post's comments: ~30% top-level, the rest replies to recent comments (active sub-threads)."""
+        opts = self.options
+        thread = []
+        ids = self.take_ids(Comment, self.heavy_tail(opts['comments_per_post'], opts['max_comments']))
+        created_at = post.created_at
+        for pk in ids:
+            created_at = created_at + (self.now - created_at) * self.rng.random() * 0.05
+            parent = None
+            if thread and self.rng.random() > 0.3:
+                parent = self.rng.choice(thread[-20:])
+                if parent.depth >= opts['max_depth']:
+                    parent = None
+            comment = Comment(
+                id=pk, post_id=post.pk, author_id=self.pick_author(user_ids), content=self.text(3, 40),
+                created_at=created_at, parent_id=parent.pk if parent else None,
+                depth=parent.depth + 1 if parent else 0,
+                path=(parent.path if parent else '') + path_segment(pk),
+            )
+            if parent:
+                parent.reply_count += 1
+            thread.append(comment)
+        return thread
+
+
+def _cumulative(weights):
+    total = 0
+    for weight in weights:
+        total += weight
+        yield total
+
+
+@contextmanager
+def explicit_timestamps():
+    """Let bulk_create keep the created_at values we set instead of stamping them with now()."""
+    fields = [model._meta.get_field('created_at') for model in (Post, Comment, Vote)]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
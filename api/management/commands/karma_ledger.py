@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from datetime import timedelta
+
+from api import karma
+
+
+class Command(BaseCommand):
+    help = (
+        "Maintain the hourly karma ledger behind the leaderboard: verify it against the "
+        "slow Vote-table aggregation, rebuild it, or prune expired buckets."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help="Compare ledger scores with the slow query (default).")
+        parser.add_argument('--rebuild', action='store_true', help="Recompute all buckets in the retention period from votes.")
+        parser.add_argument('--prune', action='store_true', help="Delete buckets older than KARMA_LEDGER_RETENTION_HOURS.")
+        parser.add_argument('--hours', type=int, default=24, help="Window to verify (default: 24).")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rows = karma.rebuild_ledger()
+            self.stdout.write(f"Rebuilt ledger: {rows} buckets")
+        if options['prune']:
+            deleted = karma.prune_ledger()
+            self.stdout.write(f"Pruned {deleted} expired buckets")
+        if options['verify'] or not (options['rebuild'] or options['prune']):
+            self.verify(options['hours'])
+
+    def verify(self, hours):
+        now = timezone.now()
+        expected = karma.slow_scores(now - timedelta(hours=hours))
+        actual = karma.ledger_scores(hours=hours, now=now)
+
+        drift = {}
+        for uid in set(expected) | set(actual):
+            if expected.get(uid, 0) != actual.get(uid, 0):
+                drift[uid] = (expected.get(uid, 0), actual.get(uid, 0))
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS(
+                f"Ledger matches the Vote table for {len(expected)} authors over the last {hours}h"
+            ))
+            return
+
+        usernames = get_user_model().objects.in_bulk(list(drift))
+        for uid, (want, got) in sorted(drift.items()):
+            user = usernames.get(uid)
+            self.stderr.write(f"{user.username if user else uid}: votes say {want}, ledger says {got}")
+        raise CommandError(f"Karma ledger drifted for {len(drift)} authors; run with --rebuild to fix")
@@ -0,0 +1,62 @@
+import os
+import pstats
+from io import StringIO
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        "List the request profiles in PROFILE_DIR (see api/profiling.py), newest first, or "
+        "summarize one: its slowest functions (pstats) and slowest SQL queries."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump_id', nargs='?', help="Dump to summarize (default: list them all).")
+        parser.add_argument('--dir', help="Dump directory (default: PROFILE_DIR).")
+        parser.add_argument('--sort', default='cumulative', help="pstats sort key (default: cumulative).")
+        parser.add_argument('--limit', type=int, default=20, help="Functions and queries to show.")
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILE_DIR
+        if not directory:
+            raise CommandError("Set PROFILE_DIR or pass --dir.")
+        if options['dump_id']:
+            self.summarize(directory, options['dump_id'], options['sort'], options['limit'])
+            return
+
+        ids = profiling.dumps(directory)
+        if not ids:
+            self.stdout.write(f"No dumps in {directory}")
+            return
+        self.stdout.write(f"{'id':<34} {'status':>6} {'ms':>9} {'queries':>7} {'sql ms':>9}  request")
+        for dump_id in ids:
+            dump = profiling.load(dump_id, directory)
+            self.stdout.write(
+                f"{dump_id:<34} {dump['status']:>6} {dump['ms']:>9.1f} {len(dump['queries']):>7} "
+                f"{dump['sql_ms']:>9.1f}  {dump['method']} {dump['path']}"
+            )
+
+    def summarize(self, directory, dump_id, sort, limit):
+        try:
+            dump = profiling.load(dump_id, directory)
+        except FileNotFoundError:
+            raise CommandError(f"No dump {dump_id} in {directory}")
+        self.stdout.write(
+            f"{dump['method']} {dump['path']} -> {dump['status']} ({dump['route']}, user {dump['user']})\n"
+            f"{dump['ms']:.1f} ms total, {len(dump['queries'])} queries in {dump['sql_ms']:.1f} ms"
+        )
+
+        out = StringIO()
+        try:
+            pstats.Stats(os.path.join(directory, f'{dump_id}.prof'), stream=out).sort_stats(sort).print_stats(limit)
+        except KeyError:
+            raise CommandError(f"Unknown sort key {sort!r}")
+        self.stdout.write(out.getvalue())
+
+        self.stdout.write("Slowest queries:")
+        for query in dump['queries'][:limit]:
+            self.stdout.write(f"{query['ms']:>9.3f} ms  [{query['database']}] {query['sql']}")
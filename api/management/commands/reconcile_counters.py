@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the Post and Comment like/comment/reply counters from the "
+        "Vote/Comment tables and report (or fix) drift. Also switches posts in and out of "
+        "sharded like-counter mode."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Write the recomputed values and fold pending shards.")
+        parser.add_argument('--fold', action='store_true', help="Only fold pending shard increments into likes_count.")
+        parser.add_argument('--shard', type=int, nargs='+', metavar='POST_ID', help="Put these posts into sharded mode.")
+        parser.add_argument('--unshard', type=int, nargs='+', metavar='POST_ID', help="Take these posts out of sharded mode.")
+        parser.add_argument('--shards', type=int, default=8, help="Shard rows per post for --shard (default: 8).")
+
+    def handle(self, *args, **options):
+        if options['shard'] or options['unshard']:
+            for post_id in options['shard'] or []:
+                counters.set_sharding(post_id, options['shards'])
+            for post_id in options['unshard'] or []:
+                counters.set_sharding(post_id, 0)
+            self.stdout.write("Updated counter sharding")
+            return
+
+        if options['fold']:
+            folded = counters.fold_shards()
+            self.stdout.write(f"Folded pending likes for {folded} posts")
+            return
+
+        drift = counters.reconcile(fix=options['fix'])
+        for label, pk, stored, actual in drift:
+            self.stderr.write(f"{label} #{pk}: stored {stored}, actual {actual}")
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All counters match"))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {len(drift)} counters"))
+        else:
+            raise CommandError(f"{len(drift)} counters drifted; run with --fix to correct them")
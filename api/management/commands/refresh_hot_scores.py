@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api import hot
+
+
+class Command(BaseCommand):
+    help = (
+        "Rescore every post for the hot feed from its counters, pending shard likes included "
+        "(see api/hot.py). Run it periodically (e.g. from cron), or with --loop as a worker "
+        "process rescoring every HOT_REFRESH_SECONDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep refreshing until interrupted.")
+        parser.add_argument('--interval', type=float, help="Seconds between refreshes with --loop.")
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write("Refreshing hot scores, Ctrl+C to stop")
+            try:
+                hot.run_refresher(interval=options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        self.stdout.write(f"Updated {hot.refresh()} hot scores")
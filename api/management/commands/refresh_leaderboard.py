@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api import leaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the leaderboard snapshots from the karma ledger. Run it once (e.g. from "
+        "cron), or with --loop as a worker process refreshing every LEADERBOARD_REFRESH_SECONDS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--windows', nargs='+', choices=list(leaderboard.WINDOWS), help="Default: all windows.")
+        parser.add_argument('--loop', action='store_true', help="Keep refreshing until interrupted.")
+        parser.add_argument('--interval', type=float, help="Seconds between refreshes with --loop.")
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write("Refreshing leaderboard snapshots, Ctrl+C to stop")
+            try:
+                leaderboard.run_refresher(interval=options['interval'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        for window, snap in leaderboard.refresh(options['windows']).items():
+            self.stdout.write(f"{window}: {len(snap['entries'])} entries")
@@ -0,0 +1,310 @@
+"""
+Per-endpoint request metrics, exposed in Prometheus text format at /api/metrics/.
+
+MetricsMiddleware records for every request, keyed by route (the URL name, e.g.
+'post-list', 'post-detail', 'vote', 'leaderboard', 'comment-thread') and method:
+  - a latency histogram,
+  - SQL query count and SQL time, from connection.execute_wrapper on every database,
+  - response bytes, and requests per status class.
+
+Methods other than the standard ones are recorded as 'OTHER', so clients can't grow the
+number of series. Reading needs METRICS_TOKEN as a bearer token (open only with DEBUG).
+
+Recording is a few dict updates under a lock plus one perf_counter() pair per query,
+so it can stay on in production (METRICS_ENABLED).
+
+Forked workers (gunicorn) each count their own requests. With METRICS_DIR set, every
+process writes its totals to METRICS_DIR/<pid>-<random id>.json and the endpoint sums all
+files, so any worker answers for the whole server. The random id keeps a new process that
+got a dead worker's pid from overwriting its file (counters going down read as a reset to
+Prometheus). Files are written on a request at least METRICS_FLUSH_SECONDS after the last
+write, and at exit: a worker's last second of requests only shows once it serves another.
+
+Exited workers' requests still count. The endpoint folds their files into
+METRICS_DIR/retired.json and deletes them, so the directory holds one file per live
+worker plus that one. Workers are checked for with kill(pid, 0): the directory must not
+be shared across hosts.
+"""
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per (route, method): request count, latency sum, latency bucket counts (+Inf last),
+# query count, SQL seconds, response bytes, {status class: count}
+COUNT, LATENCY, BUCKETS, QUERIES, SQL_TIME, BYTES, STATUS = range(7)
+
+METHODS = frozenset(['GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'])
+
+RETIRED = 'retired.json' # {'totals': totals of exited workers, 'workers': their files}
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.last_flush = 0.0
+        self.pid = self.filename = None
+
+    def observe(self, route, method, status, seconds, queries, sql_time, size):
+        with self.lock:
+            stats = self.stats.get((route, method))
+            if stats is None:
+                stats = self.stats[(route, method)] = [0, 0.0, [0] * (len(LATENCY_BUCKETS) + 1), 0, 0.0, 0, {}]
+            stats[COUNT] += 1
+            stats[LATENCY] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    break
+            else:
+                i = len(LATENCY_BUCKETS)
+            stats[BUCKETS][i] += 1
+            stats[QUERIES] += queries
+            stats[SQL_TIME] += sql_time
+            stats[BYTES] += size
+            status_class = f'{status // 100}xx'
+            stats[STATUS][status_class] = stats[STATUS].get(status_class, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                f'{route} {method}': [*stats[:BUCKETS], list(stats[BUCKETS]), *stats[QUERIES:STATUS], dict(stats[STATUS])]
+                for (route, method), stats in self.stats.items()
+            }
+
+    def flush(self, force=False):
+        """Write this process's totals to METRICS_DIR (when set), at most every METRICS_FLUSH_SECONDS."""
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or (not force and now - self.last_flush < settings.METRICS_FLUSH_SECONDS):
+            return
+        self.last_flush = now
+        if self.pid != os.getpid(): # First write of this process
+            self.pid = os.getpid()
+            self.filename = f'{self.pid}-{uuid.uuid4().hex[:12]}.json'
+            atexit.register(self.flush, force=True)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.filename)
+        _write(path, self.snapshot())
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    """connection.execute_wrapper() hook counting queries and their time."""
+    __slots__ = ('count', 'time')
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    # Async capable, so the ASGI mode keeps its async views (api/async_views.py) async
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self.wrap_queries(stack, timer)
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        # Connections are per thread, and the async ORM runs queries in the request's
+        # thread-sensitive sync thread: install the wrappers there
+        timer = QueryTimer()
+        stack = ExitStack()
+        start = time.perf_counter()
+        await sync_to_async(self.wrap_queries)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    def wrap_queries(self, stack, timer):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+
+    def record(self, request, response, elapsed, timer):
+        match = getattr(request, 'resolver_match', None)
+        route = (match.url_name or match.view_name) if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        # Clients pick the method: anything unusual shares one label, so the series stay bounded
+        method = request.method if request.method in METHODS else 'OTHER'
+        registry.observe(route, method, response.status_code, elapsed, timer.count, timer.time, size)
+        registry.flush()
+
+
+def collect():
+    """Totals of every worker process (or just this one without METRICS_DIR)."""
+    registry.flush(force=True)
+    directory = settings.METRICS_DIR
+    if not directory:
+        return [registry.snapshot()]
+    with _locked(directory):
+        retired = retire(directory)
+        snapshots = [retired['totals']]
+        for name in os.listdir(directory):
+            if _pid(name) is not None and name not in retired['workers']:
+                snapshot = _load(directory, name)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+    return snapshots
+
+
+def retire(directory):
+    """
+    Fold the files of exited workers into RETIRED and delete them; returns its contents.
+    Call with the directory locked. A file is only deleted once RETIRED lists it, so an
+    interrupted pass never counts a worker twice or not at all.
+    """
+    retired = _load(directory, RETIRED) or {'totals': {}, 'workers': []}
+    names = {name for name in os.listdir(directory) if _pid(name) is not None}
+    folded = names.intersection(retired['workers']) # Deletion interrupted
+    exited = [name for name in names - folded if not _alive(_pid(name))]
+    if exited:
+        snapshots = [snapshot for snapshot in (_load(directory, name) for name in exited) if snapshot is not None]
+        retired = {'totals': merge([retired['totals'], *snapshots]), 'workers': sorted(folded.union(exited))}
+        _write(os.path.join(directory, RETIRED), retired)
+    for name in folded.union(exited):
+        os.remove(os.path.join(directory, name))
+    return retired
+
+
+@contextmanager
+def _locked(directory):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'lock'), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX) # Released when the file is closed
+        yield
+
+
+def _pid(name):
+    """The pid in a worker file's name, None for other files."""
+    pid, _, rest = name.partition('-')
+    return int(pid) if pid.isdigit() and rest.endswith('.json') else None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # Someone else's process
+    return True
+
+
+def _load(directory, name):
+    try:
+        with open(os.path.join(directory, name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None # Not written yet
+
+
+def _write(path, data):
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path) # Readers never see a half-written file
+
+
+def merge(snapshots):
+    totals = {}
+    for snapshot in snapshots:
+        for key, stats in snapshot.items():
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [*stats[:BUCKETS], list(stats[BUCKETS]), *stats[QUERIES:STATUS], dict(stats[STATUS])]
+                continue
+            for i in (COUNT, LATENCY, QUERIES, SQL_TIME, BYTES):
+                total[i] += stats[i]
+            total[BUCKETS] = [a + b for a, b in zip(total[BUCKETS], stats[BUCKETS])]
+            for status_class, n in stats[STATUS].items():
+                total[STATUS][status_class] = total[STATUS].get(status_class, 0) + n
+    return totals
+
+
+def render(totals):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    keys = sorted(totals)
+    labels = {key: 'route="{}",method="{}"'.format(*key.split(' ', 1)) for key in keys}
+
+    family('playto_http_requests_total', 'counter', 'Requests handled, by route, method and status class.')
+    for key in keys:
+        for status_class, n in sorted(totals[key][STATUS].items()):
+            lines.append(f'playto_http_requests_total{{{labels[key]},status="{status_class}"}} {n}')
+
+    family('playto_http_request_duration_seconds', 'histogram', 'Request latency, by route and method.')
+    for key in keys:
+        cumulative = 0
+        for bound, n in zip((*LATENCY_BUCKETS, '+Inf'), totals[key][BUCKETS]):
+            cumulative += n
+            lines.append(f'playto_http_request_duration_seconds_bucket{{{labels[key]},le="{bound}"}} {cumulative}')
+        lines.append(f'playto_http_request_duration_seconds_sum{{{labels[key]}}} {totals[key][LATENCY]:.6f}')
+        lines.append(f'playto_http_request_duration_seconds_count{{{labels[key]}}} {totals[key][COUNT]}')
+
+    for name, index, help_text, fmt in (
+        ('playto_db_queries_total', QUERIES, 'SQL queries executed, by route and method.', '{}'),
+        ('playto_db_query_seconds_total', SQL_TIME, 'Time spent in SQL, by route and method.', '{:.6f}'),
+        ('playto_http_response_bytes_total', BYTES, 'Response body bytes, by route and method.', '{}'),
+    ):
+        family(name, 'counter', help_text)
+        for key in keys:
+            lines.append(f'{name}{{{labels[key]}}} {fmt.format(totals[key][index])}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponseForbidden() # No token configured: closed outside development
+    elif not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponseForbidden()
+    return HttpResponse(render(merge(collect())), content_type='text/plain; version=0.0.4; charset=utf-8')
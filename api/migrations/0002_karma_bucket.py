@@ -0,0 +1,59 @@
+# Generated by Django 5.2.10 on 2026-10-18 18:54
+
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_ledger(apps, schema_editor):
+    # Seed the ledger from votes still inside the retention period
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Vote = apps.get_model('api', 'Vote')
+    KarmaBucket = apps.get_model('api', 'KarmaBucket')
+
+    start = timezone.now() - timedelta(hours=settings.KARMA_LEDGER_RETENTION_HOURS)
+    totals = defaultdict(int)
+    for model_name, points in (('post', 5), ('comment', 1)):
+        ct = ContentType.objects.filter(app_label='api', model=model_name).first()
+        if ct is None:
+            continue
+        model = apps.get_model('api', model_name)
+        votes = list(Vote.objects.filter(content_type=ct, created_at__gte=start).values_list('object_id', 'created_at'))
+        authors = dict(model.objects.filter(pk__in={oid for oid, _ in votes}).values_list('pk', 'author_id'))
+        for object_id, created_at in votes:
+            if object_id in authors:
+                hour = created_at.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+                totals[(authors[object_id], hour)] += points
+
+    KarmaBucket.objects.bulk_create(
+        [KarmaBucket(user_id=uid, hour=hour, score=score) for (uid, hour), score in totals.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KarmaBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('score', models.IntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='karma_buckets', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hour'], name='api_karmabu_hour_d8fe78_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'hour'), name='unique_karma_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.10 on 2026-10-18 18:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_counters(apps, schema_editor):
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Vote = apps.get_model('api', 'Vote')
+    Post = apps.get_model('api', 'Post')
+    Comment = apps.get_model('api', 'Comment')
+
+    for model in (Post, Comment):
+        ct = ContentType.objects.filter(app_label='api', model=model._meta.model_name).first()
+        if ct is None:
+            continue
+        likes = Vote.objects.filter(content_type=ct).values('object_id').annotate(n=Count('pk'))
+        for row in likes:
+            model.objects.filter(pk=row['object_id']).update(likes_count=row['n'])
+
+    for row in Comment.objects.values('post_id').annotate(n=Count('pk')):
+        Post.objects.filter(pk=row['post_id']).update(comment_count=row['n'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_karma_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PostLikeShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='like_shard_rows', to='api.post')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('post', 'shard'), name='unique_post_like_shard')],
+            },
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
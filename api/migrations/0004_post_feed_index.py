@@ -0,0 +1,17 @@
+# Generated by Django 5.2.10 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-created_at', '-id'], name='api_post_created_63359e_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.10 on 2026-10-18 18:59
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_reply_count(apps, schema_editor):
+    Comment = apps.get_model('api', 'Comment')
+    for row in Comment.objects.filter(parent__isnull=False).values('parent_id').annotate(n=Count('pk')):
+        Comment.objects.filter(pk=row['parent_id']).update(reply_count=row['n'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_post_feed_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_reply_count, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'parent', 'created_at', 'id'], name='api_comment_post_id_0d7cee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent', 'created_at', 'id'], name='api_comment_parent__93d892_idx'),
+        ),
+    ]
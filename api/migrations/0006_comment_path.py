@@ -0,0 +1,62 @@
+# Generated by Django 5.2.10 on 2026-10-18 19:00
+
+from django.db import migrations, models
+
+SEGMENT_LENGTH = 8
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def segment(pk):
+    out = ''
+    while pk:
+        pk, rem = divmod(pk, 36)
+        out = DIGITS[rem] + out
+    return out.rjust(SEGMENT_LENGTH, '0')
+
+
+def backfill_paths(apps, schema_editor):
+    # Walk the existing trees level by level: roots first, then the children of each level
+    Comment = apps.get_model('api', 'Comment')
+    parents = {}
+    level = list(Comment.objects.filter(parent__isnull=True).only('pk', 'parent_id'))
+    depth = 0
+    while level:
+        for comment in level:
+            comment.path = parents.get(comment.parent_id, '') + segment(comment.pk)
+            comment.depth = depth
+        Comment.objects.bulk_update(level, ['path', 'depth'], batch_size=1000)
+        parents = {c.pk: c.path for c in level}
+        ids = list(parents)
+        level = []
+        for i in range(0, len(ids), 1000): # Keep IN lists within backend parameter limits
+            level += Comment.objects.filter(parent_id__in=ids[i:i + 1000]).only('pk', 'parent_id')
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_comment_threads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=760),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['path'], name='api_comment_path_f47fd8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth'], name='api_comment_post_id_716437_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.10 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_comment_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window', models.CharField(max_length=8, unique=True)),
+                ('computed_at', models.DateTimeField()),
+                ('entries', models.JSONField(default=list)),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.10 on 2026-10-18 19:50
+
+from django.db import migrations, models
+
+
+def backfill_hot_scores(apps, schema_editor):
+    # Same formula as api.hot.score(), pending shard likes included
+    from api.hot import score
+    Post = apps.get_model('api', 'Post')
+    PostLikeShard = apps.get_model('api', 'PostLikeShard')
+    pending = dict(PostLikeShard.objects.values('post').annotate(total=models.Sum('count')).values_list('post', 'total'))
+    posts = []
+    for post in Post.objects.only('likes_count', 'comment_count', 'created_at').iterator():
+        post.hot_score = score(post.likes_count + pending.get(post.pk, 0), post.comment_count, post.created_at)
+        posts.append(post)
+    Post.objects.bulk_update(posts, ['hot_score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_leaderboard_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='hot_score',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-hot_score', '-id'], name='api_post_hot_sco_78fa38_idx'),
+        ),
+        migrations.RunPython(backfill_hot_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.10 on 2026-10-18 21:30
+
+from django.db import migrations
+
+# Vendor specific (GIN / FTS5 / FULLTEXT), see api/search.py. The DDL is spelled out here
+# rather than imported so that later changes to search.py don't change this migration.
+TABLES = ('api_post', 'api_comment')
+
+
+def sqlite_fts(table):
+    fts = f'{table}_fts'
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"content, content='{table}', content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF content ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f"INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def install_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (to_tsvector('english', content))"
+            )
+        elif vendor == 'mysql':
+            schema_editor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {table}_search_idx (content)")
+        elif vendor == 'sqlite':
+            for sql in sqlite_fts(table):
+                schema_editor.execute(sql)
+
+
+def uninstall_search(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+        elif vendor == 'mysql':
+            schema_editor.execute(f"ALTER TABLE {table} DROP INDEX {table}_search_idx")
+        elif vendor == 'sqlite':
+            for suffix in ('insert', 'delete', 'update'):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_fts_{suffix}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {table}_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_vote_covering_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search, uninstall_search),
+    ]
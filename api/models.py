@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
 from django.contrib.contenttypes.models import ContentType
@@ -8,6 +8,7 @@ class User(AbstractUser):
     # We can add an 'avatar' field later if needed, but for now standard django user is fine.
     # Karma could be a field for display efficiency, but requirements strictly say: 
     # "Do not store 'Daily Karma' in a simple integer field... Calculate it dynamically"
+    # Karma lives in the hourly KarmaBucket ledger below and is summed per window on read.
     pass
 
 class Post(models.Model):
@@ -15,10 +16,57 @@ class Post(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     votes = GenericRelation('Vote')
+    archived_votes = GenericRelation('ArchivedVote')
+    archived_vote_totals = GenericRelation('ArchivedVoteTotal')
+
+    # Denormalized counters, maintained with F() updates from the Vote/Comment signals
+    # (see api/counters.py) so reads don't need a COUNT join.
+    likes_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    # 0 = likes go straight into likes_count. N > 0 = "viral" mode: likes are spread over
+    # N PostLikeShard rows so concurrent likes don't all lock this row.
+    like_shards = models.PositiveSmallIntegerField(default=0)
+    # Time-decayed engagement for ?sort=hot, kept up to date by api/hot.py
+    hot_score = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id']), # Keyset pagination of the feed
+            models.Index(fields=['-hot_score', '-id']), # Same for the hot feed
+        ]
     
     def __str__(self):
         return f"Post by {self.author.username} at {self.created_at}"
 
+# Materialized path of a comment: the fixed-width base36 ids of its ancestors and itself,
+# e.g. root 5 -> '00000005', its reply 42 -> '000000050000001a'. Sorting by path is a
+# depth-first walk of the tree and every subtree is one contiguous path range.
+PATH_SEGMENT_LENGTH = 8
+PATH_MAX_LENGTH = 760 # Stays within MySQL's index key limit
+MAX_COMMENT_DEPTH = PATH_MAX_LENGTH // PATH_SEGMENT_LENGTH - 1
+
+PATH_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def path_segment(pk):
+    out = ''
+    while pk:
+        pk, rem = divmod(pk, 36)
+        out = PATH_DIGITS[rem] + out
+    return out.rjust(PATH_SEGMENT_LENGTH, '0')
+
+def path_successor(path):
+    # Smallest string sorting after every path that starts with `path` (the exclusive upper
+    # bound of its subtree). Avoids LIKE 'prefix%', which many collations can't range-scan.
+    i = len(path) - 1
+    while i >= 0 and path[i] == PATH_DIGITS[-1]:
+        i -= 1
+    if i < 0:
+        return None
+    return path[:i] + PATH_DIGITS[PATH_DIGITS.index(path[i]) + 1]
+
+def path_ids(path):
+    return [int(path[i:i + PATH_SEGMENT_LENGTH], 36) for i in range(0, len(path), PATH_SEGMENT_LENGTH)]
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='replies')
@@ -26,14 +74,64 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     votes = GenericRelation('Vote')
+    archived_votes = GenericRelation('ArchivedVote')
+    archived_vote_totals = GenericRelation('ArchivedVoteTotal')
+    likes_count = models.IntegerField(default=0) # Denormalized, see api/counters.py
+    reply_count = models.IntegerField(default=0) # Direct replies, denormalized like likes_count
+
+    # Tree index, set on insert (see save()). 0 = top-level comment.
+    path = models.CharField(max_length=PATH_MAX_LENGTH, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Paging a post's top-level threads and a comment's replies by (created_at, id)
+            models.Index(fields=['post', 'parent', 'created_at', 'id']),
+            models.Index(fields=['parent', 'created_at', 'id']),
+            models.Index(fields=['path']), # Subtree range scans
+            models.Index(fields=['post', 'depth']), # "Everything down to depth D" of a post
+        ]
 
     def __str__(self):
         return f"Comment by {self.author.username}"
 
+    def save(self, *args, **kwargs):
+        creating = self._state.adding and not self.path
+        if not creating:
+            return super().save(*args, **kwargs)
+        self.depth = self.parent.depth + 1 if self.parent_id else 0
+        # The path ends with our own id, which only exists after the INSERT. Both writes
+        # commit together: a row left with path '' would sort before every other path.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.path = (self.parent.path if self.parent_id else '') + path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+    def subtree(self, max_depth=None):
+        """Descendants of this comment (not itself), in depth-first order: one path range scan."""
+        return Comment.subtree_of(self.path, self.depth, max_depth)
+
+    @staticmethod
+    def subtree_of(path, depth, max_depth=None):
+        if not path:
+            raise ValueError("Comment without a path: its subtree would be every comment")
+        qs = Comment.objects.filter(path__gt=path)
+        upper = path_successor(path)
+        if upper is not None:
+            qs = qs.filter(path__lt=upper)
+        if max_depth is not None:
+            qs = qs.filter(depth__lte=depth + max_depth)
+        return qs.order_by('path')
+
+    def ancestors(self):
+        """Root-first ancestors of this comment, read by the ids encoded in its path."""
+        return Comment.objects.filter(pk__in=path_ids(self.path)[:-1]).order_by('path')
+
 class Vote(models.Model):
     # Using a generic relation allows voting on both Post and Comment
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='votes')
-    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    # No single-column FK indexes: the composite indexes below lead with these columns
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='votes', db_index=False)
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, db_index=False)
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey('content_type', 'object_id')
     
@@ -44,7 +142,76 @@ class Vote(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='unique_vote')
         ]
+        # Every vote read is served from one of these (the unique constraint covers a user's likes):
+        indexes = [
+            models.Index(fields=['created_at']), # Oldest first, for compaction (api/archive.py)
+            models.Index(fields=['content_type', 'object_id']), # Per-object counts
+            # Karma by time window: a range scan that also covers the object_id joined back to
+            # the liked post/comment, without visiting the table
+            models.Index(fields=['content_type', 'created_at', 'object_id'], name='api_vote_karma_idx'),
+        ]
+
+class ArchivedVote(models.Model):
+    # Votes older than VOTE_ARCHIVE_AFTER_DAYS, moved out of Vote by `compact_votes` (api/archive.py)
+    # so Vote and its indexes only hold recent likes. Same columns and uniqueness as Vote; the vote
+    # write paths (api/votes.py) check both tables so an archived like can't be cast twice.
+    id = models.BigIntegerField(primary_key=True) # The original Vote id
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_votes')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey('content_type', 'object_id')
+    value = models.IntegerField(default=1)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='unique_archived_vote')
+        ]
+
+class ArchivedVoteTotal(models.Model):
+    # Archived likes per post/comment, so counters can be reconciled without scanning the archive
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='unique_archived_vote_total')
+        ]
+
+class PostLikeShard(models.Model):
+    # Pending like increments for posts in sharded counter mode (Post.like_shards > 0).
+    # A post's real like count is likes_count + the sum of its shards; shards are folded
+    # back into likes_count by `reconcile_counters`.
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='like_shard_rows')
+    shard = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'shard'], name='unique_post_like_shard')
+        ]
+
+class KarmaBucket(models.Model):
+    # Karma earned by `user` from likes cast during the UTC hour starting at `hour`.
+    # Maintained incrementally from Vote changes (see api/karma.py); the leaderboard sums the
+    # buckets of its window instead of re-aggregating the Vote table on every request.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='karma_buckets')
+    hour = models.DateTimeField()
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'hour'], name='unique_karma_bucket')
+        ]
         indexes = [
-            models.Index(fields=['created_at']), # For leaderboard filtering
-            models.Index(fields=['content_type', 'object_id']), # For lookups
+            models.Index(fields=['hour']), # For window sums and expiry
         ]
+
+class LeaderboardSnapshot(models.Model):
+    # Precomputed top authors of one leaderboard window ('1h', '24h', '7d'), refreshed on a
+    # fixed cadence (see api/leaderboard.py) so requests never aggregate anything.
+    # `entries` is [{'username': ..., 'score': ...}, ...], best first.
+    window = models.CharField(max_length=8, unique=True)
+    computed_at = models.DateTimeField()
+    entries = models.JSONField(default=list)
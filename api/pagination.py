@@ -0,0 +1,125 @@
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe cursor for a keyset position."""
+    raw = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, model, ordering):
+    """Inverse of encode_cursor; values are converted back with the model fields' to_python."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if len(raw) != len(ordering):
+            raise ValueError
+        return [
+            model._meta.get_field(name.lstrip('-')).to_python(value)
+            for name, value in zip(ordering, raw)
+        ]
+    except Exception:
+        raise NotFound('Invalid cursor')
+
+
+def keyset_filter(ordering, values):
+    """
+    Q() for "rows strictly after `values`" in `ordering`, e.g. for ('-created_at', '-id'):
+
+        created_at <= ts AND (created_at < ts OR (created_at = ts AND id < pk))
+
+    The leading bound on the first column lets the database turn this into a plain range
+    scan on the composite index, so a deep page costs the same as the first one.
+    """
+    after = Q()
+    equal = Q()
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        op = 'lt' if name.startswith('-') else 'gt'
+        after |= equal & Q(**{f'{field}__{op}': value})
+        equal &= Q(**{field: value})
+
+    first = ordering[0]
+    bound = Q(**{f"{first.lstrip('-')}__{'lte' if first.startswith('-') else 'gte'}": values[0]})
+    return bound & after
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering such as (created_at, id).
+
+    Unlike DRF's CursorPagination (single ordering field + offset for ties), the cursor
+    holds the full key of the last row, so there is never an OFFSET to skip over.
+    Views can override the ordering per request with get_keyset_ordering().
+    """
+    ordering = ('-created_at', '-id')
+    page_size = settings.FEED_PAGE_SIZE
+    max_page_size = settings.FEED_MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_ordering(self, view):
+        if view is not None and hasattr(view, 'get_keyset_ordering'):
+            return tuple(view.get_keyset_ordering())
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def page_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.page_size = self.get_page_size(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(keyset_filter(self.ordering, decode_cursor(cursor, queryset.model, self.ordering)))
+        # One extra row tells us whether there is a next page without a COUNT(*)
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        self.has_more = len(rows) > self.page_size
+        page = rows[:self.page_size]
+        self.last = page[-1] if page else None
+        return page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request, view)))
+
+    def get_next_link(self):
+        if not self.has_more:
+            return None
+        values = [getattr(self.last, name.lstrip('-')) for name in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(values))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'has_more': self.has_more,
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'has_more': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,213 @@
+"""
+Opt-in per-request profiling, for finding where a slow request spends its time (SQL,
+comment tree building, serialization, ...).
+
+With PROFILE_DIR set, ProfilingMiddleware profiles with cProfile:
+  - requests from staff users that send `X-Profile: 1`,
+  - a random PROFILE_SAMPLE_RATE fraction of all requests.
+Each profiled request writes two files to PROFILE_DIR:
+  - <id>.prof: pstats data (python -m pstats, snakeviz, flameprof / gprof2dot for a flame graph),
+  - <id>.json: the request, status, total time, and every SQL query with its time and database.
+Only the PROFILE_MAX_DUMPS newest requests are kept. `manage.py profile_dumps` lists and
+summarizes them; staff responses carry the dump's id in an X-Profile-Id header.
+
+Without PROFILE_DIR the middleware removes itself at startup (MiddlewareNotUsed): no cost at
+all. With it, unprofiled requests cost a header lookup and a random() call.
+
+The header is checked before the profiler starts: a request sending it is authenticated up
+front with the API's authentication classes (token and Basic auth otherwise only happen in
+the view), and it is ignored unless the user is staff. Nobody else can make a request pay
+for cProfile or hold the profiling lock. One request per process is profiled at a time (cProfile can't nest), others run normally.
+Under ASGI the profiler sees the event loop's thread, including any other request running
+on it meanwhile, and sync_to_async work as time spent waiting.
+"""
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework import exceptions
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+HEADER = 'HTTP_X_PROFILE'
+
+_lock = threading.Lock() # Held while a request is being profiled in this process
+
+
+class QueryLog:
+    """connection.execute_wrapper() hook recording every query with its time."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': self.alias, 'sql': sql, 'ms': round((time.perf_counter() - start) * 1000, 3), 'many': many,
+            })
+
+
+class Profile:
+    """A request being profiled: cProfile plus the SQL log of every database."""
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.logs = [QueryLog(alias) for alias in connections]
+        self.stack = ExitStack()
+
+    def wrap_queries(self):
+        for log in self.logs:
+            self.stack.enter_context(connections[log.alias].execute_wrapper(log))
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.elapsed = time.perf_counter() - self.started
+
+    def save(self, request, response, directory):
+        """Write <id>.prof and <id>.json to `directory`; returns the id."""
+        os.makedirs(directory, exist_ok=True)
+        dump_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}"
+        self.profiler.dump_stats(os.path.join(directory, f'{dump_id}.prof'))
+        match = getattr(request, 'resolver_match', None)
+        user = getattr(request, 'user', None)
+        queries = sorted((q for log in self.logs for q in log.queries), key=lambda q: -q['ms'])
+        summary = {
+            'id': dump_id,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'route': (match.url_name or match.view_name) if match else None,
+            'status': response.status_code,
+            'user': user.get_username() if user is not None and user.is_authenticated else None,
+            'ms': round(self.elapsed * 1000, 3),
+            'sql_ms': round(sum(q['ms'] for q in queries), 3),
+            'queries': queries, # Slowest first
+        }
+        with open(os.path.join(directory, f'{dump_id}.json'), 'w') as f:
+            json.dump(summary, f, indent=1)
+        prune(directory, settings.PROFILE_MAX_DUMPS)
+        return dump_id
+
+
+def dumps(directory=None):
+    """Ids of the dumps in `directory` (default PROFILE_DIR), newest first."""
+    directory = directory or settings.PROFILE_DIR
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted((name[:-5] for name in names if name.endswith('.json')), reverse=True)
+
+
+def load(dump_id, directory=None):
+    """The JSON summary of a dump."""
+    with open(os.path.join(directory or settings.PROFILE_DIR, f'{dump_id}.json')) as f:
+        return json.load(f)
+
+
+def prune(directory, keep):
+    """Delete all but the `keep` newest dumps."""
+    for dump_id in dumps(directory)[keep:]:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, dump_id + suffix))
+            except FileNotFoundError:
+                pass # Pruned by another worker
+
+
+def is_staff(request):
+    user = getattr(request, 'user', None)
+    return bool(user is not None and user.is_staff)
+
+
+def asked_by_staff(request):
+    """Whether `request` sends `X-Profile: 1` from a staff user."""
+    if request.META.get(HEADER) != '1':
+        return False
+    if is_staff(request): # Session user (AuthenticationMiddleware)
+        return True
+    drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        return bool(drf_request.user.is_staff)
+    except exceptions.APIException:
+        return False # Bad credentials: the view answers for them
+
+
+class ProfilingMiddleware:
+    # Async capable, so the ASGI mode keeps its async views (api/async_views.py) async
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_DIR:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def sampled(self):
+        return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        sampled = self.sampled()
+        if not (sampled or asked_by_staff(request)) or not _lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profile = Profile()
+            with profile.stack:
+                profile.wrap_queries()
+                profile.start()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    profile.stop()
+            return self.finish(request, response, profile, sampled)
+        finally:
+            _lock.release()
+
+    async def __acall__(self, request):
+        sampled = self.sampled()
+        # Only requests sending the header pay for the (sync) authentication
+        asked = not sampled and request.META.get(HEADER) == '1' and await sync_to_async(asked_by_staff)(request)
+        if not (sampled or asked) or not _lock.acquire(blocking=False):
+            return await self.get_response(request)
+        try:
+            # The async ORM runs queries in the request's sync thread: install the wrappers there
+            profile = Profile()
+            await sync_to_async(profile.wrap_queries)()
+            profile.start()
+            try:
+                response = await self.get_response(request)
+            finally:
+                profile.stop()
+                await sync_to_async(profile.stack.close)()
+            return await sync_to_async(self.finish)(request, response, profile, sampled)
+        finally:
+            _lock.release()
+
+    def finish(self, request, response, profile, sampled):
+        staff = is_staff(request)
+        if sampled or staff:
+            dump_id = profile.save(request, response, settings.PROFILE_DIR)
+            if staff:
+                response['X-Profile-Id'] = dump_id
+        return response
@@ -0,0 +1,136 @@
+"""
+Read replicas for the read-heavy views, with read-your-writes stickiness.
+
+With REPLICA_DATABASE_URLS set, every replica is a DATABASES entry ('replica1', ...)
+listed in REPLICA_DATABASES. Safe requests (GET/HEAD/OPTIONS) to the feed, post,
+comment and leaderboard views read from one replica picked per request, so a
+response never mixes two replicas' states. Everything else reads from and writes to
+'default': vote and other writes, management commands, background refreshers.
+
+Replicas lag. A user whose request wrote something (any unsafe method) is pinned to
+the primary for REPLICA_STICKY_SECONDS, so they see their own like or comment right
+away; keep it above the replicas' usual lag. Pins live in the cache, so with several
+worker processes they need a shared CACHE_BACKEND.
+
+Entries of shared caches that other viewers will reuse (the comment tree cache, the
+leaderboard snapshots) are always built from the primary: a lagging replica must not
+be frozen into an entry cached under a version that was bumped after the write.
+For the same reason responses read from a replica carry no feed or post ETag
+(api/conditional.py): those validators come from stamps bumped at write time, and a
+lagging body under the current stamp would be revalidated into 304s long after the
+replica caught up.
+
+The choice is kept in a context variable that ReplicaRouter reads, so it follows the
+request into sync_to_async threads and never leaks into another request.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# The database reads go to for the current request; None: Django's default routing (the primary)
+_read_db = ContextVar('read_db', default=None)
+
+
+def _pin_key(user_id):
+    return f'replica:pin:{user_id}'
+
+
+def pin(user):
+    """Send `user`'s reads to the primary for the next REPLICA_STICKY_SECONDS."""
+    if settings.REPLICA_DATABASES and user.is_authenticated:
+        cache.set(_pin_key(user.pk), 1, settings.REPLICA_STICKY_SECONDS)
+
+
+def is_pinned(user):
+    return user.is_authenticated and cache.get(_pin_key(user.pk)) is not None
+
+
+def replica_for(user):
+    """The replica `user`'s safe reads should use, or None for the primary."""
+    if not settings.REPLICA_DATABASES or is_pinned(user):
+        return None
+    return random.choice(settings.REPLICA_DATABASES)
+
+
+@contextmanager
+def reads_from(alias):
+    """Route reads in this block to `alias` (None: the primary)."""
+    token = _read_db.set(alias)
+    try:
+        yield
+    finally:
+        _read_db.reset(token)
+
+
+def switch_to_replica(user):
+    """Inside a reads_from() block: route the rest of it to replica_for(user)."""
+    _read_db.set(replica_for(user))
+
+
+def primary():
+    return reads_from(DEFAULT_DB_ALIAS)
+
+
+def on_replica():
+    """Whether reads currently go to a replica."""
+    return _read_db.get() not in (None, DEFAULT_DB_ALIAS)
+
+
+class ReplicaRouter:
+    """Reads go where reads_from() says; writes and migrations always go to the primary."""
+
+    def db_for_read(self, model, **hints):
+        return _read_db.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # Replicas hold the same rows as the primary
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaPinMiddleware:
+    """Pins the user of every unsafe request to the primary (see pin())."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            self.pin(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            # request.user may still be the lazy session user, which loads synchronously
+            await sync_to_async(self.pin)(request)
+        return response
+
+    def pin(self, request):
+        # DRF copies the user it authenticated (session, basic auth) onto the Django request
+        user = getattr(request, 'user', None)
+        if user is not None:
+            pin(user)
@@ -0,0 +1,176 @@
+"""
+Full-text search over posts and comments (GET /api/search/?q=).
+
+Each backend's own inverted index, kept in sync by the database itself, so every
+write path (views, admin, bulk_create in generate_data, raw deletes) is covered:
+  - PostgreSQL: a GIN index on to_tsvector('english', content), queried with
+    plainto_tsquery and ranked by ts_rank;
+  - SQLite: an FTS5 table per model over the model's own table (external content,
+    so text isn't stored twice; porter stemming) kept current by triggers, ranked by bm25;
+  - MySQL: a FULLTEXT index, queried in boolean mode with every word required.
+
+A query is split into words and matches the rows containing all of them. Each table
+is asked for its best `offset + limit + 1` matches only, through the index, and the
+two lists are merged by score; only the page's rows are then loaded. bm25 and ts_rank
+depend on each table's own statistics (row count, document lengths, word frequencies),
+so scores are first divided by the best score of their table: 1.0 is the best post and
+the best comment, and the merge interleaves the two by how close they come to those. Ranking still
+scores every row that contains all the words, so a query made only of very common
+words costs more than a selective one; SEARCH_MAX_RESULTS caps how deep pages may go.
+
+On SQLite, a migration that rebuilds api_post or api_comment (any AlterField) drops
+their triggers; install() runs again after every migrate (ApiConfig.ready) and
+recreates them, reindexing if any were missing.
+"""
+import re
+
+from django.db import connections, router
+from django.db.migrations.recorder import MigrationRecorder
+
+from .models import Post, Comment
+
+MODELS = {'post': Post, 'comment': Comment}
+MAX_WORDS = 10
+MIGRATION = ('api', '0011_search_index')
+
+
+def words(query):
+    """The searchable words of `query`, lowercased; punctuation and FTS operators are dropped."""
+    return re.findall(r'\w+', query.lower())[:MAX_WORDS]
+
+
+def _fts(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def install(connection):
+    """Create the search index of both models on `connection` if missing (idempotent)."""
+    with connection.cursor() as cursor:
+        for model in MODELS.values():
+            table = model._meta.db_table
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {table}_search_idx ON {table} USING GIN (to_tsvector('english', content))"
+                )
+            elif connection.vendor == 'mysql':
+                cursor.execute(
+                    "SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() "
+                    "AND table_name = %s AND index_name = %s", [table, f'{table}_search_idx']
+                )
+                if cursor.fetchone() is None:
+                    cursor.execute(f"ALTER TABLE {table} ADD FULLTEXT INDEX {table}_search_idx (content)")
+            elif connection.vendor == 'sqlite':
+                _install_fts(cursor, table, _fts(model))
+
+
+def _install_fts(cursor, table, fts):
+    triggers = {
+        f'{fts}_insert': f"AFTER INSERT ON {table} BEGIN "
+                         f"INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+        f'{fts}_delete': f"AFTER DELETE ON {table} BEGIN "
+                         f"INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); END",
+        f'{fts}_update': f"AFTER UPDATE OF content ON {table} BEGIN "
+                         f"INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content); "
+                         f"INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content); END",
+    }
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE %s", [f'{fts}%'])
+    existing = {name for name, in cursor.fetchall()}
+    if existing >= {fts, *triggers}:
+        return
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+        f"content, content='{table}', content_rowid='id', tokenize='porter unicode61')"
+    )
+    for name, body in triggers.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+    # New, or rows changed while a trigger was missing: index the table from scratch
+    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        for model in MODELS.values():
+            table = model._meta.db_table
+            if connection.vendor == 'postgresql':
+                cursor.execute(f"DROP INDEX IF EXISTS {table}_search_idx")
+            elif connection.vendor == 'mysql':
+                cursor.execute(f"ALTER TABLE {table} DROP INDEX {table}_search_idx")
+            elif connection.vendor == 'sqlite':
+                for suffix in ('insert', 'delete', 'update'):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {_fts(model)}_{suffix}")
+                cursor.execute(f"DROP TABLE IF EXISTS {_fts(model)}")
+
+
+def reinstall_after_migrate(sender, using, **kwargs):
+    """post_migrate receiver: restore the index on `using` once its migration is applied."""
+    connection = connections[using]
+    if router.allow_migrate(using, 'api') and MIGRATION in MigrationRecorder(connection).applied_migrations():
+        install(connection)
+
+
+def matches(model, terms, limit):
+    """[(score, id)] of the best `limit` rows of `model` containing all `terms`, best first."""
+    connection = connections[router.db_for_read(model)]
+    table = model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT ts_rank(to_tsvector('english', content), query) AS score, id "
+            f"FROM {table}, plainto_tsquery('english', %s) query "
+            f"WHERE to_tsvector('english', content) @@ query ORDER BY score DESC, id DESC LIMIT %s"
+        )
+        params = [' '.join(terms), limit]
+    elif connection.vendor == 'mysql':
+        sql = (
+            f"SELECT MATCH (content) AGAINST (%s IN BOOLEAN MODE) AS score, id FROM {table} "
+            f"WHERE MATCH (content) AGAINST (%s IN BOOLEAN MODE) ORDER BY score DESC, id DESC LIMIT %s"
+        )
+        expression = ' '.join(f'+{term}' for term in terms)
+        params = [expression, expression, limit]
+    elif connection.vendor == 'sqlite':
+        fts = _fts(model)
+        # bm25() is lower for better matches; ORDER BY rank is FTS5's own bm25 ordering
+        sql = f"SELECT -bm25({fts}), rowid FROM {fts} WHERE {fts} MATCH %s ORDER BY rank LIMIT %s"
+        params = [' '.join(f'"{term}"' for term in terms), limit]
+    else:
+        raise NotImplementedError(f"No full-text search for {connection.vendor}")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(float(score), pk) for score, pk in cursor.fetchall()]
+
+
+def search(query, kinds=None, offset=0, limit=20):
+    """
+    One page of results for `query`: [(kind, id, score)], best first, plus whether there
+    are more. `kinds` restricts to 'post' and/or 'comment'.
+    """
+    terms = words(query)
+    if not terms:
+        return [], False
+    hits = []
+    for kind in kinds or MODELS:
+        found = matches(MODELS[kind], terms, offset + limit + 1)
+        # Every page's list starts at the best match, so the scale is the same on all of them
+        best = max((score for score, _ in found), default=0) or 1
+        hits += [(score / best, kind, pk) for score, pk in found]
+    hits.sort(key=lambda hit: (-hit[0], hit[1], -hit[2]))
+    page = hits[offset:offset + limit + 1]
+    return [(kind, pk, score) for score, kind, pk in page[:limit]], len(page) > limit
+
+
+def load(hits):
+    """The rows of search() `hits` as result dicts (see SearchResultSerializer), in order."""
+    rows = {}
+    for kind, model in MODELS.items():
+        ids = [pk for hit_kind, pk, _ in hits if hit_kind == kind]
+        if not ids:
+            continue
+        post_field = 'id' if model is Post else 'post_id'
+        for row in model.objects.filter(pk__in=ids).values(
+            'id', 'content', 'created_at', 'likes_count', 'author_id', 'author__username', post_field
+        ):
+            rows[(kind, row['id'])] = {
+                **row, 'type': kind, 'post': row[post_field],
+                'author': {'id': row['author_id'], 'username': row['author__username']},
+            }
+    # A row deleted since it was matched is simply left out
+    return [{**rows[(kind, pk)], 'score': score} for kind, pk, score in hits if (kind, pk) in rows]
@@ -1,57 +1,158 @@
 from rest_framework import serializers
-from django.contrib.auth import get_user_model
-from .models import Post, Comment, Vote
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from .models import Post, Comment, Vote, MAX_COMMENT_DEPTH
 from django.contrib.contenttypes.models import ContentType
+from . import likes
 
 User = get_user_model()
 
+def viewer_liked(serializer, model, obj):
+    # Membership test against the viewer's cached liked ids (api/likes.py), loaded once per
+    # response. Views can pass them in the context as 'liked_<model>_ids'.
+    context = serializer.context
+    key = f'liked_{model._meta.model_name}_ids'
+    if key not in context:
+        user = getattr(context.get('request'), 'user', None)
+        context[key] = likes.liked_ids(user, model) if user is not None else likes.NOTHING
+    return obj.pk in context[key]
+
+class SparseFieldsMixin:
+    # Drops the fields not named in context['fields'] (?fields= / ?include=, see api/fieldsets.py)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.context.get('fields')
+        if selected is not None:
+            for name in set(self.fields) - selected:
+                self.fields.pop(name)
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username']
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     replies = serializers.SerializerMethodField()
     likes_count = serializers.IntegerField(read_only=True)
-    user_has_liked = serializers.BooleanField(read_only=True)
+    user_has_liked = serializers.SerializerMethodField()
+    reply_count = serializers.IntegerField(read_only=True)
+    more_replies = serializers.SerializerMethodField()
+    depth = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Comment
-        fields = ['id', 'author', 'content', 'created_at', 'parent', 'replies', 'likes_count', 'user_has_liked', 'post']
+        fields = [
+            'id', 'author', 'content', 'created_at', 'parent', 'replies', 'likes_count', 'user_has_liked', 'post',
+            'reply_count', 'more_replies', 'depth'
+        ]
+        # ?include= name -> fields, for the fields that cost a join or a lookup
+        includes = {'author': ['author'], 'user_has_liked': ['user_has_liked']}
+
+    def validate(self, attrs):
+        parent = attrs.get('parent')
+        post = attrs.get('post') or getattr(self.instance, 'post', None)
+        if parent is not None:
+            if post is not None and parent.post_id != post.id:
+                raise serializers.ValidationError({'parent': 'Reply must belong to the same post.'})
+            if parent.depth >= MAX_COMMENT_DEPTH:
+                # The materialized path has a fixed maximum length
+                raise serializers.ValidationError({'parent': 'Maximum reply depth reached.'})
+        return attrs
 
     def get_replies(self, obj):
         # Expects 'prefetched_replies' to be set on the object by the view/builder to avoid N+1
         if hasattr(obj, 'prefetched_replies'):
-            return CommentSerializer(obj.prefetched_replies, many=True).data
+            return CommentSerializer(obj.prefetched_replies, many=True, context=self.context).data
         return []
 
-class PostSerializer(serializers.ModelSerializer):
+    def get_user_has_liked(self, obj):
+        return viewer_liked(self, Comment, obj)
+
+    def get_more_replies(self, obj):
+        # Direct replies not included in this response (page them via /comments/<id>/replies/)
+        return obj.reply_count - len(getattr(obj, 'prefetched_replies', ()))
+
+class PostSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     likes_count = serializers.IntegerField(read_only=True)
-    user_has_liked = serializers.BooleanField(read_only=True)
+    comment_count = serializers.IntegerField(read_only=True)
+    user_has_liked = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'author', 'content', 'created_at', 'likes_count', 'user_has_liked']
+        fields = ['id', 'author', 'content', 'created_at', 'likes_count', 'comment_count', 'user_has_liked']
+        includes = {'author': ['author'], 'user_has_liked': ['user_has_liked']}
+
+    def get_user_has_liked(self, obj):
+        return viewer_liked(self, Post, obj)
 
 class PostDetailSerializer(PostSerializer):
     comments = serializers.SerializerMethodField()
+    comments_next = serializers.SerializerMethodField()
+    has_more_comments = serializers.SerializerMethodField()
 
     class Meta(PostSerializer.Meta):
-        fields = PostSerializer.Meta.fields + ['comments']
+        fields = PostSerializer.Meta.fields + ['comments', 'comments_next', 'has_more_comments']
+        includes = {**PostSerializer.Meta.includes, 'comments': ['comments', 'comments_next', 'has_more_comments']}
 
     def get_comments(self, obj):
+        # Tree already rendered to plain dicts by the fast path (api/tree.py)
+        if hasattr(obj, 'rendered_comments'):
+            return obj.rendered_comments
         # Expects 'prefetched_comments' (top-level comments) to be set on the object
         if hasattr(obj, 'prefetched_comments'):
-            return CommentSerializer(obj.prefetched_comments, many=True).data
+            return CommentSerializer(obj.prefetched_comments, many=True, context=self.context).data
         return []
 
+    def get_comments_next(self, obj):
+        # URL of the next page of top-level threads, set by the view
+        return getattr(obj, 'comments_next', None)
+
+    def get_has_more_comments(self, obj):
+        return getattr(obj, 'comments_next', None) is not None
+
 class VoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vote
         fields = ['id', 'value']
 
+class SearchResultSerializer(serializers.Serializer):
+    # A post or a comment (`type`); `post` is the post itself or the one commented on
+    type = serializers.CharField()
+    id = serializers.IntegerField()
+    post = serializers.IntegerField()
+    author = UserSerializer()
+    content = serializers.CharField()
+    created_at = serializers.DateTimeField()
+    likes_count = serializers.IntegerField()
+    score = serializers.FloatField()
+
 class LeaderboardEntrySerializer(serializers.Serializer):
     username = serializers.CharField()
     score = serializers.IntegerField()
+
+class BulkVoteOperationSerializer(serializers.Serializer):
+    model = serializers.ChoiceField(choices=['post', 'comment'])
+    id = serializers.IntegerField(min_value=1)
+    action = serializers.ChoiceField(choices=['like', 'unlike'])
+
+class BulkVoteSerializer(serializers.Serializer):
+    operations = BulkVoteOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, value):
+        limit = settings.VOTE_BULK_MAX_OPERATIONS
+        if len(value) > limit:
+            raise serializers.ValidationError(f'At most {limit} operations per request.')
+        return value
+
+class LoginSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(trim_whitespace=False, write_only=True)
+
+    def validate(self, attrs):
+        user = authenticate(self.context.get('request'), username=attrs['username'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError('Unable to log in with the provided credentials.')
+        attrs['user'] = user
+        return attrs
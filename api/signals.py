@@ -0,0 +1,103 @@
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import archive, conditional, counters, hot, karma, tokens, tree_cache
+from .models import User, Post, Comment, Vote, ArchivedVote
+from .votes import apply_vote_changes
+
+# Vote and Comment side effects are wired through signals so that every way of creating or
+# removing them (the views, the admin, the shell, tests) keeps the counters and the karma
+# ledger in step.
+
+
+@receiver(pre_save, sender=Vote)
+def remember_vote_timestamp(sender, instance, raw=False, **kwargs):
+    # Re-timestamping an existing vote must move its karma to the new hour bucket,
+    # so we need the timestamp it was originally counted under.
+    if raw or instance.pk is None or hasattr(instance, '_ledger_created_at'):
+        return
+    instance._ledger_created_at = Vote.objects.filter(pk=instance.pk).values_list(
+        'created_at', flat=True
+    ).first()
+
+
+@receiver(post_save, sender=Vote)
+def vote_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_ledger_created_at', None)
+    instance._ledger_created_at = instance.created_at
+
+    if created:
+        apply_vote_changes([
+            (instance.content_type_id, instance.object_id, instance.created_at, 1)
+        ], [instance.user_id])
+    elif previous is not None and previous != instance.created_at:
+        apply_vote_changes([
+            (instance.content_type_id, instance.object_id, previous, -1),
+            (instance.content_type_id, instance.object_id, instance.created_at, 1),
+        ], [instance.user_id])
+
+
+@receiver(post_delete, sender=Vote)
+def vote_deleted(sender, instance, **kwargs):
+    apply_vote_changes([
+        (instance.content_type_id, instance.object_id, instance.created_at, -1)
+    ], [instance.user_id])
+
+
+@receiver(post_delete, sender=ArchivedVote)
+def archived_vote_deleted(sender, instance, **kwargs):
+    # ORM deletes only (cascades from users and posts, the admin); votes.unlike handles its own
+    archive.remove_from_totals([(instance.content_type_id, instance.object_id)])
+    apply_vote_changes([
+        (instance.content_type_id, instance.object_id, instance.created_at, -1)
+    ], [instance.user_id])
+
+
+@receiver(pre_delete, sender=Post)
+@receiver(pre_delete, sender=Comment)
+def liked_object_deleting(sender, instance, **kwargs):
+    # Deleting a post or comment cascades to its votes, possibly after the row is gone:
+    # keep its author so the ledger can still take the votes' karma back
+    karma.remember_authors(sender, [instance])
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.record_comment_change(instance.post_id, instance.parent_id, 1)
+        conditional.bump_posts([instance.post_id]) # comment_count changed
+    tree_cache.invalidate_on_commit([instance.post_id])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.record_comment_change(instance.post_id, instance.parent_id, -1)
+    conditional.bump_posts([instance.post_id])
+    tree_cache.invalidate_on_commit([instance.post_id])
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    conditional.bump_posts([instance.pk])
+    if created:
+        hot.update([instance.pk])
+        # A new post starts a fresh tree version even if its id was used before
+        tree_cache.invalidate_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    conditional.bump_posts([instance.pk])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Token authentication caches users (api/tokens.py); a new password or is_active must apply now
+    tokens.forget_user(instance.pk)
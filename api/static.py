@@ -0,0 +1,33 @@
+"""
+WhiteNoise, without breaking the ASGI mode's async views.
+
+WhiteNoiseMiddleware is sync only. Django adapts every handler below a sync-only
+middleware to sync, so under ASGI each request would run the async views
+(api/async_views.py) through async_to_sync: a thread hop per request, undoing the point
+of them. StaticFilesMiddleware also has an async path. Static files are still served
+synchronously (finding the file and building the response doesn't touch the network, and
+ASGI streams the file). Every other request awaits the rest of the chain directly.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        static_file = self.find_file(request.path_info) if self.autorefresh else self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
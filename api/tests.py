@@ -1,16 +1,47 @@
-from django.test import TestCase
+import base64
+import gzip
+import json
+import os
+import tempfile
+import threading
+from io import StringIO
+from unittest import mock
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, connection, transaction
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.asgi import ASGIHandler
+from django.http import HttpResponse
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from datetime import timedelta
-from .models import Post, Comment, Vote
+from django.db.models import Count, QuerySet, Sum
+from .models import (
+    Post, Comment, Vote, ArchivedVote, ArchivedVoteTotal, KarmaBucket, PostLikeShard, LeaderboardSnapshot, path_ids
+)
+from django.core.cache import cache
+from . import (
+    archive, counters, hot, karma, leaderboard, likes, metrics, profiling, routing, search, static, threads, tree,
+    tree_cache, votes,
+)
+from .serializers import CommentSerializer
+from rest_framework.renderers import JSONRenderer
+from .pagination import KeysetPagination
 from django.contrib.contenttypes.models import ContentType
 from rest_framework.test import APIClient
 from django.urls import reverse
+from django.utils.http import urlencode
 
 User = get_user_model()
 
 class LeaderboardTestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.user1 = User.objects.create_user(username='alice', password='password')
         self.user2 = User.objects.create_user(username='bob', password='password')
@@ -118,3 +149,1521 @@ class LeaderboardTestCase(TestCase):
         self.assertEqual(len(bobs_comment['replies']), 1)
         charlies_reply = bobs_comment['replies'][0]
         self.assertEqual(charlies_reply['content'], "Charlie's reply")
+
+
+class KarmaLedgerTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        self.comment = Comment.objects.create(author=self.alice, post=self.post, content="Alice's comment")
+        self.post_ct = ContentType.objects.get_for_model(Post)
+        self.comment_ct = ContentType.objects.get_for_model(Comment)
+
+    def vote_at(self, user, ct, obj, when):
+        v = Vote.objects.create(user=user, content_type=ct, object_id=obj.id)
+        v.created_at = when
+        v.save()
+        return v
+
+    def test_like_and_unlike_through_vote_view(self):
+        self.client.force_authenticate(self.bob)
+        url = reverse('vote', args=['post', self.post.id])
+
+        self.client.post(url)
+        self.assertEqual(karma.ledger_scores()[self.alice.id], 5)
+
+        self.client.post(url) # Toggle off
+        self.assertEqual(karma.ledger_scores()[self.alice.id], 0)
+        self.assertEqual(self.client.get(reverse('leaderboard')).json(), [])
+
+    def test_cascade_deletes_take_karma_back(self):
+        reply = Comment.objects.create(author=self.alice, post=self.post, parent=self.comment, content="Reply")
+        other = Post.objects.create(author=self.alice, content="Another post")
+        liked = Comment.objects.create(author=self.alice, post=other, content="Liked")
+        liked_reply = Comment.objects.create(author=self.alice, post=other, parent=liked, content="Liked reply")
+        self.client.force_authenticate(self.bob)
+        for model, obj in (('post', self.post), ('comment', self.comment), ('comment', reply),
+                           ('comment', liked), ('comment', liked_reply)):
+            self.client.put(reverse('vote', args=[model, obj.id]))
+        self.assertEqual(karma.ledger_scores()[self.alice.id], 9)
+
+        self.client.delete(reverse('comment-detail', args=[liked.id])) # Takes its liked reply with it
+        self.assertEqual(karma.ledger_scores()[self.alice.id], 7)
+        self.client.delete(reverse('post-detail', args=[self.post.id]))
+        self.assertEqual(karma.ledger_scores()[self.alice.id], 0)
+        call_command('karma_ledger', '--verify', stdout=StringIO())
+
+    def test_window_edge_is_exact(self):
+        now = timezone.now()
+        # Both votes can land in the same hour bucket; only the one inside the window counts
+        self.vote_at(self.bob, self.post_ct, self.post, now - timedelta(hours=23, minutes=59, seconds=59))
+        self.vote_at(self.bob, self.comment_ct, self.comment, now - timedelta(hours=24, seconds=1))
+
+        self.assertEqual(karma.ledger_scores(now=now)[self.alice.id], 5)
+        self.assertEqual(karma.top_scores(now=now), [(self.alice.id, 5)])
+
+    def test_verify_command_detects_and_repairs_drift(self):
+        self.vote_at(self.bob, self.post_ct, self.post, timezone.now() - timedelta(hours=2))
+        call_command('karma_ledger', '--verify', stdout=StringIO())
+
+        KarmaBucket.objects.update(score=42)
+        with self.assertRaises(CommandError):
+            call_command('karma_ledger', '--verify', stdout=StringIO(), stderr=StringIO())
+
+        call_command('karma_ledger', '--rebuild', '--verify', stdout=StringIO())
+        self.assertEqual(KarmaBucket.objects.get().score, 5)
+
+    def test_window_scan_is_covered_by_the_karma_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Plan text is backend specific')
+        now = timezone.now()
+        plan = Post.objects.filter(
+            votes__content_type=self.post_ct, votes__created_at__gte=now - timedelta(hours=1), votes__created_at__lt=now
+        ).values('author').annotate(score=Count('votes')).explain()
+        self.assertIn('USING COVERING INDEX api_vote_karma_idx', plan)
+
+
+class LeaderboardSnapshotTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        self.comment = Comment.objects.create(author=self.bob, post=self.post, content="Bob's comment")
+        post_ct = ContentType.objects.get_for_model(Post)
+        comment_ct = ContentType.objects.get_for_model(Comment)
+        for name, ct, obj, age in [
+            ('u1', post_ct, self.post, timedelta(minutes=10)),
+            ('u2', comment_ct, self.comment, timedelta(minutes=10)),
+            ('u3', comment_ct, self.comment, timedelta(hours=3)),
+            ('u4', comment_ct, self.comment, timedelta(days=3)),
+        ]:
+            vote = Vote.objects.create(user=User.objects.create_user(username=name, password='password'), content_type=ct, object_id=obj.id)
+            vote.created_at = timezone.now() - age
+            vote.save()
+
+    def get(self, **params):
+        return self.client.get(reverse('leaderboard'), params)
+
+    def test_windows_and_limit(self):
+        scores = lambda response: [(e['username'], e['score']) for e in response.json()]
+        self.assertEqual(scores(self.get(window='1h')), [('alice', 5), ('bob', 1)])
+        self.assertEqual(scores(self.get()), [('alice', 5), ('bob', 2)])
+        self.assertEqual(scores(self.get(window='7d')), [('alice', 5), ('bob', 3)])
+        self.assertEqual(scores(self.get(window='7d', limit=1)), [('alice', 5)])
+        self.assertEqual(self.get(window='2w').status_code, 400)
+        self.assertIn('X-Computed-At', self.get())
+
+    def test_requests_are_served_from_the_snapshot(self):
+        self.get()
+        snap = LeaderboardSnapshot.objects.get(window='24h')
+        Vote.objects.create(user=self.bob, content_type=ContentType.objects.get_for_model(Post), object_id=self.post.id)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get()
+        self.assertEqual(len(queries), 0) # Not even the snapshot row: it is cached
+        self.assertEqual(response.json()[0]['score'], 5) # As of computed_at
+        self.assertEqual(response['X-Computed-At'], snap.computed_at.isoformat())
+
+        call_command('refresh_leaderboard', stdout=StringIO())
+        self.assertEqual(self.get().json()[0]['score'], 10)
+        self.assertEqual(LeaderboardSnapshot.objects.count(), 3)
+
+    def test_stale_snapshot_is_refreshed_by_one_reader(self):
+        self.get()
+        LeaderboardSnapshot.objects.update(computed_at=timezone.now() - timedelta(hours=1), entries=[])
+        cache.clear()
+        self.assertEqual(self.get().json()[0]['username'], 'alice')
+        self.assertEqual(LeaderboardSnapshot.objects.get(window='24h').entries[0]['score'], 5)
+
+        # While another reader holds the refresh lock, the stale snapshot is served as is
+        LeaderboardSnapshot.objects.update(computed_at=timezone.now() - timedelta(hours=1), entries=[])
+        cache.clear()
+        cache.add('leaderboard:24h:lock', 1)
+        self.assertEqual(self.get().json(), [])
+
+    def test_background_refresher(self):
+        stop = threading.Event()
+        with mock.patch.object(leaderboard, 'refresh', side_effect=lambda: stop.set()) as refresh:
+            leaderboard.run_refresher(interval=0.01, stop=stop)
+        refresh.assert_called_once_with()
+
+class CounterTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+
+    def test_counters_follow_votes_and_comments(self):
+        self.client.force_authenticate(self.bob)
+        self.client.post(reverse('vote', args=['post', self.post.id]))
+        self.client.post(reverse('comment-list'), {'post': self.post.id, 'content': 'Hi'}, format='json')
+        comment = Comment.objects.get()
+        self.client.post(reverse('vote', args=['comment', comment.id]))
+
+        self.post.refresh_from_db()
+        comment.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comment_count), (1, 1))
+        self.assertEqual(comment.likes_count, 1)
+
+        self.client.post(reverse('vote', args=['post', self.post.id])) # Unlike
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_sharded_post_counts_are_exact_on_read(self):
+        counters.set_sharding(self.post.id, 4)
+        for name in ('u1', 'u2', 'u3'):
+            user = User.objects.create_user(username=name, password='password')
+            self.client.force_authenticate(user)
+            self.client.post(reverse('vote', args=['post', self.post.id]))
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0) # Everything is still in the shards
+        self.assertEqual(PostLikeShard.objects.aggregate(n=Sum('count'))['n'], 3)
+        self.assertEqual(self.client.get(reverse('post-detail', args=[self.post.id])).json()['likes_count'], 3)
+        self.assertEqual(self.client.get(reverse('post-list')).json()['results'][0]['likes_count'], 3)
+
+        counters.fold_shards()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 3)
+        self.assertFalse(PostLikeShard.objects.exists())
+
+    def test_likes_on_a_sharded_post_never_write_its_row(self):
+        counters.set_sharding(self.post.id, 4)
+        with CaptureQueriesContext(connection) as queries:
+            votes.like(self.bob, Post, self.post.id)
+        self.assertFalse([q['sql'] for q in queries if q['sql'].startswith('UPDATE "api_post"')])
+        self.assertEqual(PostLikeShard.objects.aggregate(n=Sum('count'))['n'], 1)
+
+    def test_reconcile_keeps_pending_shards_pending(self):
+        counters.set_sharding(self.post.id, 4)
+        for name in ('u1', 'u2', 'u3'):
+            user = User.objects.create_user(username=name, password='password')
+            self.client.force_authenticate(user)
+            self.client.post(reverse('vote', args=['post', self.post.id]))
+        Post.objects.filter(pk=self.post.pk).update(likes_count=5)
+
+        # Shard increments landing after the fold are left pending, not counted twice
+        with mock.patch.object(counters, 'fold_shards'):
+            self.assertEqual(counters.reconcile(fix=True), [('post.likes_count', self.post.id, 8, 3)])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+        self.assertEqual(self.client.get(reverse('post-detail', args=[self.post.id])).json()['likes_count'], 3)
+        self.assertEqual(counters.reconcile(), [])
+
+    def test_reconcile_locks_the_rows_it_fixes(self):
+        Post.objects.filter(pk=self.post.pk).update(likes_count=2)
+        # SQLite has no FOR UPDATE: check the locking reads were asked for instead
+        with mock.patch.object(QuerySet, 'select_for_update', autospec=True, side_effect=lambda qs, **kw: qs) as lock:
+            counters.reconcile(fix=True)
+        self.assertEqual({call.args[0].model for call in lock.call_args_list}, {Post, PostLikeShard})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_reconcile_command_fixes_drift(self):
+        Vote.objects.create(user=self.bob, content_type=ContentType.objects.get_for_model(Post), object_id=self.post.id)
+        Post.objects.filter(pk=self.post.pk).update(likes_count=7, comment_count=3)
+
+        with self.assertRaises(CommandError):
+            call_command('reconcile_counters', stdout=StringIO(), stderr=StringIO())
+        call_command('reconcile_counters', '--fix', stdout=StringIO(), stderr=StringIO())
+
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comment_count), (1, 0))
+        call_command('reconcile_counters', stdout=StringIO())
+
+
+
+class GenerateDataTestCase(TestCase):
+    def generate(self, seed=7):
+        call_command(
+            'generate_data', '--users', '20', '--posts', '15', '--comments-per-post', '6', '--max-depth', '3',
+            '--likes-per-post', '4', '--likes-per-comment', '2', '--batch-size', '4', '--seed', str(seed),
+            stdout=StringIO()
+        )
+
+    def fingerprint(self):
+        return (
+            list(Post.objects.order_by('pk').values_list('content', 'likes_count', 'comment_count')),
+            list(Comment.objects.order_by('pk').values_list('content', 'depth', 'reply_count', 'likes_count')),
+            Vote.objects.count(),
+        )
+
+    def test_generated_data_is_consistent(self):
+        self.generate()
+        self.assertEqual(User.objects.filter(username__startswith='gen_').count(), 20)
+        self.assertEqual(Post.objects.count(), 15)
+        self.assertTrue(Comment.objects.filter(depth__gt=0).exists())
+        self.assertFalse(Comment.objects.filter(depth__gt=3).exists())
+        for comment in Comment.objects.all():
+            ids = path_ids(comment.path)
+            self.assertEqual(ids[-1], comment.pk)
+            self.assertEqual(ids[-2] if len(ids) > 1 else None, comment.parent_id)
+        call_command('reconcile_counters', stdout=StringIO())
+        call_command('karma_ledger', '--verify', stdout=StringIO())
+        # Sequences were moved past the generated ids
+        self.assertGreater(Post.objects.create(author=User.objects.first(), content='New').pk, 15)
+
+        with self.assertRaises(CommandError):
+            self.generate()
+
+    def test_same_seed_same_data(self):
+        self.generate()
+        first = self.fingerprint()
+        User.objects.all().delete()
+        Vote.objects.all().delete()
+        self.generate()
+        self.assertEqual(self.fingerprint(), first)
+        User.objects.all().delete()
+        Vote.objects.all().delete()
+        self.generate(seed=8)
+        self.assertNotEqual(self.fingerprint(), first)
+
+class VoteEndpointTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, content='Hi')
+        self.client.force_authenticate(self.bob)
+
+    def test_put_and_delete_are_idempotent(self):
+        url = reverse('vote', args=['post', self.post.id])
+        first = self.client.put(url)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json(), {'likes_count': 1, 'user_has_liked': True})
+        again = self.client.put(url)
+        self.assertEqual((again.status_code, again.json()['likes_count']), (200, 1))
+        self.assertEqual(Vote.objects.count(), 1)
+        self.assertEqual(dict(karma.ledger_scores())[self.alice.id], 5)
+
+        self.assertEqual(self.client.delete(url).json(), {'likes_count': 0, 'user_has_liked': False})
+        self.assertEqual(self.client.delete(url).json()['likes_count'], 0)
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(dict(karma.ledger_scores()).get(self.alice.id, 0), 0)
+        self.assertEqual(counters.reconcile(), [])
+
+    def test_toggle_reports_what_it_did(self):
+        url = reverse('vote', args=['post', self.post.id])
+        with mock.patch.object(votes, 'like', return_value=False): # Lost to a concurrent double click
+            response = self.client.post(url)
+        self.assertEqual((response.status_code, response.json()['status']), (200, 'unchanged'))
+        response = self.client.post(url)
+        self.assertEqual((response.status_code, response.json()['status']), (201, 'liked'))
+        response = self.client.post(url)
+        self.assertEqual((response.status_code, response.json()['status']), (200, 'unliked'))
+        self.assertEqual(self.client.post(reverse('vote', args=['post', 999])).status_code, 404)
+
+    def test_unlike_takes_karma_from_the_original_hour(self):
+        url = reverse('vote', args=['comment', self.comment.id])
+        self.client.put(url)
+        old = timezone.now() - timedelta(hours=3)
+        Vote.objects.update(created_at=old) # Bypasses signals: move the ledger entry by hand
+        karma.rebuild_ledger()
+        self.client.delete(url)
+        self.assertEqual(KarmaBucket.objects.get(hour=karma.hour_bucket(old)).score, 0)
+
+    def test_toggle_and_missing_targets(self):
+        url = reverse('vote', args=['comment', self.comment.id])
+        liked = self.client.post(url)
+        self.assertEqual(liked.status_code, 201)
+        self.assertEqual(liked.json(), {'status': 'liked', 'likes_count': 1, 'user_has_liked': True})
+        self.assertEqual(self.client.post(url).json()['status'], 'unliked')
+
+        self.assertEqual(self.client.put(reverse('vote', args=['post', 999])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('vote', args=['post', 999])).status_code, 404)
+        self.assertEqual(self.client.put(reverse('vote', args=['user', 1])).status_code, 400)
+        self.assertFalse(Vote.objects.exists())
+
+class AsyncReadPathTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.posts = [Post.objects.create(author=self.alice, content=f'Post {i}') for i in range(3)]
+        root = Comment.objects.create(post=self.posts[0], author=self.bob, content='Root')
+        Comment.objects.create(post=self.posts[0], author=self.alice, content='Reply', parent=root)
+        self.client.force_authenticate(self.bob)
+        self.client.put(reverse('vote', args=['post', self.posts[0].id]))
+        self.client.put(reverse('vote', args=['comment', root.id]))
+
+    def test_same_responses_as_sync_views(self):
+        pairs = [
+            (reverse('post-list') + '?page_size=2', reverse('async-post-list') + '?page_size=2'),
+            (reverse('post-detail', args=[self.posts[0].id]), reverse('async-post-detail', args=[self.posts[0].id])),
+            (reverse('leaderboard'), reverse('async-leaderboard')),
+        ]
+        for sync_url, async_url in pairs:
+            expected = self.client.get(sync_url).json()
+            actual = self.client.get(async_url).json()
+            if 'next' in expected:
+                # Same cursor, different endpoint
+                self.assertEqual(actual.pop('next').split('?')[1], expected.pop('next').split('?')[1])
+            self.assertEqual(actual, expected)
+
+        detail = self.client.get(reverse('async-post-detail', args=[self.posts[0].id])).json()
+        self.assertTrue(detail['user_has_liked'])
+        self.assertTrue(detail['comments'][0]['user_has_liked'])
+        self.assertEqual(self.client.get(reverse('async-post-detail', args=[999])).status_code, 404)
+
+    async def test_async_client_and_basic_auth(self):
+        credentials = 'Basic ' + base64.b64encode(b'bob:password').decode()
+        response = await self.async_client.get(reverse('async-post-list'), headers={'Authorization': credentials})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['results'][-1]['user_has_liked'])
+
+        wrong = 'Basic ' + base64.b64encode(b'bob:nope').decode()
+        response = await self.async_client.get(reverse('async-leaderboard'), headers={'Authorization': wrong})
+        expected = await self.async_client.get(reverse('leaderboard'), headers={'Authorization': wrong})
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), expected.json())
+        response = await self.async_client.post(reverse('async-post-list'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_bad_parameters_match_the_sync_views(self):
+        for query in ('?cursor=garbage', '?fields=nope', '?sort=nope'):
+            expected = self.client.get(reverse('post-list') + query)
+            actual = self.client.get(reverse('async-post-list') + query)
+            self.assertEqual((actual.status_code, actual.json()), (expected.status_code, expected.json()))
+        self.assertEqual(actual.status_code // 100, 4)
+
+    @override_settings(DEBUG=True) # Django only logs adapted handlers in debug mode
+    def test_middleware_chain_stays_async(self):
+        # A sync-only middleware would run every async view through async_to_sync
+        with self.assertLogs('django.request', 'DEBUG') as logs:
+            ASGIHandler()
+        self.assertFalse([line for line in logs.output if 'adapted' in line])
+
+    async def test_static_files_under_asgi(self):
+        async def view(request):
+            return HttpResponse('view')
+
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root):
+            with open(os.path.join(root, 'app.js'), 'w') as f:
+                f.write('console.log(1)')
+            middleware = static.StaticFilesMiddleware(view)
+            response = await middleware(RequestFactory().get(settings.STATIC_URL + 'app.js'))
+            self.assertEqual(b''.join(response.streaming_content), b'console.log(1)')
+            response = await middleware(RequestFactory().get('/api/async/posts/'))
+            self.assertEqual(response.content, b'view')
+
+class TokenAuthTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        leaderboard.refresh()
+
+    def login(self, password='password'):
+        return self.client.post(reverse('login'), {'username': 'alice', 'password': password}, format='json')
+
+    def use(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_login_then_no_query_or_hash_per_request(self):
+        self.assertEqual(self.login('nope').status_code, 400)
+        response = self.login()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['username'], 'alice')
+        self.use(response.json()['token'])
+
+        self.assertEqual(self.client.put(reverse('vote', args=['post', self.post.id])).status_code, 201)
+        self.assertTrue(self.client.get(reverse('post-list')).json()['results'][0]['user_has_liked'])
+        with mock.patch.object(User, 'check_password') as check, self.assertNumQueries(0):
+            response = self.client.get(reverse('leaderboard')) # Snapshot cached, user cached
+        self.assertEqual(response.status_code, 200)
+        check.assert_not_called()
+
+    def test_logout_expiry_and_password_change_revoke(self):
+        token = self.login().json()['token']
+        self.use(token)
+        self.assertEqual(self.client.post(reverse('logout')).status_code, 204)
+        self.assertEqual(self.client.put(reverse('vote', args=['post', self.post.id])).status_code, 403)
+
+        self.use(self.login().json()['token'])
+        with override_settings(TOKEN_TTL_SECONDS=0): # Any age is too old
+            self.assertEqual(self.client.get(reverse('post-list')).status_code, 403)
+        self.alice.set_password('changed')
+        self.alice.save()
+        self.assertEqual(self.client.get(reverse('post-list')).status_code, 403)
+        self.use(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+        self.assertEqual(self.client.get(reverse('post-list')).status_code, 403)
+
+@override_settings(POST_ETAGS=True)
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        self.other = Post.objects.create(author=self.alice, content="Older post")
+        Post.objects.filter(pk=self.other.pk).update(created_at=timezone.now() - timedelta(days=1))
+
+    def get(self, url, user=None, etag=None):
+        self.client.force_authenticate(user)
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag) if etag else self.client.get(url)
+
+    def test_no_post_etags_without_a_shared_cache(self):
+        with override_settings(POST_ETAGS=False):
+            for url in (reverse('post-list'), reverse('post-detail', args=[self.post.id])):
+                response = self.get(url, self.bob)
+                self.assertNotIn('ETag', response)
+                self.assertEqual(self.get(url, self.bob, '*').status_code, 200)
+
+    def assertRevalidates(self, url, user, etag):
+        self.assertEqual(self.get(url, user, etag).status_code, 304)
+
+    def test_feed_and_detail_answer_304_until_something_changes(self):
+        for url in (reverse('post-list'), reverse('post-detail', args=[self.post.id])):
+            first = self.get(url, self.bob)
+            self.assertEqual(first['Cache-Control'], 'private, no-cache')
+            self.assertIn('Cookie', first['Vary'])
+            not_modified = self.get(url, self.bob, first['ETag'])
+            self.assertEqual((not_modified.status_code, not_modified.content), (304, b''))
+            self.assertEqual(not_modified['ETag'], first['ETag'])
+
+        # A 304 on the detail page needs no query beyond authentication
+        etag = self.get(reverse('post-detail', args=[self.post.id]), self.bob)['ETag']
+        with self.assertNumQueries(0):
+            self.assertRevalidates(reverse('post-detail', args=[self.post.id]), self.bob, etag)
+
+        feed = self.get(reverse('post-list'), self.bob)['ETag']
+        detail = self.get(reverse('post-detail', args=[self.post.id]), self.bob)['ETag']
+        Comment.objects.create(post=self.post, author=self.alice, content='New comment')
+        self.assertEqual(self.get(reverse('post-list'), self.bob, feed).status_code, 200)
+        self.assertEqual(self.get(reverse('post-detail', args=[self.post.id]), self.bob, detail).status_code, 200)
+
+    def test_likes_change_the_etags_of_affected_pages_only(self):
+        feed_url = reverse('post-list') + '?page_size=1'
+        second_page = self.get(feed_url, self.bob).json()['next']
+        etags = {
+            (user, url): self.get(url, user)['ETag']
+            for user in (self.alice, self.bob, None) for url in (feed_url, second_page)
+        }
+        # Viewers never share a validator: user_has_liked is theirs alone
+        self.assertEqual(len(set(etags.values())), len(etags))
+
+        self.client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True): # Updates Bob's cached likes
+            self.client.put(reverse('vote', args=['post', self.post.id]))
+        # The like changed the first page for everyone, but not the second page of anyone but Bob
+        for user in (self.alice, self.bob, None):
+            self.assertEqual(self.get(feed_url, user, etags[(user, feed_url)]).status_code, 200)
+        self.assertRevalidates(second_page, self.alice, etags[(self.alice, second_page)])
+        self.assertRevalidates(second_page, None, etags[(None, second_page)])
+        self.assertEqual(self.get(second_page, self.bob, etags[(self.bob, second_page)]).status_code, 200)
+        self.assertTrue(self.get(feed_url, self.bob).json()['results'][0]['user_has_liked'])
+
+    def test_leaderboard_validators_follow_the_snapshot(self):
+        url = reverse('leaderboard')
+        first = self.client.get(url)
+        self.assertIn('Last-Modified', first)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304)
+
+        leaderboard.refresh(now=timezone.now() + timedelta(seconds=5))
+        refreshed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertNotEqual(refreshed['ETag'], first['ETag'])
+
+    async def test_async_views_revalidate(self):
+        url = reverse('async-post-list')
+        first = await self.async_client.get(url)
+        self.assertEqual((await self.async_client.get(url, headers={'If-None-Match': first['ETag']})).status_code, 304)
+        detail = reverse('async-post-detail', args=[self.post.id])
+        etag = (await self.async_client.get(detail))['ETag']
+        self.assertEqual(etag, (await sync_to_async(self.get)(reverse('post-detail', args=[self.post.id])))['ETag'])
+        self.assertEqual((await self.async_client.get(detail, headers={'If-None-Match': etag})).status_code, 304)
+
+@override_settings(LIKED_IDS_CACHE=True)
+class LikedIdsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.posts = [Post.objects.create(author=self.alice, content=f'Post {i}') for i in range(5)]
+        self.client.force_authenticate(self.bob)
+
+    def test_compact_encodings(self):
+        sparse = likes.LikedIds([5, 1, 10 ** 6, 3, 2 ** 40])
+        dense = likes.LikedIds(range(1000, 3000, 2))
+        for liked, ids, absent in [(sparse, [1, 3, 5, 10 ** 6, 2 ** 40], [0, 2, 4, 10 ** 6 + 1]),
+                                   (dense, [1000, 1998, 2998], [999, 1001, 2999, 3000, 10 ** 9])]:
+            restored = likes.LikedIds.decode(liked.encode())
+            self.assertTrue(all(pk in restored for pk in ids))
+            self.assertFalse(any(pk in restored for pk in absent))
+            self.assertEqual(len(restored), len(liked))
+        self.assertEqual(len(dense.encode()), 1 + 8 + 250) # Bitmap: 1 bit per id in the range
+        self.assertEqual(len(likes.LikedIds([1, 10 ** 6]).encode()), 1 + 2 * 4) # Sorted uint32 array
+        self.assertNotIn(1, likes.NOTHING)
+
+    def test_feed_uses_cached_likes_and_votes_update_them(self):
+        self.client.put(reverse('vote', args=['post', self.posts[1].id]))
+        self.client.get(reverse('post-list')) # Loads bob's liked ids
+
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get(reverse('post-list')).json()['results']
+        # The page's ids (for the ETag) and its rows; no per-row subquery, no likes query
+        self.assertEqual(len(queries), 2)
+        self.assertFalse(any('api_vote' in query['sql'] for query in queries))
+        self.assertEqual([p['id'] for p in results if p['user_has_liked']], [self.posts[1].id])
+
+        # A vote edits the cached entry once it commits, rather than dropping it
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse('vote', args=['post', self.posts[3].id]))
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.get(reverse('post-list')).json()['results']
+        self.assertFalse(any('api_vote' in query['sql'] for query in queries))
+        self.assertEqual({p['id'] for p in results if p['user_has_liked']}, {self.posts[1].id, self.posts[3].id})
+
+        # A rolled back vote leaves it alone
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            votes.unlike(self.bob, Post, self.posts[1].id)
+            transaction.set_rollback(True)
+        self.assertIn(self.posts[1].id, likes.liked_ids(self.bob, Post))
+
+        # Writes that bypass the views (admin, shell) go through the signals
+        with self.captureOnCommitCallbacks(execute=True):
+            Vote.objects.filter(user=self.bob).delete()
+        results = self.client.get(reverse('post-list')).json()['results']
+        self.assertFalse(any(p['user_has_liked'] for p in results))
+
+    def test_in_place_changes(self):
+        sparse = likes.LikedIds([5, 1, 10 ** 6])
+        dense = likes.LikedIds(range(1000, 3000, 2))
+        for liked, added, removed in [(sparse, [7, 2 ** 40], [5, 8]),  # 2 ** 40 widens the array
+                                      (sparse, [2], [1, 10 ** 6]),
+                                      (dense, [1001, 2999], [1000, 5]),
+                                      (dense, [10], [2998])]:           # 10 is outside the bitmap
+            changed = likes.LikedIds.decode(liked.changed(added, removed).encode())
+            self.assertEqual(set(changed), set(liked).union(added).difference(removed))
+            self.assertEqual(len(changed), len(set(changed)))
+
+    def test_entries_expire_from_their_load(self):
+        key = f'likes:{self.bob.pk}:post'
+        with mock.patch.object(likes.cache, 'touch') as touch:
+            likes.liked_ids(self.bob, Post) # Miss: loaded and stored
+            likes.liked_ids(self.bob, Post) # Hit
+        touch.assert_not_called()
+        expires = cache.get(key)[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            votes.like(self.bob, Post, self.posts[0].id)
+        self.assertEqual(cache.get(key)[1], expires) # Patched, not renewed
+        self.assertIs(likes.liked_ids(AnonymousUser(), Post), likes.NOTHING)
+
+    def test_stale_entry_is_fixed_by_the_next_write(self):
+        key = f'likes:{self.bob.pk}:post'
+        likes.liked_ids(self.bob, Post)
+        stale = cache.get(key)
+        with self.captureOnCommitCallbacks(execute=True):
+            votes.like(self.bob, Post, self.posts[0].id)
+        # A reader that loaded before that like committed stores its rows afterwards
+        cache.set(key, stale)
+        self.assertIn(self.posts[0].id, likes.liked_ids(self.bob, Post)) # Its stamp is behind
+
+        cache.set(key, stale)
+        with self.captureOnCommitCallbacks(execute=True):
+            votes.like(self.bob, Post, self.posts[1].id)
+        self.assertIsNone(cache.get(key)) # Dropped rather than patched
+        self.assertEqual(set(likes.liked_ids(self.bob, Post)), {self.posts[0].id, self.posts[1].id})
+
+        # No lock: invalidated
+        cache.add(f'{key}:lock', 1)
+        with mock.patch.object(likes, 'LOCK_WAIT', 0), self.captureOnCommitCallbacks(execute=True):
+            votes.unlike(self.bob, Post, self.posts[0].id)
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(set(likes.liked_ids(self.bob, Post)), {self.posts[1].id})
+
+    @override_settings(LIKED_IDS_CACHE=False)
+    def test_off_without_a_shared_cache(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            votes.like(self.bob, Post, self.posts[0].id)
+        self.assertEqual(set(likes.liked_ids(self.bob, Post)), {self.posts[0].id})
+        self.assertIsNone(cache.get(f'likes:{self.bob.pk}:post'))
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        patcher = mock.patch.object(metrics, 'registry', metrics.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def stats(self, route, method='GET'):
+        return metrics.merge(metrics.collect())[f'{route} {method}']
+
+    def test_records_latency_sql_and_size_per_route(self):
+        response = self.client.get(reverse('post-list'))
+        self.client.get(reverse('post-detail', args=[self.post.id]))
+        self.client.get(reverse('post-detail', args=[999]))
+        self.client.force_authenticate(self.alice)
+        self.client.put(reverse('vote', args=['post', self.post.id]))
+
+        feed = self.stats('post-list')
+        self.assertEqual(feed[metrics.COUNT], 1)
+        self.assertEqual(feed[metrics.QUERIES], 2) # Page ids and rows; anonymous viewers have no likes to load
+        self.assertEqual(feed[metrics.BYTES], len(response.content))
+        self.assertEqual(sum(feed[metrics.BUCKETS]), 1)
+        self.assertEqual(self.stats('post-detail')[metrics.STATUS], {'2xx': 1, '4xx': 1})
+        self.assertEqual(self.stats('vote', 'PUT')[metrics.STATUS], {'2xx': 1})
+
+        self.client.request(REQUEST_METHOD='BREW', PATH_INFO=reverse('post-list'))
+        self.assertEqual(self.stats('post-list', 'OTHER')[metrics.COUNT], 1)
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            text = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer s3cret'}).content.decode()
+        self.assertIn('playto_http_requests_total{route="post-detail",method="GET",status="4xx"} 1', text)
+        self.assertIn('playto_http_request_duration_seconds_bucket{route="post-list",method="GET",le="+Inf"} 1', text)
+        self.assertIn('playto_db_queries_total{route="post-list",method="GET"} 2', text)
+
+    async def test_async_views_count_their_queries(self):
+        await self.async_client.get(reverse('async-post-detail', args=[self.post.id]))
+        detail = await sync_to_async(self.stats)('async-post-detail')
+        self.assertEqual(detail[metrics.COUNT], 1)
+        self.assertGreater(detail[metrics.QUERIES], 0)
+
+    def test_totals_are_summed_across_worker_processes(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.client.get(reverse('post-list'))
+            other = metrics.Registry()
+            other.observe('post-list', 'GET', 200, 0.02, 3, 0.001, 100)
+            with mock.patch('os.getpid', return_value=os.getppid()):
+                other.flush(force=True) # Another (live) worker's file
+            feed = self.stats('post-list')
+        self.assertEqual(feed[metrics.COUNT], 2)
+        self.assertEqual(feed[metrics.STATUS], {'2xx': 2})
+
+    def test_exited_workers_are_retired(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            self.client.get(reverse('post-list'))
+            for pid in (os.getppid(), os.getppid()): # A dead worker, then a new one given its pid
+                worker = metrics.Registry()
+                worker.observe('post-list', 'GET', 200, 0.02, 3, 0.001, 100)
+                with mock.patch('os.getpid', return_value=pid):
+                    worker.flush(force=True)
+            self.assertEqual(self.stats('post-list')[metrics.COUNT], 3) # Neither file overwrote the other
+
+            with mock.patch.object(metrics, '_alive', lambda pid: pid == os.getpid()):
+                self.assertEqual(self.stats('post-list')[metrics.COUNT], 3)
+                self.assertEqual(self.stats('post-list')[metrics.COUNT], 3) # Retired once
+            self.assertEqual(sorted(os.listdir(directory)), sorted(['lock', metrics.RETIRED, self.registry.filename]))
+
+    def test_token_and_disabling(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403) # No token: closed...
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200) # ...but in development
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+            self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer nope'}).status_code, 403)
+            response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer s3cret'})
+            self.assertEqual(response.status_code, 200)
+        with override_settings(METRICS_ENABLED=False):
+            with self.assertRaises(MiddlewareNotUsed):
+                metrics.MetricsMiddleware(lambda request: None)
+
+@override_settings(REPLICA_DATABASES=['replica1'])
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        Comment.objects.create(post=self.post, author=self.alice, content='Hi')
+        leaderboard.refresh()
+        cache.clear() # Read the snapshots' rows, not the cache
+        # The test database stands in for every alias: record where each read would have gone
+        self.reads = []
+        route = routing.ReplicaRouter.db_for_read
+        def record(router, model, **hints):
+            self.reads.append((model, route(router, model, **hints) or 'default'))
+        patcher = mock.patch.object(routing.ReplicaRouter, 'db_for_read', record)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_from(self, url, user=None):
+        self.client.force_authenticate(user)
+        self.reads.clear()
+        self.assertEqual(self.client.get(url).status_code, 200)
+        return {db for _, db in self.reads}
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        feed = reverse('post-list')
+        self.assertEqual(self.read_from(feed), {'replica1'})
+        self.assertEqual(self.read_from(reverse('leaderboard') + '?window=1h', self.bob), {'replica1'})
+
+        self.client.put(reverse('vote', args=['post', self.post.id]))
+        self.assertEqual(self.read_from(feed, self.bob), {'default'})
+        self.assertEqual(self.read_from(feed, self.alice), {'replica1'}) # Only the writer is pinned
+
+        cache.delete(f'replica:pin:{self.bob.id}') # REPLICA_STICKY_SECONDS later
+        self.assertEqual(self.read_from(feed, self.bob), {'replica1'})
+
+    def test_shared_cache_entries_are_built_from_the_primary(self):
+        self.read_from(reverse('post-detail', args=[self.post.id]))
+        self.assertEqual({db for model, db in self.reads if model is Comment}, {'default'}) # The cached tree
+        self.assertEqual({db for model, db in self.reads if model is Post}, {'replica1'})
+
+    @override_settings(POST_ETAGS=True)
+    def test_no_etags_for_replica_reads(self):
+        detail = reverse('post-detail', args=[self.post.id])
+        self.assertNotIn('ETag', self.client.get(detail)) # Replica: the body may lag the stamps
+        self.client.force_authenticate(self.bob)
+        self.client.put(reverse('vote', args=['post', self.post.id]))
+        self.assertIn('ETag', self.client.get(detail)) # Pinned to the primary
+
+    async def test_async_views_and_the_disabled_middleware(self):
+        await self.async_client.get(reverse('async-post-list'))
+        # Authentication (and its content type lookups) runs before the database is picked
+        self.assertEqual({db for model, db in self.reads if model is Post}, {'replica1'})
+        with override_settings(REPLICA_DATABASES=[]):
+            with self.assertRaises(MiddlewareNotUsed):
+                routing.ReplicaPinMiddleware(lambda request: None)
+
+class VoteArchiveTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.carol = User.objects.create_user(username='carol', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, content='Hi')
+        for user in (self.bob, self.carol):
+            self.client.force_authenticate(user)
+            self.client.put(reverse('vote', args=['post', self.post.id]))
+        self.client.put(reverse('vote', args=['comment', self.comment.id]))
+        Vote.objects.update(created_at=timezone.now() - timedelta(days=settings.VOTE_ARCHIVE_AFTER_DAYS + 1))
+        karma.rebuild_ledger()
+        self.client.force_authenticate(self.bob)
+
+    def counts(self):
+        self.post.refresh_from_db()
+        self.comment.refresh_from_db()
+        return self.post.likes_count, self.comment.likes_count
+
+    def test_unliking_an_archived_like_leaves_the_pruned_ledger_alone(self):
+        archive.compact()
+        karma.prune_ledger()
+        self.client.delete(reverse('vote', args=['post', self.post.id]))
+        self.assertFalse(KarmaBucket.objects.exists()) # Not a negative bucket before the cutoff
+        self.assertEqual(self.counts(), (1, 1))
+
+    def test_compaction_moves_rows_in_batches_and_keeps_counts(self):
+        moved, _ = archive.compact(batch_size=2)
+        self.assertEqual(moved, 3)
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(ArchivedVote.objects.count(), 3)
+        self.assertEqual(self.counts(), (2, 1))
+        self.assertEqual(ArchivedVoteTotal.objects.get(object_id=self.post.id, content_type__model='post').count, 2)
+        self.assertEqual(counters.reconcile(), [])
+        call_command('compact_votes', stdout=StringIO()) # Nothing left to move
+
+        with self.assertRaises(CommandError):
+            call_command('compact_votes', '--days', '1', stdout=StringIO()) # Inside the ledger's retention
+
+    def test_archived_likes_stay_unique_and_can_be_removed(self):
+        archive.compact()
+        url = reverse('vote', args=['post', self.post.id])
+        self.assertTrue(self.client.get(reverse('post-detail', args=[self.post.id])).json()['user_has_liked'])
+
+        again = self.client.put(url)
+        self.assertEqual((again.status_code, again.json()['likes_count']), (200, 2))
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(self.client.post(reverse('vote-bulk'), {'operations': [
+            {'model': 'post', 'id': self.post.id, 'action': 'like'},
+        ]}, format='json').json()['results'][0]['status'], 'unchanged')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(url).json(), {'likes_count': 1, 'user_has_liked': False})
+        self.assertFalse(self.client.get(reverse('post-detail', args=[self.post.id])).json()['user_has_liked'])
+        self.assertEqual(self.client.put(url).status_code, 201) # A fresh like goes to Vote
+        self.assertEqual(self.counts(), (2, 1))
+        self.assertEqual(counters.reconcile(), [])
+
+        self.client.force_authenticate(self.carol)
+        results = self.client.post(reverse('vote-bulk'), {'operations': [
+            {'model': 'post', 'id': self.post.id, 'action': 'unlike'},
+            {'model': 'comment', 'id': self.comment.id, 'action': 'unlike'},
+        ]}, format='json').json()['results']
+        self.assertEqual([r['status'] for r in results], ['unliked', 'unliked'])
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(counters.reconcile(), [])
+
+    def test_deleting_a_user_removes_their_archived_likes(self):
+        archive.compact()
+        self.carol.delete()
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(counters.reconcile(), [])
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.admin = User.objects.create_user(username='admin', password='password', is_staff=True)
+        self.posts = [Post.objects.create(author=self.alice, content=f"Post {i}") for i in range(5)]
+        self.client.force_authenticate(self.alice)
+        for post in self.posts[:3]:
+            self.client.put(reverse('vote', args=['post', post.id]))
+        self.client.force_authenticate(self.admin)
+
+    def export(self, kind, query=''):
+        response = self.client.get(reverse('export', args=[kind]) + query)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def lines(self, kind, query=''):
+        return [json.loads(line) for line in self.export(kind, query).splitlines()]
+
+    def test_streams_every_row_in_batches(self):
+        with CaptureQueriesContext(connection) as queries:
+            rows = self.lines('posts')
+        self.assertEqual([row['id'] for row in rows], [post.id for post in self.posts])
+        self.assertEqual(rows[0]['author_id'], self.alice.id)
+        self.assertEqual(rows[0]['likes_count'], 1)
+        self.assertEqual(len(queries), 1 + 3) # Max id, then 2 + 2 + 1 rows
+
+    def test_incremental_and_archived_votes(self):
+        self.assertEqual([row['id'] for row in self.lines('posts', f'?since_id={self.posts[2].id}')], [p.id for p in self.posts[3:]])
+        Post.objects.filter(pk=self.posts[0].pk).update(created_at=timezone.now() - timedelta(days=2))
+        since = (timezone.now() - timedelta(days=1)).isoformat()
+        self.assertEqual(len(self.lines('posts', '?' + urlencode({'since': since}))), 4)
+        self.assertEqual(self.client.get(reverse('export', args=['posts']) + '?since=yesterday').status_code, 400)
+
+        Vote.objects.filter(object_id=self.posts[0].id).update(created_at=timezone.now() - timedelta(days=settings.VOTE_ARCHIVE_AFTER_DAYS + 1))
+        archive.compact()
+        votes = self.lines('votes')
+        self.assertEqual([(row['object_id'], row['archived']) for row in votes], [(p.id, i == 0) for i, p in enumerate(self.posts[:3])])
+        self.assertEqual({row['model'] for row in votes}, {'post'})
+
+    def test_gzip_command_and_permissions(self):
+        plain = self.export('posts')
+        self.assertEqual(gzip.decompress(self.export('posts', '?gzip=1')), plain)
+        with tempfile.NamedTemporaryFile(suffix='.ndjson.gz') as f:
+            call_command('export_data', 'posts', '--gzip', '--output', f.name, stderr=StringIO())
+            self.assertEqual(gzip.decompress(f.read()), plain)
+
+        self.assertEqual(self.client.get(reverse('export', args=['users'])).status_code, 404)
+        self.client.force_authenticate(self.alice)
+        self.assertEqual(self.client.get(reverse('export', args=['posts'])).status_code, 403)
+
+@override_settings(SEARCH_PAGE_SIZE=2)
+class SearchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.tomato = Post.objects.create(author=self.alice, content="Growing tomatoes on a balcony")
+        self.other = Post.objects.create(author=self.alice, content="Balcony gardening: tomato, tomato, basil")
+        self.comment = Comment.objects.create(post=self.other, author=self.alice, content="Which tomato variety?")
+        Post.objects.create(author=self.alice, content="Nothing to see here")
+
+    def search(self, query):
+        response = self.client.get(reverse('search') + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, query):
+        return [(row['type'], row['id']) for row in self.search(query)['results']]
+
+    def test_ranked_stemmed_and_paginated(self):
+        data = self.search('?q=Tomato')
+        self.assertEqual(data['results'][0]['author']['username'], 'alice')
+        self.assertEqual(len(data['results']), 2)
+        self.assertTrue(data['has_more'])
+        rest = self.client.get(data['next']).json()
+        found = data['results'] + rest['results']
+        self.assertEqual({(row['type'], row['id']) for row in found}, {
+            ('post', self.tomato.id), ('post', self.other.id), ('comment', self.comment.id)
+        })
+        self.assertEqual([row['score'] for row in found], sorted((row['score'] for row in found), reverse=True))
+        self.assertFalse(rest['has_more'])
+
+        self.assertEqual(self.ids('?q=balcony+basil'), [('post', self.other.id)]) # Every word must match
+        self.assertEqual(self.ids('?q=tomato&type=comment'), [('comment', self.comment.id)])
+        self.assertEqual(self.ids('?q="tomato" -(*'), self.ids('?q=tomato')) # Operators are just text
+        self.assertEqual(self.client.get(reverse('search') + '?q=%3F%21').status_code, 400)
+
+    def test_scores_are_relative_to_each_table(self):
+        # bm25 over 3 posts and over 1 comment aren't on one scale: each table's best match is 1.0
+        hits, _ = search.search('tomato')
+        best = {kind: max(score for hit_kind, _, score in hits if hit_kind == kind) for kind in search.MODELS}
+        self.assertEqual(best, {'post': 1.0, 'comment': 1.0})
+        self.assertTrue(all(0 < score <= 1 for _, _, score in hits))
+
+    def test_index_follows_writes(self):
+        self.tomato.content = 'Growing peppers'
+        self.tomato.save()
+        self.comment.delete()
+        self.assertEqual(self.ids('?q=tomato'), [('post', self.other.id)])
+        self.assertEqual(self.ids('?q=pepper'), [('post', self.tomato.id)])
+
+    def test_sqlite_index_survives_table_rebuilds(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Triggers are the SQLite backend')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER api_post_fts_insert') # What a table rebuild does
+        Post.objects.create(author=self.alice, content='Tomato soup')
+        search.install(connection)
+        self.assertEqual(len(self.ids('?q=tomato+soup')), 1)
+
+class SparseFieldsTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.post = Post.objects.create(author=self.alice, content="A post")
+        self.comment = Comment.objects.create(post=self.post, author=self.alice, content="A comment")
+        self.client.force_authenticate(self.alice)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), ' '.join(q['sql'] for q in queries.captured_queries)
+
+    def test_feed_reads_only_what_was_asked_for(self):
+        data, sql = self.get(reverse('post-list') + '?fields=id,content')
+        self.assertEqual(data['results'], [{'id': self.post.id, 'content': 'A post'}])
+        self.assertNotIn('auth_user', sql.split('FROM "api_post"', 1)[1]) # No author join...
+        self.assertNotIn('api_vote', sql) # ...and no liked ids lookup
+
+        data, sql = self.get(reverse('post-list') + '?fields=content&include=author,user_has_liked')
+        self.assertEqual(data['results'], [{
+            'id': self.post.id, 'author': {'id': self.alice.id, 'username': 'alice'},
+            'content': 'A post', 'user_has_liked': False,
+        }])
+
+        full = self.client.get(reverse('post-list')).json()['results'][0]
+        self.assertEqual(set(full), {
+            'id', 'author', 'content', 'created_at', 'likes_count', 'comment_count', 'user_has_liked'
+        })
+
+    def test_detail_skips_the_comment_tree(self):
+        data, sql = self.get(reverse('post-detail', args=[self.post.id]) + '?fields=likes_count')
+        self.assertEqual(data, {'id': self.post.id, 'likes_count': 0})
+        self.assertNotIn('api_comment', sql)
+
+        data, _ = self.get(reverse('post-detail', args=[self.post.id]) + '?include=comments')
+        self.assertEqual(set(data), {'id', 'comments', 'comments_next', 'has_more_comments'})
+        self.assertEqual(data['comments'][0]['id'], self.comment.id)
+
+        data, _ = self.get(reverse('comment-detail', args=[self.comment.id]) + '?fields=post,more_replies')
+        self.assertEqual(data, {'id': self.comment.id, 'post': self.post.id, 'more_replies': 0})
+
+    def test_unknown_names_and_writes(self):
+        response = self.client.get(reverse('post-list') + '?fields=id,password&include=content')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'fields', 'include'})
+        # Writes ignore the selection
+        response = self.client.post(reverse('post-list') + '?fields=id', {'content': 'New'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['content'], 'New')
+
+@override_settings(COMMENT_PAGE_SIZE=2, COMMENT_REPLIES_PAGE_SIZE=2)
+class PostBatchTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.client.force_authenticate(self.alice)
+        self.posts = []
+        for i in range(6):
+            post = Post.objects.create(author=self.alice, content=f"Post {i}")
+            for j in range(i % 4):
+                root = Comment.objects.create(post=post, author=self.alice, content=f"Root {j}")
+                reply = Comment.objects.create(post=post, parent=root, author=self.alice, content="Reply")
+                Comment.objects.create(post=post, parent=reply, author=self.alice, content="Deeper")
+            self.posts.append(post)
+        Vote.objects.create(user=self.alice, content_object=self.posts[3])
+
+    def batch(self, ids):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post-batch') + '?ids=' + ','.join(map(str, ids)))
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_same_as_retrieve_in_constant_queries(self):
+        ids = [post.id for post in reversed(self.posts)] + [999]
+        data, _ = self.batch(ids)
+        self.assertEqual(data['missing'], [999])
+        for row, post in zip(data['results'], reversed(self.posts)):
+            self.assertEqual(row, self.client.get(reverse('post-detail', args=[post.id])).json())
+
+        likes.liked_ids(self.alice, Post), likes.liked_ids(self.alice, Comment) # Warm, as for any viewer
+        _, one = self.batch(ids[:1])
+        _, six = self.batch(ids)
+        self.assertEqual(one, six)
+
+    def test_invalid_ids(self):
+        for ids in ('', 'a,1', ','.join(['1'] * 2 + [str(n) for n in range(2, settings.POST_BATCH_MAX_IDS + 2)])):
+            response = self.client.get(reverse('post-batch') + '?ids=' + ids)
+            self.assertEqual(response.status_code, 400)
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.dir = directory.name
+        self.staff = User.objects.create_user(username='staff', password='password', is_staff=True)
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+
+    def detail(self, user, **headers):
+        client = APIClient() # New client: middleware is loaded with the settings of its first request
+        client.force_authenticate(user)
+        return client.get(reverse('post-detail', args=[self.post.id]), **headers)
+
+    def test_staff_header_writes_profile_and_sql(self):
+        with override_settings(PROFILE_DIR=self.dir):
+            response = self.detail(self.staff, HTTP_X_PROFILE='1')
+            with mock.patch.object(profiling.Profile, 'start') as start:
+                self.detail(self.alice, HTTP_X_PROFILE='1') # Not staff: not even profiled
+                self.detail(AnonymousUser(), HTTP_X_PROFILE='1')
+            start.assert_not_called()
+            self.detail(self.staff)
+        self.assertEqual(profiling.dumps(self.dir), [response['X-Profile-Id']])
+        dump = profiling.load(response['X-Profile-Id'], self.dir)
+        self.assertEqual((dump['route'], dump['status'], dump['user']), ('post-detail', 200, 'staff'))
+        self.assertTrue(any('api_comment' in query['sql'] for query in dump['queries']))
+
+        out = StringIO()
+        call_command('profile_dumps', dump['id'], dir=self.dir, limit=100, stdout=out)
+        self.assertIn('render_detail', out.getvalue())
+        self.assertIn('Slowest queries:', out.getvalue())
+
+    def test_staff_with_token_or_basic_auth(self):
+        token = APIClient().post(reverse('login'), {'username': 'staff', 'password': 'password'}, format='json').json()['token']
+        basic = 'Basic ' + base64.b64encode(b'staff:password').decode()
+        with override_settings(PROFILE_DIR=self.dir):
+            for credentials in (f'Bearer {token}', basic):
+                response = APIClient().get(reverse('post-list'), HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=credentials)
+                self.assertIn('X-Profile-Id', response)
+        self.assertEqual(len(profiling.dumps(self.dir)), 2)
+
+    async def test_async_views(self):
+        url = reverse('async-post-list')
+        with override_settings(PROFILE_DIR=self.dir):
+            for credentials, profiled in (('staff:password', True), ('alice:password', False)):
+                auth = 'Basic ' + base64.b64encode(credentials.encode()).decode()
+                response = await self.async_client.get(url, headers={'X-Profile': '1', 'Authorization': auth})
+                self.assertEqual('X-Profile-Id' in response, profiled)
+        self.assertEqual(len(profiling.dumps(self.dir)), 1)
+
+    def test_sampling_keeps_the_newest_dumps(self):
+        with override_settings(PROFILE_DIR=self.dir, PROFILE_SAMPLE_RATE=1, PROFILE_MAX_DUMPS=2):
+            for _ in range(4):
+                self.detail(AnonymousUser())
+        ids = profiling.dumps(self.dir)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(len(os.listdir(self.dir)), 4)
+        out = StringIO()
+        call_command('profile_dumps', dir=self.dir, stdout=out)
+        self.assertIn(ids[0], out.getvalue())
+
+    def test_off_without_profile_dir(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            profiling.ProfilingMiddleware(lambda request: None)
+
+class BulkVoteTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.posts = [Post.objects.create(author=self.alice, content=f'Post {i}') for i in range(3)]
+        self.comment = Comment.objects.create(post=self.posts[0], author=self.alice, content='Hi')
+        self.client.force_authenticate(self.bob)
+
+    def bulk(self, operations):
+        return self.client.post(reverse('vote-bulk'), {'operations': operations}, format='json')
+
+    def test_bulk_like_and_unlike(self):
+        self.client.post(reverse('vote', args=['post', self.posts[2].id])) # Already liked
+        response = self.bulk(
+            [{'model': 'post', 'id': post.id, 'action': 'like'} for post in self.posts]
+            + [
+                {'model': 'comment', 'id': self.comment.id, 'action': 'like'},
+                {'model': 'post', 'id': self.posts[2].id, 'action': 'unlike'},
+                {'model': 'post', 'id': 999, 'action': 'like'},
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(
+            [(r['status'], r['likes_count']) for r in results],
+            [('liked', 1), ('liked', 1), ('unchanged', 0), ('liked', 1), ('unliked', 0), ('not_found', None)]
+        )
+        self.assertEqual(Vote.objects.filter(user=self.bob).count(), 3)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+        # Ledger: 2 post likes and 1 comment like for alice
+        self.assertEqual(dict(karma.ledger_scores())[self.alice.id], 11)
+        self.assertEqual(counters.reconcile(), [])
+
+    def test_like_then_unlike_in_one_batch_is_a_noop(self):
+        post = self.posts[0]
+        response = self.bulk([
+            {'model': 'post', 'id': post.id, 'action': 'like'},
+            {'model': 'post', 'id': post.id, 'action': 'unlike'},
+        ])
+        self.assertEqual([r['status'] for r in response.json()['results']], ['liked', 'unliked'])
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(Post.objects.get(pk=post.pk).likes_count, 0)
+
+    def test_concurrent_votes_are_counted_once(self):
+        post, other = self.posts[0], self.posts[1]
+        insert = votes._insert_votes
+
+        def like_first(*args):
+            votes.like(self.bob, Post, post.id) # Another request wins the race for `post`
+            return insert(*args)
+        with mock.patch.object(votes, '_insert_votes', like_first):
+            self.bulk([{'model': 'post', 'id': p.id, 'action': 'like'} for p in (post, other)])
+        self.assertEqual([Post.objects.get(pk=p.pk).likes_count for p in (post, other)], [1, 1])
+
+        select_for_update = QuerySet.select_for_update
+
+        def unlike_first(queryset, *args, **kwargs):
+            patcher.stop() # Once, before bulk_vote locks its rows
+            votes.unlike(self.bob, Post, post.id)
+            return select_for_update(queryset, *args, **kwargs)
+        patcher = mock.patch.object(QuerySet, 'select_for_update', unlike_first)
+        patcher.start()
+        self.bulk([{'model': 'post', 'id': p.id, 'action': 'unlike'} for p in (post, other)])
+        self.assertEqual([Post.objects.get(pk=p.pk).likes_count for p in (post, other)], [0, 0])
+        self.assertEqual(counters.reconcile(), [])
+        self.assertEqual(karma.ledger_scores()[self.alice.id], 0)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        posts = [Post.objects.create(author=self.alice, content=f'More {i}') for i in range(20)]
+        self.bulk([{'model': 'post', 'id': self.posts[0].id, 'action': 'like'}])
+        with CaptureQueriesContext(connection) as small:
+            self.bulk([{'model': 'post', 'id': self.posts[1].id, 'action': 'like'}])
+        operations = [{'model': 'post', 'id': post.id, 'action': 'like'} for post in posts]
+        with CaptureQueriesContext(connection) as large:
+            self.bulk(operations)
+        # Only the per-post counter UPDATEs scale with the batch
+        self.assertLessEqual(len(large), len(small) + len(posts))
+        self.assertEqual(Vote.objects.filter(user=self.bob).count(), 22)
+
+    def test_rejects_invalid_operations(self):
+        self.assertEqual(self.bulk([{'model': 'user', 'id': 1, 'action': 'like'}]).status_code, 400)
+        self.assertEqual(self.bulk([]).status_code, 400)
+        with override_settings(VOTE_BULK_MAX_OPERATIONS=1):
+            response = self.bulk([{'model': 'post', 'id': post.id, 'action': 'like'} for post in self.posts])
+        self.assertEqual(response.status_code, 400)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.bulk([{'model': 'post', 'id': 1, 'action': 'like'}]).status_code, 403)
+
+class FeedPaginationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        same_time = timezone.now()
+        self.posts = [Post.objects.create(author=self.alice, content=f"Post {i}") for i in range(5)]
+        # Ties on created_at must still page correctly thanks to the id tiebreaker
+        Post.objects.filter(pk__in=[p.pk for p in self.posts[1:4]]).update(created_at=same_time)
+
+    def test_walks_every_post_once_in_order(self):
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        seen = []
+        url = reverse('post-list') + '?page_size=2'
+        while url:
+            data = self.client.get(url).json()
+            seen += [p['id'] for p in data['results']]
+            self.assertEqual(data['has_more'], data['next'] is not None)
+            url = data['next']
+        self.assertEqual(seen, expected)
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(KeysetPagination, 'max_page_size', 3):
+            data = self.client.get(reverse('post-list') + '?page_size=100000').json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertTrue(data['has_more'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('post-list') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class HotFeedTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.old = Post.objects.create(author=self.alice, content='Old but liked')
+        self.new = Post.objects.create(author=self.alice, content='New')
+        Post.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - timedelta(seconds=settings.HOT_DECAY_SECONDS))
+        hot.refresh()
+        self.voters = [User.objects.create_user(username=f'u{i}', password='password') for i in range(12)]
+
+    def hot_ids(self, url=None):
+        return [p['id'] for p in self.client.get(url or reverse('post-list') + '?sort=hot').json()['results']]
+
+    def like(self, post, voters):
+        for voter in voters:
+            self.client.force_authenticate(voter)
+            self.client.put(reverse('vote', args=['post', post.id]))
+
+    def test_scores_follow_votes_and_comments_with_decay(self):
+        self.assertEqual(self.hot_ids(), [self.new.id, self.old.id])
+        # A post one decay period older needs 10x the engagement to catch up
+        self.like(self.old, self.voters[:9])
+        self.assertEqual(self.hot_ids(), [self.new.id, self.old.id])
+        self.like(self.old, self.voters[9:11])
+        self.assertEqual(self.hot_ids(), [self.old.id, self.new.id])
+
+        # Comments count too (HOT_COMMENT_WEIGHT each)
+        for _ in range(6):
+            Comment.objects.create(post=self.new, author=self.alice, content='Hi')
+        self.assertEqual(self.hot_ids(), [self.new.id, self.old.id])
+        self.assertEqual(hot.refresh(), 0) # Incremental updates left nothing to fix
+
+    def test_sharded_posts_are_rescored_by_the_batch_job(self):
+        counters.set_sharding(self.old.pk, 4)
+        self.like(self.old, self.voters)
+        self.assertEqual(self.hot_ids(), [self.new.id, self.old.id])
+        call_command('refresh_hot_scores', stdout=StringIO())
+        self.assertEqual(self.hot_ids(), [self.old.id, self.new.id])
+
+    def test_pages_through_the_hot_order(self):
+        for i in range(5):
+            Post.objects.create(author=self.alice, content=f'Post {i}')
+        self.like(self.old, self.voters)
+        expected = list(Post.objects.order_by('-hot_score', '-id').values_list('id', flat=True))
+        seen = []
+        url = reverse('post-list') + '?sort=hot&page_size=2'
+        while url:
+            data = self.client.get(url).json()
+            seen += [p['id'] for p in data['results']]
+            url = data['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.client.get(reverse('post-list') + '?sort=top').status_code, 400)
+        self.assertEqual(self.client.get(reverse('async-post-list') + '?sort=hot').json()['results'][0]['id'], self.old.id)
+
+    def test_top_posts_come_from_the_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Plan text is backend specific')
+        plan = Post.objects.order_by('-hot_score', '-id')[:20].explain()
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan) # No sort step
+
+
+@override_settings(COMMENT_PAGE_SIZE=2, COMMENT_REPLIES_PAGE_SIZE=2, COMMENT_TREE_DEPTH=2)
+class CommentThreadPagingTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        self.roots = [self.comment(f"Root {i}") for i in range(3)]
+        self.replies = [self.comment(f"Reply {i}", parent=self.roots[0]) for i in range(4)]
+        self.comment("Deep reply", parent=self.replies[0])
+
+    def comment(self, content, parent=None):
+        return Comment.objects.create(author=self.alice, post=self.post, parent=parent, content=content)
+
+    def test_retrieve_returns_first_page_only(self):
+        data = self.client.get(reverse('post-detail', args=[self.post.id])).json()
+
+        self.assertEqual([c['content'] for c in data['comments']], ['Root 0', 'Root 1'])
+        self.assertTrue(data['has_more_comments'])
+        first = data['comments'][0]
+        self.assertEqual([c['content'] for c in first['replies']], ['Reply 0', 'Reply 1'])
+        self.assertEqual(first['more_replies'], 2)
+        # Depth 2: the deep reply is not loaded, only announced
+        self.assertEqual(first['replies'][0]['replies'], [])
+        self.assertEqual(first['replies'][0]['more_replies'], 1)
+
+        rest = self.client.get(data['comments_next']).json()
+        self.assertEqual([c['content'] for c in rest['results']], ['Root 2'])
+        self.assertFalse(rest['has_more'])
+
+    def test_replies_endpoint_pages_by_cursor(self):
+        url = reverse('comment-replies', args=[self.roots[0].id])
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen += [c['content'] for c in data['results']]
+            url = data['next']
+        self.assertEqual(seen, [f"Reply {i}" for i in range(4)])
+
+    def test_query_count_does_not_grow_with_thread_size(self):
+        url = reverse('post-detail', args=[self.post.id])
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(url)
+        for i in range(30):
+            self.comment(f"Extra reply {i}", parent=self.roots[1])
+        with CaptureQueriesContext(connection) as after:
+            data = self.client.get(url).json()
+        self.assertEqual(len(before), len(after))
+        self.assertEqual(data['comments'][1]['more_replies'], 28)
+
+
+class CommentPathTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        # root -> a -> b -> c, plus a sibling root that must stay out of every subtree
+        self.root = self.comment("root")
+        self.a = self.comment("a", self.root)
+        self.b = self.comment("b", self.a)
+        self.c = self.comment("c", self.b)
+        self.other = self.comment("other")
+
+    def comment(self, content, parent=None):
+        return Comment.objects.create(author=self.alice, post=self.post, parent=parent, content=content)
+
+    def test_path_and_depth_are_set_on_insert(self):
+        self.c.refresh_from_db()
+        self.assertEqual(self.c.depth, 3)
+        self.assertEqual(path_ids(self.c.path), [self.root.id, self.a.id, self.b.id, self.c.id])
+
+    def test_subtree_and_ancestors_queries(self):
+        self.assertEqual(list(self.root.subtree()), [self.a, self.b, self.c])
+        self.assertEqual(list(self.root.subtree(max_depth=1)), [self.a])
+        self.assertEqual(list(self.c.ancestors()), [self.root, self.a, self.b])
+        self.assertEqual(
+            set(Comment.objects.filter(post=self.post, depth__lte=1)), {self.root, self.a, self.other}
+        )
+
+    def test_path_is_written_with_the_insert(self):
+        update = QuerySet.update
+
+        def failing_path_update(queryset, **kwargs):
+            if 'path' in kwargs:
+                raise DatabaseError('connection lost')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', failing_path_update), self.assertRaises(DatabaseError):
+            self.comment("lost", self.c)
+        self.assertFalse(Comment.objects.filter(path='').exists())
+        with self.assertRaises(ValueError):
+            Comment.subtree_of('', 0)
+
+    def test_thread_endpoint(self):
+        with self.assertNumQueries(3): # comment, subtree, ancestors
+            data = self.client.get(reverse('comment-thread', args=[self.a.id])).json()
+        self.assertEqual([c['content'] for c in data['ancestors']], ['root'])
+        self.assertEqual(data['comment']['replies'][0]['content'], 'b')
+        self.assertEqual(data['comment']['replies'][0]['replies'][0]['content'], 'c')
+        self.assertFalse(data['truncated'])
+
+        data = self.client.get(reverse('comment-thread', args=[self.root.id]) + '?depth=1').json()
+        a = data['comment']['replies'][0]
+        self.assertEqual((a['replies'], a['more_replies']), ([], 1))
+
+
+class CommentTreeTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        root = Comment.objects.create(author=self.alice, post=self.post, content="Root")
+        reply = Comment.objects.create(author=self.bob, post=self.post, parent=root, content="Reply ✓")
+        Comment.objects.create(author=self.alice, post=self.post, parent=reply, content="Nested")
+        Comment.objects.create(author=self.bob, post=self.post, content="Second root")
+        Vote.objects.create(user=self.bob, content_type=ContentType.objects.get_for_model(Comment), object_id=reply.id)
+
+    def test_fast_path_matches_drf_serializer_byte_for_byte(self):
+        nodes, _ = threads.load_threads(self.bob, {'post': self.post, 'parent': None})
+
+        # The same tree through the recursive CommentSerializer
+        instances = {c.id: c for c in Comment.objects.select_related('author').filter(post=self.post)}
+        def attach(node):
+            comment = instances[node.id]
+            comment.prefetched_replies = [attach(child) for child in node.replies]
+            return comment
+        context = {'liked_comment_ids': likes.liked_ids(self.bob, Comment)}
+        drf = CommentSerializer([attach(n) for n in nodes], many=True, context=context).data
+
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(tree.render(nodes)), renderer.render(drf))
+        self.assertIn(b'"user_has_liked":true', renderer.render(tree.render(nodes)))
+
+    def test_deep_chain_does_not_recurse(self):
+        # Far deeper than the recursion limit: a recursive renderer would blow up here
+        row = {
+            'author_id': self.alice.id, 'author__username': 'alice', 'content': 'x', 'created_at': timezone.now(),
+            'likes_count': 0, 'user_has_liked': False, 'post_id': self.post.id, 'reply_count': 1,
+        }
+        root = parent = tree.Node({**row, 'id': 1, 'parent_id': None, 'depth': 0})
+        for pk in range(2, 5000):
+            node = tree.Node({**row, 'id': pk, 'parent_id': parent.id, 'depth': pk - 1})
+            parent.replies.append(node)
+            parent = node
+
+        rendered = tree.render([root])
+        for _ in range(4998):
+            rendered = rendered[0]['replies']
+        self.assertEqual(rendered[0]['id'], 4999)
+
+
+@override_settings(COMMENT_TREE_CACHE_TTL=300) # Not the LocMemCache default: no expiry mid-test
+class CommentTreeCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.alice = User.objects.create_user(username='alice', password='password')
+        self.bob = User.objects.create_user(username='bob', password='password')
+        self.post = Post.objects.create(author=self.alice, content="Alice's post")
+        self.comment = Comment.objects.create(author=self.alice, post=self.post, content="First")
+        self.url = reverse('post-detail', args=[self.post.id])
+
+    def get(self, user=None):
+        self.client.force_authenticate(user)
+        return self.client.get(self.url).json()
+
+    def test_second_read_is_served_from_cache(self):
+        with CaptureQueriesContext(connection) as miss:
+            first = self.get()
+        with CaptureQueriesContext(connection) as hit:
+            second = self.get()
+        self.assertEqual(first, second)
+        self.assertLess(len(hit), len(miss))
+
+    def test_likes_are_overlaid_per_viewer(self):
+        self.client.force_authenticate(self.bob)
+        self.client.post(reverse('vote', args=['comment', self.comment.id]))
+
+        self.assertTrue(self.get(self.bob)['comments'][0]['user_has_liked'])
+        alice_view = self.get(self.alice)['comments'][0]
+        self.assertFalse(alice_view['user_has_liked'])
+        self.assertEqual(alice_view['likes_count'], 1)
+        self.assertFalse(self.get()['comments'][0]['user_has_liked'])
+
+    def test_comments_and_votes_invalidate(self):
+        self.get()
+        Comment.objects.create(author=self.bob, post=self.post, content="Second")
+        self.assertEqual(len(self.get()['comments']), 2)
+
+        self.client.force_authenticate(self.bob)
+        self.client.post(reverse('vote', args=['comment', self.comment.id]))
+        self.assertEqual(self.get()['comments'][0]['likes_count'], 1)
+
+    def test_single_flight_waits_for_the_running_rebuild(self):
+        builds = []
+        cache.add('tree-key:lock', 1)
+        # Another worker finishes its rebuild shortly after we start waiting
+        timer = threading.Timer(0.05, lambda: cache.set('tree-key', 'built elsewhere'))
+        timer.start()
+        value = tree_cache.single_flight('tree-key', lambda: builds.append(1) or 'built here', 60)
+        timer.join()
+        self.assertEqual(value, 'built elsewhere')
+        self.assertEqual(builds, [])
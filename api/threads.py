@@ -0,0 +1,172 @@
+"""
+Bounded loading of comment threads.
+
+A post can have tens of thousands of comments, so instead of loading the whole
+tree we load a window of it:
+  - `limit` root comments (top-level comments of a post, or direct replies of a
+    comment) after an optional (created_at, id) cursor,
+  - then, level by level down to `depth`, at most `replies` children per parent,
+    picked with a ROW_NUMBER() window in a single query per level.
+
+Each level is one query, so a page costs at most `depth` queries and
+limit * (1 + replies + replies**2 + ...) rows whatever the size of the thread.
+Rows are read with values() into tree.Node objects and rendered by tree.render();
+each node reports `more_replies = reply_count - len(replies)`.
+
+load_subtree() serves a single comment's whole subtree from the materialized path
+index on Comment (see models.py) instead.
+"""
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from . import likes, tree_cache
+from .models import Comment, path_ids
+from .pagination import keyset_filter
+from .tree import Node, ROW_FIELDS, iter_nodes
+
+ORDERING = ('created_at', 'id')
+
+
+def bounded(value, default, maximum):
+    """Parse an optional positive int query param and clamp it to `maximum`."""
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
+
+
+def mark_liked(user, nodes):
+    """Set user_has_liked on `nodes` from the viewer's cached liked ids (api/likes.py)."""
+    liked = likes.liked_ids(user, Comment)
+    for node in nodes:
+        node.user_has_liked = node.id in liked
+
+
+def comment_nodes(user, qs, limit=None):
+    rows = qs.values(*ROW_FIELDS)
+    if limit is not None:
+        rows = rows[:limit]
+    nodes = [Node(row) for row in rows]
+    mark_liked(user, nodes)
+    return nodes
+
+
+def load_threads(user, roots, after=None, limit=None, depth=None, replies=None):
+    """
+    Load a page of threads.
+
+    `roots` is a filter dict selecting the root comments (e.g. {'post_id': 1, 'parent': None}
+    or {'parent_id': 7}); `after` is a decoded (created_at, id) cursor.
+    Returns (root_nodes, has_more).
+    """
+    limit = limit or settings.COMMENT_PAGE_SIZE
+    depth = depth or settings.COMMENT_TREE_DEPTH
+    replies = replies or settings.COMMENT_REPLIES_PAGE_SIZE
+
+    qs = Comment.objects.filter(**roots).order_by(*ORDERING)
+    if after:
+        qs = qs.filter(keyset_filter(ORDERING, after))
+    level = comment_nodes(user, qs, limit + 1)
+    has_more = len(level) > limit
+    top = level[:limit]
+    load_replies(user, top, depth, replies)
+    return top, has_more
+
+
+def first_of_each(qs, partition, limit):
+    """The first `limit` rows of `qs` per value of `partition`, in ORDERING: one query for all of them."""
+    return qs.annotate(
+        position=Window(RowNumber(), partition_by=[F(partition)], order_by=[F('created_at').asc(), F('id').asc()])
+    ).filter(position__lte=limit).order_by(partition, *ORDERING)
+
+
+def load_replies(user, level, depth, replies):
+    """Attach up to `replies` children per node below `level`, `depth - 1` levels down: one query per level."""
+    for _ in range(depth - 1):
+        parents = {node.id: node for node in level if node.reply_count}
+        if not parents:
+            break
+        # First `replies` children of every parent of this level, in one query
+        children = first_of_each(Comment.objects.filter(parent_id__in=list(parents)), 'parent_id', replies)
+        level = comment_nodes(user, children)
+        for child in level:
+            parents[child.parent_id].replies.append(child)
+
+
+def posts_first_pages(user, post_ids, depth=None):
+    """
+    post_first_page() for many posts at once: {post_id: (root_nodes, has_more)}.
+
+    Same queries as for a single post, whatever the number of posts: the first
+    COMMENT_PAGE_SIZE top-level comments of every post in one windowed query, then one
+    query per level. The shared per-post tree cache is not used (it is one entry per post).
+    """
+    limit = settings.COMMENT_PAGE_SIZE
+    depth = depth or settings.COMMENT_TREE_DEPTH
+    pages = {post_id: [] for post_id in post_ids}
+    if not pages:
+        return {}
+    roots = first_of_each(Comment.objects.filter(post_id__in=list(pages), parent=None), 'post_id', limit + 1)
+    for node in comment_nodes(user, roots):
+        pages[node.post_id].append(node)
+    load_replies(user, [node for nodes in pages.values() for node in nodes[:limit]], depth, settings.COMMENT_REPLIES_PAGE_SIZE)
+    return {post_id: (nodes[:limit], len(nodes) > limit) for post_id, nodes in pages.items()}
+
+
+def post_first_page(user, post_id, depth=None):
+    """
+    The first page of a post's threads, as shown on its detail page: (root_nodes, has_more).
+
+    The default page is a shared, viewer-independent tree from the cache (tree_cache.py)
+    with only this viewer's likes looked up; a custom `depth` is loaded directly.
+    """
+    roots = {'post_id': post_id, 'parent': None}
+    if depth is not None:
+        return load_threads(user, roots, depth=depth)
+
+    def build():
+        nodes, more = load_threads(AnonymousUser(), roots)
+        return {'roots': nodes, 'has_more': more}
+    entry = tree_cache.cached_tree(post_id, build)
+    apply_likes(user, entry['roots'])
+    return entry['roots'], entry['has_more']
+
+
+def apply_likes(user, roots):
+    """Set user_has_liked on trees loaded for another viewer (e.g. the cached anonymous tree)."""
+    mark_liked(user, iter_nodes(roots))
+
+
+def load_comment(user, pk):
+    """A single comment as a Node (plus its path), or None."""
+    rows = list(Comment.objects.filter(pk=pk).values(*ROW_FIELDS, 'path'))
+    if not rows:
+        return None, None
+    node = Node(rows[0])
+    mark_liked(user, [node])
+    return node, rows[0]['path']
+
+
+def load_subtree(user, root, path, depth, limit=None):
+    """
+    Attach `root`'s descendants down to `depth` levels below it, using the materialized
+    path: one range scan in depth-first order, capped at `limit` rows.
+    Returns True if the subtree was truncated by the cap.
+    """
+    limit = limit or settings.COMMENT_THREAD_MAX_NODES
+    rows = comment_nodes(user, Comment.subtree_of(path, root.depth, max_depth=depth), limit + 1)
+
+    # Depth-first order means every parent is attached before its children, and the
+    # cap cuts off a suffix of the walk, never a parent of something we keep.
+    nodes = {root.id: root}
+    for node in rows[:limit]:
+        nodes[node.parent_id].replies.append(node)
+        nodes[node.id] = node
+    return len(rows) > limit
+
+
+def load_ancestors(user, path):
+    """Root-first ancestors of the comment at `path`, ids decoded from the path."""
+    return comment_nodes(user, Comment.objects.filter(pk__in=path_ids(path)[:-1]).order_by('path'))
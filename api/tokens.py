@@ -0,0 +1,105 @@
+"""
+Signed, expiring API tokens, sent as `Authorization: Bearer <token>`.
+
+Basic auth runs the password hasher (PBKDF2, a million iterations) on every request,
+tens of milliseconds of CPU for each vote and leaderboard poll. Instead
+POST /api/auth/login/ checks the password once and returns a token:
+
+    signing.dumps({'uid': user id, 'jti': random id, 'auth': session auth hash}, salt=SALT)
+
+django.core.signing signs it with SECRET_KEY and a timestamp. Verifying it takes an
+HMAC check, an expiry check against TOKEN_TTL_SECONDS, and one cache round trip
+(get_many) for the user and the denylist. No database query, no password hash:
+  - the user object is cached for TOKEN_USER_CACHE_TTL seconds and dropped whenever
+    the user is saved or deleted (signals.py);
+  - the token carries the user's session auth hash (an HMAC of the password hash,
+    as Django sessions do), so a password change revokes all of the user's tokens;
+  - POST /api/auth/logout/ puts the token's id on a denylist for TOKEN_TTL_SECONDS,
+    after which the token has expired anyway. The denylist only ever holds tokens
+    younger than that.
+With several worker processes the cached users and the denylist need a shared
+CACHE_BACKEND, or a logout only takes effect in the worker that handled it (see DEPLOY.md).
+"""
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+SALT = 'api.tokens'
+KEYWORD = 'Bearer'
+
+
+def _user_key(user_id):
+    return f'token:user:{user_id}'
+
+
+def _revoked_key(token_id):
+    return f'token:revoked:{token_id}'
+
+
+def issue(user):
+    """A new token for `user`: (token, expires_at)."""
+    token = signing.dumps(
+        {'uid': user.pk, 'jti': secrets.token_urlsafe(12), 'auth': user.get_session_auth_hash()},
+        salt=SALT,
+    )
+    return token, timezone.now() + timedelta(seconds=settings.TOKEN_TTL_SECONDS)
+
+
+def verify(token):
+    """(user, payload) for a valid `token`. Raises AuthenticationFailed."""
+    try:
+        payload = signing.loads(token, salt=SALT, max_age=settings.TOKEN_TTL_SECONDS)
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed('Token expired.')
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed('Invalid token.')
+
+    user_key, revoked_key = _user_key(payload['uid']), _revoked_key(payload['jti'])
+    found = cache.get_many([user_key, revoked_key])
+    if revoked_key in found:
+        raise exceptions.AuthenticationFailed('Token revoked.')
+    user = found.get(user_key)
+    if user is None:
+        user = get_user_model().objects.filter(pk=payload['uid']).first()
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+        cache.set(user_key, user, settings.TOKEN_USER_CACHE_TTL)
+    if not user.is_active or not constant_time_compare(payload['auth'], user.get_session_auth_hash()):
+        raise exceptions.AuthenticationFailed('Invalid token.')
+    return user, payload
+
+
+def revoke(payload):
+    cache.set(_revoked_key(payload['jti']), 1, settings.TOKEN_TTL_SECONDS)
+
+
+def forget_user(user_id):
+    """Drop the cached user (after it changed), so the next request reloads it."""
+    cache.delete(_user_key(user_id))
+
+
+class TokenAuthentication(BaseAuthentication):
+    """`Authorization: Bearer <token>`; request.auth is the token's payload."""
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None # Not ours: let Session/Basic authentication try
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+        return verify(token)
+
+    def authenticate_header(self, request):
+        return f'{KEYWORD} realm="api"'
@@ -0,0 +1,98 @@
+"""
+Per-post cache of the first page of a post's comment tree.
+
+The cached tree is viewer independent (content, authors, counts, built as an
+anonymous viewer); each response overlays the viewer's own likes on a copy of it
+(threads.apply_likes). Entries are keyed by a per-post version that is bumped
+whenever a comment is added/removed or a vote lands on one of the post's
+comments, so stale trees are simply never looked up again.
+
+Rebuilds are single-flight: when an entry is missing, one request takes a short
+cache lock and rebuilds while concurrent requests wait for its result instead of
+all hitting the database.
+
+Version bumps only reach the workers that share the cache. With a shared backend (Redis,
+Memcached) every worker sees them at once. With the default per-process LocMemCache the
+other workers keep their tree until it expires, so COMMENT_TREE_CACHE_TTL defaults to a
+couple of seconds there: long enough to absorb a burst of reads of a busy post, short
+enough that new comments and like counts show up promptly.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import routing
+
+LOCK_TIMEOUT = 10 # Seconds before a crashed rebuilder's lock is ignored
+WAIT_INTERVAL = 0.02
+
+
+def _version_key(post_id):
+    return f'post:{post_id}:tree-version'
+
+
+def post_version(post_id):
+    key = _version_key(post_id)
+    version = cache.get(key)
+    if version is None:
+        # New or evicted: start from a random version so a tree cached under an old
+        # version number can never be picked up again
+        cache.add(key, random.getrandbits(48), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate(post_ids):
+    for post_id in set(post_ids):
+        try:
+            cache.incr(_version_key(post_id))
+        except ValueError:
+            pass # No version yet: the next reader starts a fresh one
+
+
+def invalidate_on_commit(post_ids):
+    """
+    Bump now (so the writer's own transaction reads fresh) and again after commit, so a
+    reader that rebuilt from the pre-commit state in between can't keep its tree.
+    """
+    post_ids = set(post_ids)
+    if post_ids:
+        invalidate(post_ids)
+        transaction.on_commit(lambda: invalidate(post_ids))
+
+
+def single_flight(key, build, timeout):
+    """cache.get(key), or build() it with at most one concurrent builder per key."""
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock = f'{key}:lock'
+    if cache.add(lock, 1, LOCK_TIMEOUT):
+        try:
+            # Shared with every viewer under the current version: build it from the primary,
+            # never from a replica that may not have the write behind that version yet
+            with routing.primary():
+                value = build()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock)
+        return value
+
+    # Somebody else is rebuilding: wait a little for their result
+    deadline = time.monotonic() + settings.COMMENT_TREE_CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return build()
+
+
+def cached_tree(post_id, build):
+    """The cached first page of `post_id`'s tree: {'roots': [Node, ...], 'has_more': bool}."""
+    key = f'post:{post_id}:tree:{post_version(post_id)}'
+    return single_flight(key, build, settings.COMMENT_TREE_CACHE_TTL)
@@ -1,6 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, CommentViewSet, VoteView, LeaderboardView
+from . import async_views, metrics
+from .views import (
+    PostViewSet, CommentViewSet, VoteView, BulkVoteView, LeaderboardView, ExportView, LoginView, LogoutView,
+    SearchView
+)
 
 router = DefaultRouter()
 router.register(r'posts', PostViewSet)
@@ -8,6 +12,16 @@ router.register(r'comments', CommentViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('vote/bulk/', BulkVoteView.as_view(), name='vote-bulk'),
     path('vote/<str:model_name>/<int:pk>/', VoteView.as_view(), name='vote'),
     path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('auth/login/', LoginView.as_view(), name='login'),
+    path('auth/logout/', LogoutView.as_view(), name='logout'),
+    path('metrics/', metrics.metrics_view, name='metrics'),
+    path('export/<str:kind>/', ExportView.as_view(), name='export'),
+    # Async read path for the ASGI serving mode (api/async_views.py)
+    path('async/posts/', async_views.post_list, name='async-post-list'),
+    path('async/posts/<int:pk>/', async_views.post_detail, name='async-post-detail'),
+    path('async/leaderboard/', async_views.leaderboard, name='async-leaderboard'),
 ]
@@ -1,276 +1,433 @@
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.views import APIView
 from django.db.models import Count, Exists, OuterRef, Sum, Q
 from django.utils import timezone
 from datetime import timedelta
 from django.contrib.contenttypes.models import ContentType
-from django.db import transaction
-from .models import Post, Comment, Vote
+from django.db import DEFAULT_DB_ALIAS, transaction
+from .models import Post, Comment, Vote, MAX_COMMENT_DEPTH
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from rest_framework.utils.urls import replace_query_param
+from . import conditional, counters, export, fieldsets, leaderboard, routing, search, threads, tokens, tree, tree_cache, votes
+from .pagination import KeysetPagination, decode_cursor, encode_cursor
 from django.contrib.auth import get_user_model
 from .serializers import (
     PostSerializer, PostDetailSerializer, CommentSerializer,
-    LeaderboardEntrySerializer, UserSerializer
+    LeaderboardEntrySerializer, UserSerializer, BulkVoteSerializer, LoginSerializer, SearchResultSerializer
 )
 
 User = get_user_model()
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all().order_by('-created_at')
+# ?sort= of the feed -> keyset ordering, each backed by its own index on Post
+FEED_ORDERINGS = {
+    'new': ('-created_at', '-id'),
+    'hot': ('-hot_score', '-id'), # Time-decayed engagement, see api/hot.py
+}
+
+def feed_ordering(params):
+    sort = params.get('sort', 'new')
+    if sort not in FEED_ORDERINGS:
+        raise ValidationError({'sort': f"Must be one of {', '.join(FEED_ORDERINGS)}."})
+    return FEED_ORDERINGS[sort]
+
+# Serializer field -> the columns it reads, for ?fields= (see api/fieldsets.py)
+POST_COLUMNS = {
+    'author': ('author__id', 'author__username'),
+    'content': ('content',),
+    'created_at': ('created_at',),
+    'likes_count': ('likes_count', 'like_shards'), # like_shards: see counters.add_pending_likes
+    'comment_count': ('comment_count',),
+}
+COMMENT_COLUMNS = {
+    'author': ('author__id', 'author__username'),
+    'content': ('content',),
+    'created_at': ('created_at',),
+    'parent': ('parent',),
+    'likes_count': ('likes_count',),
+    'post': ('post',),
+    'reply_count': ('reply_count',),
+    'more_replies': ('reply_count',),
+    'depth': ('depth',),
+}
+
+def post_queryset(user, qs=None, fields=None, ordering=()):
+    # user_has_liked comes from the viewer's cached liked ids (api/likes.py) in PostSerializer,
+    # not from a per-row subquery. With ?fields= only the selected columns (plus the keyset
+    # `ordering`'s, for the next link) are read, and the author only joined when asked for.
+    qs = Post.objects.all() if qs is None else qs
+    if fields is None:
+        return qs.select_related('author')
+    if 'author' in fields:
+        qs = qs.select_related('author')
+    return qs.only(*fieldsets.columns(fields, POST_COLUMNS), *(name.lstrip('-') for name in ordering))
+
+def wants(fields, *names):
+    """Whether any of `names` is in the ?fields= selection `fields` (None: everything is)."""
+    return fields is None or any(name in fields for name in names)
+
+class ReplicaReadsMixin:
+    """Safe requests read from a replica unless the user wrote recently (see api/routing.py)."""
+
+    def dispatch(self, request, *args, **kwargs):
+        # Whatever initial() picks is undone when the request ends
+        with routing.reads_from(None):
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs) # Authenticates: the user decides the database
+        if request.method in SAFE_METHODS:
+            routing.switch_to_replica(request.user)
+
+class SparseFieldsViewMixin:
+    """?fields= / ?include= on read requests (see api/fieldsets.py)."""
+
+    def requested_fields(self):
+        # The selected field names, or None for all of them (and for every write)
+        if self.request.method not in SAFE_METHODS:
+            return None
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = fieldsets.requested(self.request.query_params, self.get_serializer_class())
+        return self._requested_fields
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'fields': self.requested_fields()}
+
+class PostViewSet(SparseFieldsViewMixin, ReplicaReadsMixin, viewsets.ModelViewSet):
+    queryset = Post.objects.all().order_by('-created_at', '-id')
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetPagination # Cursor on (created_at, id) or (hot_score, id), see api/pagination.py
 
     def get_serializer_class(self):
-        if self.action == 'retrieve':
+        if self.action in ('retrieve', 'batch'):
             return PostDetailSerializer
         return PostSerializer
 
     def get_queryset(self):
-        user = self.request.user
-        qs = super().get_queryset().select_related('author')
-        
-        # Annotate likes count
-        qs = qs.annotate(likes_count=Count('votes'))
-        
-        # Annotate user_has_liked
-        if user.is_authenticated:
-            post_ct = ContentType.objects.get_for_model(Post)
-            likes = Vote.objects.filter(
-                content_type=post_ct,
-                object_id=OuterRef('pk'),
-                user=user
-            )
-            qs = qs.annotate(user_has_liked=Exists(likes))
-        else:
-            qs = qs.annotate(user_has_liked=Exists(Post.objects.none()))
-            
-        return qs
+        # likes_count / comment_count are stored columns (api/counters.py), no COUNT join needed
+        ordering = self.get_keyset_ordering() if self.action == 'list' else ()
+        return post_queryset(self.request.user, super().get_queryset(), self.requested_fields(), ordering)
+
+    def get_keyset_ordering(self):
+        return feed_ordering(self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        # The page's ids first (an index-only scan): they and the posts' version stamps make
+        # the ETag, so a 304 loads and serializes nothing (see api/conditional.py)
+        page_ids = list(self.paginator.page_queryset(queryset, request, self).values_list('pk', flat=True))
+        etag = conditional.feed_etag(request.user, page_ids)
+        response = conditional.not_modified(request, etag)
+        if response is None:
+            by_id = queryset.in_bulk(page_ids)
+            posts = self.paginator.set_page([by_id[pk] for pk in page_ids if pk in by_id])
+            if wants(self.requested_fields(), 'likes_count'):
+                counters.add_pending_likes(posts) # Viral posts in sharded counter mode
+            serializer = self.get_serializer(posts, many=True)
+            response = self.get_paginated_response(serializer.data)
+        return conditional.set_validators(response, etag)
 
     def retrieve(self, request, *args, **kwargs):
+        # Validated from cached version stamps alone, before the post is even loaded
+        etag = conditional.post_etag(request.user, self.kwargs['pk'])
+        response = conditional.not_modified(request, etag)
+        if response is None:
+            response = self.render_detail(request) # Raises Http404 for a missing post
+        return conditional.set_validators(response, etag)
+
+    def render_detail(self, request):
         instance = self.get_object()
-        
-        # Fetch all comments for this post in constant queries
-        # 1 query for comments
-        # 1 query for User (author) - handled by select_related
-        # 1 query for Vote counts - handled by annotation
-        # 1 query for User Vote status - handled by annotation
-        
-        comment_ct = ContentType.objects.get_for_model(Comment)
-        
-        comments_qs = Comment.objects.filter(post=instance).select_related('author')
-        comments_qs = comments_qs.annotate(likes_count=Count('votes'))
-        
-        if request.user.is_authenticated:
-            user_likes = Vote.objects.filter(
-                content_type=comment_ct,
-                object_id=OuterRef('pk'),
-                user=request.user
-            )
-            comments_qs = comments_qs.annotate(user_has_liked=Exists(user_likes))
-        else:
-            comments_qs = comments_qs.annotate(user_has_liked=Exists(Comment.objects.none()))
-
-        # Execute query
-        all_comments = list(comments_qs)
-        
-        # Build tree in memory
-        comment_map = {c.id: c for c in all_comments}
-        top_level_comments = []
-        
-        for comment in all_comments:
-            comment.prefetched_replies = [] # Initialize empty list for recursive serializer
-        
-        for comment in all_comments:
-            if comment.parent_id:
-                parent = comment_map.get(comment.parent_id)
-                if parent:
-                    parent.prefetched_replies.append(comment)
-            else:
-                top_level_comments.append(comment)
-                
-        instance.prefetched_comments = top_level_comments
+        fields = self.requested_fields()
+        if wants(fields, 'likes_count'):
+            counters.add_pending_likes([instance])
+        
+        # Only the first page of the comment tree: COMMENT_PAGE_SIZE top-level comments,
+        # COMMENT_TREE_DEPTH levels deep, COMMENT_REPLIES_PAGE_SIZE replies per comment per level.
+        # One values() query per level (see api/threads.py) with the author joined in, likes_count
+        # stored on the row and user_has_liked from the viewer's cached likes. The rest is paged through
+        # /posts/<id>/comments/ and /comments/<id>/replies/.
+        # Without ?depth= the page is served from the per-post tree cache (api/tree_cache.py)
+        # with only this viewer's likes looked up. Not loaded at all when ?fields= leaves it out.
+        if wants(fields, 'comments', 'comments_next', 'has_more_comments'):
+            depth = threads.bounded(request.query_params.get('depth'), None, settings.COMMENT_MAX_DEPTH)
+            comments, has_more = threads.post_first_page(request.user, instance.pk, depth)
+            instance.rendered_comments = tree.render(comments) # Fast path, see api/tree.py
+            if has_more:
+                instance.comments_next = thread_page_link(request, 'post-comments', instance.pk, comments[-1])
         
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """
+        GET ?ids=1,2,3: post details (as retrieve, for the default first page of comments)
+        of up to POST_BATCH_MAX_IDS posts, in the order asked. Missing ids are listed in
+        `missing`. The number of queries doesn't depend on the number of posts: one for
+        the posts, one per comment tree level for all of them, the viewer's cached likes.
+        """
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in request.query_params.get('ids', '').split(',') if pk.strip()))
+        except ValueError:
+            raise ValidationError({'ids': 'Must be a comma-separated list of integers.'})
+        if not ids:
+            raise ValidationError({'ids': 'Enter at least one id.'})
+        if len(ids) > settings.POST_BATCH_MAX_IDS:
+            raise ValidationError({'ids': f'At most {settings.POST_BATCH_MAX_IDS} ids per request.'})
+
+        fields = self.requested_fields()
+        by_id = self.get_queryset().in_bulk(ids)
+        posts = [by_id[pk] for pk in ids if pk in by_id]
+        if wants(fields, 'likes_count'):
+            counters.add_pending_likes(posts)
+        if wants(fields, 'comments', 'comments_next', 'has_more_comments'):
+            depth = threads.bounded(request.query_params.get('depth'), None, settings.COMMENT_MAX_DEPTH)
+            pages = threads.posts_first_pages(request.user, list(by_id), depth)
+            for post in posts:
+                comments, has_more = pages[post.pk]
+                post.rendered_comments = tree.render(comments)
+                if has_more:
+                    post.comments_next = thread_page_link(request, 'post-comments', post.pk, comments[-1])
+
+        return Response({
+            'results': self.get_serializer(posts, many=True).data,
+            'missing': [pk for pk in ids if pk not in by_id],
+        })
+
+    @action(detail=True, methods=['get'])
+    def comments(self, request, pk=None):
+        # Further pages of a post's top-level threads
+        post = get_object_or_404(Post.objects.only('pk'), pk=pk)
+        return thread_page(request, 'post-comments', post.pk, {'post': post, 'parent': None})
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(SparseFieldsViewMixin, ReplicaReadsMixin, viewsets.ModelViewSet):
     queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
 
+    def get_queryset(self):
+        fields = self.requested_fields()
+        if fields is None:
+            return super().get_queryset().select_related('author')
+        queryset = super().get_queryset().only(*fieldsets.columns(fields, COMMENT_COLUMNS))
+        return queryset.select_related('author') if 'author' in fields else queryset
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        # Atomic so the comment and its post's comment_count bump (signals.py) commit together
+        with transaction.atomic():
+            serializer.save(author=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        # A comment with its subtree (depth-first range scan on the materialized path)
+        # and its ancestors (ids decoded from the path), for deep links into a discussion
+        comment, path = threads.load_comment(request.user, pk)
+        if comment is None:
+            raise Http404
+        depth = threads.bounded(request.query_params.get('depth'), settings.COMMENT_THREAD_DEPTH, MAX_COMMENT_DEPTH)
+        truncated = threads.load_subtree(request.user, comment, path, depth)
+        ancestors = threads.load_ancestors(request.user, path)
+        return Response({
+            'ancestors': tree.render(ancestors),
+            'comment': tree.render([comment])[0],
+            'truncated': truncated,
+        })
+
+    @action(detail=True, methods=['get'])
+    def replies(self, request, pk=None):
+        # Pages of a comment's direct replies, each with its own bounded subtree
+        comment = get_object_or_404(Comment.objects.only('pk'), pk=pk)
+        return thread_page(request, 'comment-replies', comment.pk, {'parent': comment})
+
+
+def thread_page_link(request, url_name, pk, last):
+    url = request.build_absolute_uri(reverse(url_name, args=[pk]))
+    return replace_query_param(url, 'cursor', encode_cursor([last.created_at, last.id]))
+
+
+def thread_page(request, url_name, pk, roots):
+    """Cursor-paged response of comment threads selected by the `roots` filter."""
+    cursor = request.query_params.get('cursor')
+    comments, has_more = threads.load_threads(
+        request.user, roots,
+        after=decode_cursor(cursor, Comment, threads.ORDERING) if cursor else None,
+        limit=threads.bounded(request.query_params.get('page_size'), None, settings.COMMENT_MAX_PAGE_SIZE),
+        depth=threads.bounded(request.query_params.get('depth'), None, settings.COMMENT_MAX_DEPTH),
+    )
+    return Response({
+        'next': thread_page_link(request, url_name, pk, comments[-1]) if has_more else None,
+        'has_more': has_more,
+        'results': tree.render(comments),
+    })
 
 class VoteView(generics.GenericAPIView):
+    """
+    PUT likes, DELETE un-likes, POST toggles (kept for old clients).
+
+    Each write is one conflict-aware statement (see votes.like / votes.unlike): the
+    unique constraint settles concurrent double clicks, there is no fetch of the target
+    first and no IntegrityError to recover from. Responses carry the fresh count.
+    """
     permission_classes = [IsAuthenticatedOrReadOnly]
-    
-    def post(self, request, model_name, pk):
+
+    def get_model(self, model_name):
         # 'model_name' should be 'post' or 'comment'
-        if model_name.lower() == 'post':
-            model = Post
-        elif model_name.lower() == 'comment':
-            model = Comment
-        else:
-            return Response({'error': 'Invalid model'}, status=status.HTTP_400_BAD_REQUEST)
-            
-        try:
-            obj = model.objects.get(pk=pk)
-        except model.DoesNotExist:
+        return votes.VOTE_MODELS.get(model_name.lower())
+
+    def vote_response(self, model, pk, liked, status_code=status.HTTP_200_OK, **extra):
+        count = votes.likes_count(model, pk)
+        if count is None:
             return Response({'error': 'Object not found'}, status=status.HTTP_404_NOT_FOUND)
-            
-        ct = ContentType.objects.get_for_model(model)
-        
-        # Concurrency: Use atomic transaction
-        # To strictly prevent double-likes even with race conditions, DB unique constraint is key.
-        # We have UniqueConstraint(user, content_type, object_id) in Vote model.
-        
-        try:
-            Vote.objects.create(
-                user=request.user,
-                content_type=ct,
-                object_id=obj.pk,
-                value=1
-            )
-            return Response({'status': 'liked'}, status=status.HTTP_201_CREATED)
-        except Exception: # IntegrityError
-            # If already liked, we can unlike (toggle) or return error. 
-            # Requirement says "cannot double like". It implies state check.
-            # Let's verify if they want toggle or explicit Unlike.
-            # "Like/Unlike API" in task list implies both.
-            # Let's check if it exists and delete.
-            deleted, _ = Vote.objects.filter(
-                user=request.user,
-                content_type=ct,
-                object_id=obj.pk
-            ).delete()
-            
-            if deleted:
-                return Response({'status': 'unliked'}, status=status.HTTP_200_OK)
-            else:
-               # Should not happen if create failed due to integrity error, 
-               # but strictly speaking create might fail for other reasons.
-               # If IntegrityError, it meant it existed.
-               return Response({'status': 'error'}, status=status.HTTP_400_BAD_REQUEST)
-
-class LeaderboardView(generics.ListAPIView):
-    permission_classes = [IsAuthenticatedOrReadOnly]
-    serializer_class = LeaderboardEntrySerializer
+        return Response({**extra, 'likes_count': count, 'user_has_liked': liked}, status=status_code)
 
-    def get_queryset(self):
-        # Calculate last 24h
-        last_24h = timezone.now() - timedelta(hours=24)
-        
-        # We need to sum up karma for each user.
-        # User -> posts -> votes (worth 5)
-        # User -> comments -> votes (worth 1)
-        
-        # To avoid Cartesian products when joining two to-many relationships (posts-votes and comments-votes),
-        # we should use subqueries or sum them separately.
-        # Given this is a prototype, assuming not huge scale, we can try a combined approach but Django might warn.
-        # Better: use Subquery.
-        
-        post_ct = ContentType.objects.get_for_model(Post)
-        comment_ct = ContentType.objects.get_for_model(Comment)
-        
-        # Subquery for Post Karma
-        # We want: for each user, sum(votes on their posts created > 24h) * 5
-        # Vote -> GenericFK to Post -> Author
-        # Note: GenericRelation on Post is 'votes'.
-        
-        # Unfortunately, querying backward from User -> Post -> Vote via Subquery is easiest.
-        
-        # Let's count votes on posts for the user
-        # We can filters votes by content_type=post_ct, created_at > 24h.
-        # But we need to group by Post__Author.
-        # The Vote model has 'object_id'.
-        # We can't easily join object_id to Post table inside a Value aggregate without proper setup.
-        
-        # However, we have GenericRelation.
-        # So we can filter Post objects independent of User?
-        
-        # Let's try the direct annotation and see if Django handles it (it usually does separate subqueries for multiple annotations since Django 2.0+ if strict).
-        # Actually, let's just do it in Python for the "Top Users" if the user count is small? No, "complex systems efficienty".
-        
-        # Correct efficient approach:
-        # 1. Aggregation on Votes for Posts
-        post_karma_qs = Vote.objects.filter(
-            content_type=post_ct,
-            created_at__gte=last_24h
-        ).values('object_id') # Group by Post
-        
-        # This gives votes per post. We need votes per Author.
-        # We need to join Vote -> Post -> Author.
-        
-        # Since Vote has GenericForeignKey, we can't directly join 'content_object__author'.
-        # Constraints says "The Tree" and "The Math" are important.
-        
-        # Efficient SQL way:
-        # SELECT post.author_id, COUNT(*) * 5 
-        # FROM api_vote v 
-        # JOIN api_post p ON v.object_id = p.id 
-        # WHERE v.content_type_id = <post_ct_id> AND v.created_at >= <date>
-        # GROUP BY p.author_id
-        
-        # We can express this in Django ORM starting from Post?
-        # Post.objects.filter(votes__created_at__gte=last_24h).values('author').annotate(k=Count('votes')*5)
-        
-        post_karma = Post.objects.filter(
-            votes__created_at__gte=last_24h,
-            votes__content_type=post_ct # Redundant if using related name but safe
-        ).values('author').annotate(
-            score=Count('votes') * 5
-        )
-        
-        comment_karma = Comment.objects.filter(
-            votes__created_at__gte=last_24h,
-            votes__content_type=comment_ct
-        ).values('author').annotate(
-            score=Count('votes')
+    def put(self, request, model_name, pk):
+        model = self.get_model(model_name)
+        if model is None:
+            return Response({'error': 'Invalid model'}, status=status.HTTP_400_BAD_REQUEST)
+        created = votes.like(request.user, model, pk)
+        return self.vote_response(model, pk, True, status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def delete(self, request, model_name, pk):
+        model = self.get_model(model_name)
+        if model is None:
+            return Response({'error': 'Invalid model'}, status=status.HTTP_400_BAD_REQUEST)
+        votes.unlike(request.user, model, pk)
+        return self.vote_response(model, pk, False)
+
+    def post(self, request, model_name, pk):
+        model = self.get_model(model_name)
+        if model is None:
+            return Response({'error': 'Invalid model'}, status=status.HTTP_400_BAD_REQUEST)
+        if votes.unlike(request.user, model, pk):
+            return self.vote_response(model, pk, False, status='unliked')
+        if votes.like(request.user, model, pk):
+            return self.vote_response(model, pk, True, status.HTTP_201_CREATED, status='liked')
+        # A concurrent request (double click) liked it in between, or the target is gone (404)
+        return self.vote_response(model, pk, True, status='unchanged')
+
+class BulkVoteView(generics.GenericAPIView):
+    # Batched like/unlike for offline-sync clients and migration tooling (see votes.bulk_vote)
+    permission_classes = [IsAuthenticated]
+    serializer_class = BulkVoteSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = votes.bulk_vote(request.user, serializer.validated_data['operations'])
+        return Response({'results': results})
+
+class LoginView(generics.GenericAPIView):
+    """
+    POST {username, password} -> {token, expires_at, user}. The password is checked here
+    once; requests then send `Authorization: Bearer <token>` (see api/tokens.py).
+    """
+    authentication_classes = [] # A stale token or bad Basic header must not block logging in
+    permission_classes = [AllowAny]
+    serializer_class = LoginSerializer
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, expires_at = tokens.issue(user)
+        return Response({'token': token, 'expires_at': expires_at, 'user': UserSerializer(user).data})
+
+class LogoutView(generics.GenericAPIView):
+    # Revokes the token the request was made with (no-op for session and Basic auth)
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if isinstance(request.successful_authenticator, tokens.TokenAuthentication):
+            tokens.revoke(request.auth)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class ExportView(APIView):
+    """
+    GET /api/export/<posts|comments|votes>/: NDJSON stream of every row, for analytics
+    (see api/export.py). ?since_id= / ?since= for incremental exports, ?gzip=1 for a
+    .ndjson.gz download. Read from a replica when there is one.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, kind):
+        if kind not in export.KINDS:
+            return Response({'error': f"Must be one of {', '.join(export.KINDS)}."}, status=status.HTTP_404_NOT_FOUND)
+        params = request.query_params
+        options = {'using': routing.replica_for(request.user) or DEFAULT_DB_ALIAS}
+        if params.get('since_id'):
+            try:
+                options['since_id'] = int(params['since_id'])
+            except ValueError:
+                raise ValidationError({'since_id': 'Must be an integer.'})
+        if params.get('since'):
+            try:
+                options['since'] = export.parse_since(params['since'])
+            except ValueError as exc:
+                raise ValidationError({'since': str(exc)})
+        gzip = params.get('gzip') in ('1', 'true')
+        response = StreamingHttpResponse(
+            export.stream(kind, gzip=gzip, **options),
+            content_type='application/gzip' if gzip else 'application/x-ndjson',
         )
-        
-        # Now we have two querysets:
-        # [{'author': 1, 'score': 10}, ...]
-        # [{'author': 2, 'score': 3}, ...]
-        
-        # We merge them in Python. For a "Top 5" leaderboard, this is efficient enough 
-        # unless we have millions of active users in 24h.
-        # If we strictly need SQL, we can use union or common table expressions, 
-        # or a User query with Subqueries.
-        
-        # Let's use Python merge for readability and reasonable performance.
-        # To get the User objects, we can extract IDs.
-        
-        scores = {}
-        
-        # Convert to dict
-        for item in post_karma:
-            uid = item['author']
-            scores[uid] = scores.get(uid, 0) + item['score']
-            
-        for item in comment_karma:
-            uid = item['author']
-            scores[uid] = scores.get(uid, 0) + item['score']
-            
-        # Sort top 5
-        top_user_ids = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:5]
-        
-        # Fetch User objects
-        results = []
-        if top_user_ids:
-            users = User.objects.in_bulk([uid for uid, _ in top_user_ids])
-            for uid, score in top_user_ids:
-                user = users.get(uid)
-                if user:
-                    results.append({'username': user.username, 'score': score})
-                    
-        return results
+        response['Content-Disposition'] = f'attachment; filename="{kind}.ndjson{".gz" if gzip else ""}"'
+        return response
 
-    def list(self, request, *args, **kwargs):
-        # Override list to avoid pagination overhead if we return list
-        data = self.get_queryset()
-        serializer = self.get_serializer(data, many=True)
-        return Response(serializer.data)
+class SearchView(ReplicaReadsMixin, generics.GenericAPIView):
+    """
+    GET ?q=words[&type=post|comment][&page=N][&page_size=M]: posts and comments containing
+    every word, best match first, from the database's full-text index (see api/search.py).
+    """
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    serializer_class = SearchResultSerializer
+
+    def get(self, request):
+        params = request.query_params
+        if not search.words(params.get('q', '')):
+            raise ValidationError({'q': 'Enter at least one word.'})
+        kind = params.get('type')
+        if kind is not None and kind not in search.MODELS:
+            raise ValidationError({'type': f"Must be one of {', '.join(search.MODELS)}."})
+        page_size = threads.bounded(params.get('page_size'), settings.SEARCH_PAGE_SIZE, settings.FEED_MAX_PAGE_SIZE)
+        page = threads.bounded(params.get('page'), 1, settings.SEARCH_MAX_RESULTS // page_size)
+        hits, has_more = search.search(params['q'], [kind] if kind else None, (page - 1) * page_size, page_size)
+        has_more = has_more and page * page_size < settings.SEARCH_MAX_RESULTS
 
+        results = search.load(hits)
+        next_url = replace_query_param(request.build_absolute_uri(), 'page', page + 1) if has_more else None
+        return Response({'next': next_url, 'has_more': has_more, 'results': self.get_serializer(results, many=True).data})
+
+def leaderboard_page(params):
+    """
+    Top `?limit=` authors of the `?window=` leaderboard, read from its precomputed snapshot
+    (api/leaderboard.py): (entries, computed_at). Raises ValidationError for an unknown window.
+    """
+    window = params.get('window', leaderboard.DEFAULT_WINDOW)
+    if window not in leaderboard.WINDOWS:
+        raise ValidationError({'window': f"Must be one of {', '.join(leaderboard.WINDOWS)}."})
+    limit = threads.bounded(params.get('limit'), 5, settings.LEADERBOARD_SNAPSHOT_SIZE)
+    snap = leaderboard.snapshot(window)
+    return snap['entries'][:limit], snap['computed_at']
+
+class LeaderboardView(ReplicaReadsMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    serializer_class = LeaderboardEntrySerializer
+
+    def list(self, request, *args, **kwargs):
+        # Karma earned in the window, as of the snapshot's computed_at. Snapshots are rebuilt
+        # from the hourly karma ledger (api/karma.py) on a fixed cadence, never per request.
+        entries, computed_at = leaderboard_page(request.query_params)
+        etag = conditional.leaderboard_etag(computed_at)
+        response = conditional.not_modified(request, etag, computed_at)
+        if response is None:
+            response = Response(self.get_serializer(entries, many=True).data)
+        response['X-Computed-At'] = computed_at.isoformat()
+        return conditional.set_validators(response, etag, computed_at, private=False)
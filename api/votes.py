@@ -0,0 +1,278 @@
+"""
+Side effects of a vote being added or removed.
+
+Every write path (signals for ORM saves/deletes, and any bulk path that bypasses
+signals) funnels through apply_vote_changes() so the counters, the karma ledger
+and the comment tree cache always see the same changes.
+"""
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import archive, conditional, counters, karma, likes, tree_cache
+from .models import Post, Comment, Vote, ArchivedVote
+
+
+def apply_vote_changes(changes, voters=()):
+    """
+    `changes`: iterable of (content_type_id, object_id, created_at, delta),
+    delta = +1 for an added like, -1 for a removed one.
+    `voters`: ids of the users who cast / removed these votes.
+    """
+    changes = list(changes)
+    if not changes:
+        return
+    with transaction.atomic():
+        likes.update_on_commit(voters, changes)
+        counters.record_vote_changes(changes)
+        karma.record_vote_changes(changes)
+
+        # Post like counts are part of the post's ETag (api/conditional.py)...
+        post_ct = ContentType.objects.get_for_model(Post)
+        conditional.bump_posts({object_id for ct_id, object_id, _, _ in changes if ct_id == post_ct.id})
+
+        # ...and comment like counts of their post's cached tree
+        comment_ct = ContentType.objects.get_for_model(Comment)
+        comment_ids = {object_id for ct_id, object_id, _, _ in changes if ct_id == comment_ct.id}
+        if comment_ids:
+            tree_cache.invalidate_on_commit(
+                Comment.objects.filter(pk__in=comment_ids).values_list('post_id', flat=True)
+            )
+
+
+VOTE_MODELS = {'post': Post, 'comment': Comment}
+
+
+def bulk_vote(user, operations):
+    """
+    Apply a batch of {'model', 'id', 'action'} like/unlike operations for `user`.
+
+    Operations run in order against the user's current likes, so liking and then
+    un-liking the same target in one batch is a no-op. The votes themselves take one
+    target lookup and one vote lookup per model, one multi-row INSERT and a locked
+    SELECT plus DELETE, whatever the batch size; the side effects go through
+    apply_vote_changes() once, but still cost one counter UPDATE per touched object.
+
+    Only the rows this call actually wrote count: a like inserted or removed
+    concurrently by another request (a double click, another device) is left to that
+    request's changes, so counters and karma stay exact.
+
+    Returns one {'model', 'id', 'action', 'status', 'likes_count'} per operation,
+    status being 'liked', 'unliked', 'unchanged' or 'not_found'.
+    """
+    wanted = defaultdict(set)
+    for op in operations:
+        wanted[op['model']].add(op['id'])
+
+    with transaction.atomic():
+        found = {}
+        liked = {}
+        archived = {}
+        for name, ids in wanted.items():
+            model = VOTE_MODELS[name]
+            ct = ContentType.objects.get_for_model(model)
+            found[name] = model.objects.only('pk').in_bulk(ids)
+            liked[name] = dict(Vote.objects.filter(
+                user=user, content_type=ct, object_id__in=ids
+            ).values_list('object_id', 'created_at'))
+            # Archived likes count as liked too (api/archive.py)
+            archived[name] = dict(ArchivedVote.objects.filter(
+                user=user, content_type=ct, object_id__in=ids
+            ).values_list('object_id', 'created_at'))
+            liked[name].update(archived[name])
+
+        # Replay the operations on the in-memory state to get the net change per target
+        state = {(name, pk) for name, votes in liked.items() for pk in votes}
+        results = []
+        for op in operations:
+            key = (op['model'], op['id'])
+            if op['id'] not in found[op['model']]:
+                result = 'not_found'
+            elif op['action'] == 'like':
+                result = 'unchanged' if key in state else 'liked'
+                state.add(key)
+            else:
+                result = 'unliked' if key in state else 'unchanged'
+                state.discard(key)
+            results.append({**op, 'status': result})
+
+        before = {(name, pk) for name, votes in liked.items() for pk in votes}
+        added = state - before
+        removed = before - state
+
+        changes = []
+        if added:
+            now = timezone.now()
+            inserted = _insert_votes(user, [
+                (ContentType.objects.get_for_model(VOTE_MODELS[name]).id, pk) for name, pk in added
+            ], now)
+            changes += [(ct_id, pk, now, 1) for ct_id, pk in inserted]
+        if removed:
+            condition = Q()
+            for name in {name for name, _ in removed}:
+                condition |= Q(
+                    content_type=ContentType.objects.get_for_model(VOTE_MODELS[name]),
+                    object_id__in=[pk for n, pk in removed if n == name]
+                )
+            # Lock the rows, then delete them by pk: rows another request removed meanwhile
+            # aren't returned, so only what this call deletes is taken off the counters.
+            # _raw_delete: one DELETE statement, without Django collecting the rows and firing
+            # post_delete per vote - the side effects are applied in bulk just below.
+            for model in (Vote, ArchivedVote):
+                rows = list(model.objects.select_for_update().filter(condition, user=user).values_list(
+                    'pk', 'content_type_id', 'object_id', 'created_at'
+                ))
+                if not rows:
+                    continue
+                model.objects.filter(pk__in=[row[0] for row in rows])._raw_delete(model.objects.db)
+                if model is ArchivedVote:
+                    archive.remove_from_totals((ct_id, pk) for _, ct_id, pk, _ in rows)
+                changes += [(ct_id, pk, created_at, -1) for _, ct_id, pk, created_at in rows]
+        apply_vote_changes(changes, [user.pk])
+
+    counts = {}
+    for name, ids in wanted.items():
+        fields = ('likes_count', 'like_shards') if name == 'post' else ('likes_count',)
+        rows = list(VOTE_MODELS[name].objects.filter(pk__in=ids).only(*fields))
+        if name == 'post':
+            counters.add_pending_likes(rows)
+        counts[name] = {row.pk: row.likes_count for row in rows}
+    for result in results:
+        result['likes_count'] = counts[result['model']].get(result['id'])
+    return results
+
+
+def _vote_columns():
+    opts = Vote._meta
+    quote = connection.ops.quote_name
+    return quote(opts.db_table), {
+        name: quote(opts.get_field(name).column)
+        for name in ('user', 'content_type', 'object_id', 'value', 'created_at')
+    }
+
+
+def _from_db(name, value):
+    # Raw cursors skip the backend's converters (e.g. SQLite returns datetimes as text)
+    col = Vote._meta.get_field(name).get_col(Vote._meta.db_table)
+    for converter in connection.ops.get_db_converters(col) + col.get_db_converters(connection):
+        value = converter(value, col, connection)
+    return value
+
+
+def _insert_votes(user, targets, now):
+    """
+    Insert a like of `user` for every (content_type_id, object_id) in `targets`, skipping
+    the ones that already exist. Returns the targets actually inserted.
+    """
+    table, col = _vote_columns()
+    created_at = Vote._meta.get_field('created_at').get_db_prep_value(now, connection)
+    insert = 'INSERT IGNORE INTO' if connection.vendor == 'mysql' else 'INSERT INTO'
+    conflict = '' if connection.vendor == 'mysql' else ' ON CONFLICT DO NOTHING'
+    columns = f"({col['user']}, {col['content_type']}, {col['object_id']}, {col['value']}, {col['created_at']})"
+    with connection.cursor() as cursor:
+        if connection.features.can_return_rows_from_bulk_insert:
+            # One statement; RETURNING only lists the rows the conflict clause didn't skip
+            cursor.execute(
+                f"{insert} {table} {columns} VALUES {', '.join(['(%s, %s, %s, 1, %s)'] * len(targets))}{conflict} "
+                f"RETURNING {col['content_type']}, {col['object_id']}",
+                [value for ct_id, pk in targets for value in (user.pk, ct_id, pk, created_at)]
+            )
+            return [tuple(row) for row in cursor.fetchall()]
+        # MySQL has no INSERT ... RETURNING: one statement per like, checked by its rowcount
+        inserted = []
+        for ct_id, pk in targets:
+            cursor.execute(f"{insert} {table} {columns} VALUES (%s, %s, %s, 1, %s)", [user.pk, ct_id, pk, created_at])
+            if cursor.rowcount == 1:
+                inserted.append((ct_id, pk))
+        return inserted
+
+
+def like(user, model, pk):
+    """
+    Idempotent like: a single INSERT ... SELECT that only inserts when the target exists
+    and the user has not liked it yet. Concurrent double clicks are settled by the
+    unique constraint inside the statement, so exactly one of them reports True.
+    Returns True if a vote was added.
+
+    A like moved to the archive (api/archive.py) is no longer in Vote's unique constraint,
+    so a successful INSERT is checked against ArchivedVote and undone if the user had
+    already liked the object. The check runs after the INSERT on purpose: an INSERT that
+    waited on a vote being archived concurrently sees the archived row in this next statement.
+    """
+    ct = ContentType.objects.get_for_model(model)
+    table, col = _vote_columns()
+    now = timezone.now()
+    insert = 'INSERT IGNORE INTO' if connection.vendor == 'mysql' else 'INSERT INTO'
+    conflict = '' if connection.vendor == 'mysql' else ' ON CONFLICT DO NOTHING'
+    # (SQLite only parses an upsert after INSERT ... SELECT when the SELECT has a WHERE clause)
+    sql = (
+        f"{insert} {table} ({col['user']}, {col['content_type']}, {col['object_id']}, {col['value']}, {col['created_at']}) "
+        f"SELECT %s, %s, {connection.ops.quote_name(model._meta.pk.column)}, 1, %s "
+        f"FROM {connection.ops.quote_name(model._meta.db_table)} "
+        f"WHERE {connection.ops.quote_name(model._meta.pk.column)} = %s{conflict}"
+    )
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, ct.id, Vote._meta.get_field('created_at').get_db_prep_value(now, connection), pk])
+            created = cursor.rowcount == 1
+        if created and ArchivedVote.objects.filter(user=user, content_type=ct, object_id=pk).exists():
+            Vote.objects.filter(user=user, content_type=ct, object_id=pk)._raw_delete(Vote.objects.db)
+            created = False
+        if created:
+            apply_vote_changes([(ct.id, pk, now, 1)], [user.pk])
+    return created
+
+
+def unlike(user, model, pk):
+    """
+    Idempotent unlike: one DELETE ... RETURNING created_at (the ledger needs the hour the
+    like was counted in). Returns True if a vote was removed. Likes that were archived
+    (api/archive.py) are removed from the archive instead.
+    """
+    ct = ContentType.objects.get_for_model(model)
+    with transaction.atomic():
+        if connection.features.can_return_columns_from_insert:
+            # Postgres, SQLite >= 3.35: RETURNING works for DELETE as well
+            table, col = _vote_columns()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {table} WHERE {col['user']} = %s AND {col['content_type']} = %s "
+                    f"AND {col['object_id']} = %s RETURNING {col['created_at']}",
+                    [user.pk, ct.id, pk]
+                )
+                row = cursor.fetchone()
+            created_at = row and _from_db('created_at', row[0])
+        else:
+            # MySQL has no DELETE ... RETURNING: lock the row, then delete it by pk
+            row = Vote.objects.select_for_update().filter(
+                user=user, content_type=ct, object_id=pk
+            ).values_list('pk', 'created_at').first()
+            created_at = None
+            if row:
+                Vote.objects.filter(pk=row[0])._raw_delete(Vote.objects.db)
+                created_at = row[1]
+        if not created_at:
+            row = ArchivedVote.objects.select_for_update().filter(
+                user=user, content_type=ct, object_id=pk
+            ).values_list('pk', 'created_at').first()
+            if row:
+                ArchivedVote.objects.filter(pk=row[0])._raw_delete(ArchivedVote.objects.db)
+                archive.remove_from_totals([(ct.id, pk)])
+                created_at = row[1]
+        if created_at:
+            apply_vote_changes([(ct.id, pk, created_at, -1)], [user.pk])
+    return bool(created_at)
+
+
+def likes_count(model, pk):
+    """Current like count of a post/comment (including pending shards), or None if it is gone."""
+    fields = ('likes_count', 'like_shards') if model is Post else ('likes_count',)
+    obj = model.objects.filter(pk=pk).only(*fields).first()
+    if obj is None:
+        return None
+    if model is Post:
+        counters.add_pending_likes([obj])
+    return obj.likes_count
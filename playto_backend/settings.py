@@ -50,15 +50,19 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'api.User'
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware', # First, so it times everything below (see api/metrics.py)
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware', # Add WhiteNoise
+    'api.static.StaticFilesMiddleware', # WhiteNoise, async capable (see api/static.py)
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Only with PROFILE_DIR set; after authentication, to honour X-Profile for staff only (see api/profiling.py)
+    'api.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.routing.ReplicaPinMiddleware', # After authentication: pins writers to the primary (see api/routing.py)
 ]
 
 ROOT_URLCONF = 'playto_backend.urls'
@@ -95,6 +99,34 @@ DATABASES = {
 if os.environ.get('DB_ENGINE') == 'django.db.backends.postgresql' and not os.environ.get('DATABASE_URL'):
     DATABASES['default']['ENGINE'] = 'django.db.backends.postgresql'
 
+# Read replicas (api/routing.py): comma-separated database URLs, added as DATABASES['replica1'], ...
+# Safe requests to the feed, post, comment and leaderboard views read from one of them, except for
+# users who wrote something in the last REPLICA_STICKY_SECONDS (keep it above the replicas' lag).
+# In tests the replicas mirror the test database.
+REPLICA_DATABASES = []
+for number, url in enumerate(filter(None, map(str.strip, os.environ.get('REPLICA_DATABASE_URLS', '').split(','))), 1):
+    DATABASES[f'replica{number}'] = {**dj_database_url.parse(url, conn_max_age=600), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica{number}')
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', '5'))
+DATABASE_ROUTERS = ['api.routing.ReplicaRouter']
+
+
+# Cache: local memory per process by default. Point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache, redis://...) to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+# ETags on the feed and post detail (api/conditional.py) are built from version stamps in the
+# cache, so every worker must share it: off with the default per-process LocMemCache, where
+# another worker would keep answering 304 with stale pages. POST_ETAGS=True forces them on,
+# e.g. for a single worker process.
+POST_ETAGS = os.environ.get(
+    'POST_ETAGS', str(not CACHES['default']['BACKEND'].endswith('LocMemCache'))
+) == 'True'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -140,3 +172,97 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True # For prototype simplicity
+
+# DRF's default Session and Basic authentication, plus Bearer tokens (api/tokens.py) that skip
+# Basic's per-request password hash. Session stays first, so failures keep answering 403.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+        'api.tokens.TokenAuthentication',
+    ],
+}
+
+# Feed pagination (api/pagination.py): default page size and the cap for ?page_size=
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', '20'))
+FEED_MAX_PAGE_SIZE = int(os.environ.get('FEED_MAX_PAGE_SIZE', '100'))
+
+# Hot feed ranking (api/hot.py): seconds of age worth a 10x engagement difference, how many
+# likes a comment counts as, and the cadence of `refresh_hot_scores --loop`
+HOT_DECAY_SECONDS = int(os.environ.get('HOT_DECAY_SECONDS', '45000'))
+HOT_COMMENT_WEIGHT = int(os.environ.get('HOT_COMMENT_WEIGHT', '2'))
+HOT_REFRESH_SECONDS = int(os.environ.get('HOT_REFRESH_SECONDS', '300'))
+
+# Comment threads (api/threads.py): top-level comments per page, levels per page,
+# replies per comment per level, and the caps for ?page_size= / ?depth=
+COMMENT_PAGE_SIZE = int(os.environ.get('COMMENT_PAGE_SIZE', '20'))
+COMMENT_TREE_DEPTH = int(os.environ.get('COMMENT_TREE_DEPTH', '3'))
+COMMENT_REPLIES_PAGE_SIZE = int(os.environ.get('COMMENT_REPLIES_PAGE_SIZE', '5'))
+COMMENT_MAX_PAGE_SIZE = int(os.environ.get('COMMENT_MAX_PAGE_SIZE', '100'))
+COMMENT_MAX_DEPTH = int(os.environ.get('COMMENT_MAX_DEPTH', '6'))
+# GET /api/posts/batch/?ids=: max posts per request
+POST_BATCH_MAX_IDS = int(os.environ.get('POST_BATCH_MAX_IDS', '50'))
+# GET /api/comments/<id>/thread/: default levels below the comment and the row cap
+COMMENT_THREAD_DEPTH = int(os.environ.get('COMMENT_THREAD_DEPTH', '10'))
+COMMENT_THREAD_MAX_NODES = int(os.environ.get('COMMENT_THREAD_MAX_NODES', '500'))
+# Cached first page of each post's tree (api/tree_cache.py): lifetime, and how long readers
+# wait for a concurrent rebuild before building themselves. Other workers only see a new
+# comment once their copy expires with a per-process LocMemCache, so the lifetime is short there.
+COMMENT_TREE_CACHE_TTL = int(os.environ.get(
+    'COMMENT_TREE_CACHE_TTL', '2' if CACHES['default']['BACKEND'].endswith('LocMemCache') else '300'
+))
+COMMENT_TREE_CACHE_WAIT = float(os.environ.get('COMMENT_TREE_CACHE_WAIT', '2'))
+
+# Per-user liked-id cache (api/likes.py): seconds after loading before a user's entries expire.
+# Like POST_ETAGS it needs a cache every worker shares: off with the default LocMemCache.
+LIKED_IDS_CACHE = os.environ.get(
+    'LIKED_IDS_CACHE', str(not CACHES['default']['BACKEND'].endswith('LocMemCache'))
+) == 'True'
+LIKED_IDS_CACHE_TTL = int(os.environ.get('LIKED_IDS_CACHE_TTL', '3600'))
+
+# Karma ledger (api/karma.py): how many hours of hourly buckets to keep.
+# Must cover the longest leaderboard window (7d).
+KARMA_LEDGER_RETENTION_HOURS = int(os.environ.get('KARMA_LEDGER_RETENTION_HOURS', '168'))
+
+# Vote compaction (api/archive.py, `compact_votes`): votes older than this many days move to the
+# archive table (must exceed KARMA_LEDGER_RETENTION_HOURS), in batches of this many rows
+VOTE_ARCHIVE_AFTER_DAYS = int(os.environ.get('VOTE_ARCHIVE_AFTER_DAYS', '30'))
+VOTE_ARCHIVE_BATCH_SIZE = int(os.environ.get('VOTE_ARCHIVE_BATCH_SIZE', '5000'))
+
+# Leaderboard snapshots (api/leaderboard.py): refresh cadence, entries kept per window (the cap
+# for ?limit=), and whether each web process runs a background refresher thread
+LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', '30'))
+LEADERBOARD_SNAPSHOT_SIZE = int(os.environ.get('LEADERBOARD_SNAPSHOT_SIZE', '100'))
+LEADERBOARD_REFRESH_IN_PROCESS = os.environ.get('LEADERBOARD_REFRESH_IN_PROCESS', 'False') == 'True'
+
+# Request metrics (api/metrics.py) served at /api/metrics/. METRICS_DIR is where each worker
+# process of this host writes its totals so they can be summed across processes (empty: this process only);
+# METRICS_TOKEN is required as "Authorization: Bearer <token>" to read them; without one the
+# endpoint only answers with DEBUG on.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', '1'))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Request profiling (api/profiling.py), off unless PROFILE_DIR is set: staff requests with an
+# "X-Profile: 1" header and a PROFILE_SAMPLE_RATE fraction (0-1) of all requests are profiled
+# into PROFILE_DIR, which keeps the PROFILE_MAX_DUMPS newest. List them with `profile_dumps`.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_MAX_DUMPS = int(os.environ.get('PROFILE_MAX_DUMPS', '100'))
+
+# POST /api/vote/bulk/: max operations per request
+VOTE_BULK_MAX_OPERATIONS = int(os.environ.get('VOTE_BULK_MAX_OPERATIONS', '1000'))
+
+# API tokens (api/tokens.py): lifetime of a token from POST /api/auth/login/, and how long
+# token authentication caches a user between database lookups
+TOKEN_TTL_SECONDS = int(os.environ.get('TOKEN_TTL_SECONDS', '28800'))
+TOKEN_USER_CACHE_TTL = int(os.environ.get('TOKEN_USER_CACHE_TTL', '300'))
+
+# Full-text search (api/search.py, GET /api/search/): default page size, and how many results
+# deep pages may reach (?page_size= is capped by FEED_MAX_PAGE_SIZE)
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', '500'))
+
+# NDJSON export (api/export.py, /api/export/<kind>/ and `export_data`): rows read per query
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '2000'))
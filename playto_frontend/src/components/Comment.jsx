@@ -7,17 +7,29 @@ const Comment = ({ comment, currentUser, onReply }) => {
     const [replyContent, setReplyContent] = useState("");
     const [liked, setLiked] = useState(comment.user_has_liked);
     const [likesCount, setLikesCount] = useState(comment.likes_count);
+    const [replies, setReplies] = useState(comment.replies || []);
+    const [moreReplies, setMoreReplies] = useState(comment.more_replies || 0);
+    const [repliesNext, setRepliesNext] = useState(null);
+
+    const loadMoreReplies = async () => {
+        // The first page restarts from the top and replaces the replies embedded in the tree
+        try {
+            const res = await api.get(repliesNext || `comments/${comment.id}/replies/`);
+            const loaded = repliesNext ? [...replies, ...res.data.results] : res.data.results;
+            setReplies(loaded);
+            setRepliesNext(res.data.next);
+            setMoreReplies(res.data.has_more ? comment.reply_count - loaded.length : 0);
+        } catch (err) {
+            console.error("Failed to load replies", err);
+        }
+    };
 
     const handleLike = async () => {
         try {
-            const res = await api.post(`vote/comment/${comment.id}/`);
-            if (res.data.status === 'liked') {
-                setLiked(true);
-                setLikesCount(prev => prev + 1);
-            } else if (res.data.status === 'unliked') {
-                setLiked(false);
-                setLikesCount(prev => prev - 1);
-            }
+            const url = `vote/comment/${comment.id}/`;
+            const res = liked ? await api.delete(url) : await api.put(url);
+            setLiked(res.data.user_has_liked);
+            setLikesCount(res.data.likes_count);
         } catch (err) {
             console.error("Like failed", err);
         }
@@ -66,9 +78,14 @@ const Comment = ({ comment, currentUser, onReply }) => {
                 )}
             </div>
 
-            {comment.replies && comment.replies.map(reply => (
+            {replies.map(reply => (
                 <Comment key={reply.id} comment={reply} currentUser={currentUser} onReply={onReply} />
             ))}
+            {moreReplies > 0 && (
+                <button onClick={loadMoreReplies} className="mt-2 ml-4 text-xs text-blue-600 hover:underline">
+                    Load {moreReplies} more {moreReplies === 1 ? 'reply' : 'replies'}
+                </button>
+            )}
         </div>
     );
 };
@@ -5,12 +5,26 @@ import api from '../api';
 
 const Feed = ({ currentUser }) => {
     const [posts, setPosts] = useState([]);
+    const [nextPage, setNextPage] = useState(null);
     const [content, setContent] = useState("");
+    const [sort, setSort] = useState('new');
 
     const fetchPosts = async () => {
         try {
-            const res = await api.get('posts/');
-            setPosts(res.data);
+            const res = await api.get('posts/', { params: { sort } });
+            setPosts(res.data.results);
+            setNextPage(res.data.next);
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
+    const loadMore = async () => {
+        // The feed is cursor-paginated; `next` already carries the cursor for the following page
+        try {
+            const res = await api.get(nextPage);
+            setPosts(prev => [...prev, ...res.data.results]);
+            setNextPage(res.data.next);
         } catch (err) {
             console.error(err);
         }
@@ -18,7 +32,7 @@ const Feed = ({ currentUser }) => {
 
     useEffect(() => {
         fetchPosts();
-    }, [currentUser]); // Refresh if user toggles to see correct liked state
+    }, [currentUser, sort]); // Refresh if user toggles to see correct liked state
 
     const handleCreatePost = async (e) => {
         e.preventDefault();
@@ -32,12 +46,11 @@ const Feed = ({ currentUser }) => {
     };
 
     const handleLike = async (postId, liked) => {
-        // Optimistic update impossible easily without deep copy, better just refetch or careful state update
-        // Let's refetch for simplicity of prototype, or just toggle locally
+        // PUT likes, DELETE un-likes; both return the fresh count, so no refetch
         try {
-            const res = await api.post(`vote/post/${postId}/`);
-            // Simple re-fetch
-            fetchPosts();
+            const url = `vote/post/${postId}/`;
+            const res = liked ? await api.delete(url) : await api.put(url);
+            setPosts(prev => prev.map(p => p.id === postId ? { ...p, ...res.data } : p));
         } catch (err) {
             console.error(err);
         }
@@ -63,6 +76,13 @@ const Feed = ({ currentUser }) => {
                 </div>
             )}
 
+            <div className="flex justify-end">
+                <select className="text-sm border rounded p-1" value={sort} onChange={e => setSort(e.target.value)}>
+                    <option value="new">New</option>
+                    <option value="hot">Hot</option>
+                </select>
+            </div>
+
             <div className="space-y-4">
                 {posts.map(post => (
                     <div key={post.id} className="bg-white p-4 rounded-lg shadow-md hover:shadow-lg transition-shadow">
@@ -88,6 +108,12 @@ const Feed = ({ currentUser }) => {
                     </div>
                 ))}
             </div>
+
+            {nextPage && (
+                <div className="text-center">
+                    <button onClick={loadMore} className="px-4 py-2 bg-gray-200 rounded-lg hover:bg-gray-300">Load more</button>
+                </div>
+            )}
         </div>
     );
 };
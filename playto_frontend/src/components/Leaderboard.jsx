@@ -3,11 +3,12 @@ import api from '../api';
 
 const Leaderboard = () => {
     const [users, setUsers] = useState([]);
+    const [period, setPeriod] = useState('24h');
 
     useEffect(() => {
         const fetchLeaderboard = async () => {
             try {
-                const res = await api.get('leaderboard/');
+                const res = await api.get('leaderboard/', { params: { window: period } });
                 setUsers(res.data);
             } catch (err) {
                 console.error("Failed to fetch leaderboard", err);
@@ -17,11 +18,18 @@ const Leaderboard = () => {
         fetchLeaderboard();
         const interval = setInterval(fetchLeaderboard, 30000); // Refresh every 30s
         return () => clearInterval(interval);
-    }, []);
+    }, [period]);
 
     return (
         <div className="bg-white p-4 rounded-lg shadow-md w-full md:w-64">
-            <h3 className="font-bold text-lg mb-4 border-b pb-2">Top 5 (24h)</h3>
+            <div className="flex justify-between items-center mb-4 border-b pb-2">
+                <h3 className="font-bold text-lg">Top 5</h3>
+                <select className="text-sm border rounded p-1" value={period} onChange={e => setPeriod(e.target.value)}>
+                    <option value="1h">1h</option>
+                    <option value="24h">24h</option>
+                    <option value="7d">7d</option>
+                </select>
+            </div>
             <ul>
                 {users.length === 0 && <li className="text-gray-500 text-sm">No activity yet.</li>}
                 {users.map((user, index) => (
@@ -3,20 +3,17 @@ import { Link } from 'react-router-dom';
 import api from '../api';
 
 const Navbar = ({ currentUser, setCurrentUser }) => {
-    // Simple mock auth for prototype
-    const handleLogin = (username) => {
-        // In real app, this would be a POST /login
-        // Here we just set state. Ideally we fetch user ID from backend or create if not exists.
-        // For prototype simplicity, assuming users exist or we just use username.
-        // But API needs Authentication header (Token/Session).
-        // Let's assume Backend uses SessionAuthentication or Basic.
-        // I configured IsAuthenticatedOrReadOnly.
-        // I'll make a quick "login" endpoint or just Basic Auth header?
-        // Let's use Basic Auth for simplicity in this prototype.
+    // Log in once for a signed, expiring token and send it as a Bearer header: the server
+    // checks the password at login only, instead of hashing it on every request (Basic auth).
+    const handleLogin = async (username) => {
         const password = 'password'; // Mock password
-        const token = btoa(`${username}:${password}`);
-        api.defaults.headers.common['Authorization'] = `Basic ${token}`;
-        setCurrentUser(username);
+        try {
+            const { data } = await api.post('auth/login/', { username, password });
+            api.defaults.headers.common['Authorization'] = `Bearer ${data.token}`;
+            setCurrentUser(username);
+        } catch (err) {
+            console.error("Login failed", err);
+        }
     };
 
     return (
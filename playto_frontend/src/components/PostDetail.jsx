@@ -28,17 +28,29 @@ const PostDetail = ({ currentUser }) => {
 
     const handleLike = async () => {
         try {
-            const res = await api.post(`vote/post/${post.id}/`);
-            if (res.data.status === 'liked') {
-                setPost({ ...post, likes_count: post.likes_count + 1, user_has_liked: true });
-            } else if (res.data.status === 'unliked') {
-                setPost({ ...post, likes_count: post.likes_count - 1, user_has_liked: false });
-            }
+            const url = `vote/post/${post.id}/`;
+            const res = post.user_has_liked ? await api.delete(url) : await api.put(url);
+            setPost(prev => ({ ...prev, ...res.data }));
         } catch (err) {
             console.error("Like failed", err);
         }
     };
 
+    const loadMoreComments = async () => {
+        // Detail only carries the first page of threads; the rest is cursor-paged
+        try {
+            const res = await api.get(post.comments_next);
+            setPost({
+                ...post,
+                comments: [...post.comments, ...res.data.results],
+                comments_next: res.data.next,
+                has_more_comments: res.data.has_more,
+            });
+        } catch (err) {
+            console.error("Failed to load comments", err);
+        }
+    };
+
     const handleComment = async (parentId, content) => {
         try {
             await api.post('comments/', {
@@ -71,8 +83,7 @@ const PostDetail = ({ currentUser }) => {
                 </button>
                 <div className="flex items-center space-x-2">
                     <MessageSquare size={18} />
-                    <span>{post.comments ? post.comments.length : 0} Roots</span>
-                    {/* Note: comments.length only counts top-level roots here unless we flatten */}
+                    <span>{post.comment_count} Comments</span>
                 </div>
             </div>
 
@@ -97,6 +108,9 @@ const PostDetail = ({ currentUser }) => {
                         <Comment key={comment.id} comment={comment} currentUser={currentUser} onReply={handleComment} />
                     ))}
                 </div>
+                {post.has_more_comments && (
+                    <button onClick={loadMoreComments} className="mt-4 text-sm text-blue-600 hover:underline">Load more comments</button>
+                )}
             </div>
         </div>
     );